@@ -1,6 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
+from app.core.auth_utils import (
+    HashingBusyError,
+    create_access_token,
+    hash_password,
+    verify_password,
+)
 from app.db.database import get_db
 from app.db import crud
 from app.schemas.auth import RegisterRequest, LoginRequest
@@ -8,8 +15,16 @@ from app.schemas.auth import RegisterRequest, LoginRequest
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
+def _busy(exc: HashingBusyError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, please retry shortly",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @router.post("/register")
-def register(body: RegisterRequest, db: Session = Depends(get_db)):
+async def register(body: RegisterRequest, db: Session = Depends(get_db)):
     email = body.email.lower().strip()
     password = body.password
 
@@ -19,31 +34,51 @@ def register(body: RegisterRequest, db: Session = Depends(get_db)):
     if len(password) > 128:
         raise HTTPException(status_code=400, detail="Password too long (max 128 characters).")
 
-    existing = crud.get_user_auth_by_email(db, email)
+    existing = await run_in_threadpool(crud.get_user_auth_by_email, db, email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    user_id = crud.new_user_id()
-    crud.create_user(db, user_id)
+    try:
+        password_hash = await hash_password(password)
+    except HashingBusyError as exc:
+        raise _busy(exc)
 
-    password_hash = crud.hash_password(password)
-    crud.create_user_auth(db, user_id=user_id, email=email, password_hash=password_hash)
+    user_id = crud.new_user_id()
+    await run_in_threadpool(crud.create_user, db, user_id)
+    await run_in_threadpool(
+        crud.create_user_auth,
+        db,
+        user_id=user_id,
+        email=email,
+        password_hash=password_hash,
+    )
 
-    token = crud.create_access_token(user_id)
+    token = create_access_token(user_id)
     return {"access_token": token, "user_id": user_id}
 
 
 @router.post("/login")
-def login(body: LoginRequest, db: Session = Depends(get_db)):
+async def login(body: LoginRequest, db: Session = Depends(get_db)):
     email = body.email.lower().strip()
     password = body.password
 
-    user_auth = crud.get_user_auth_by_email(db, email)
+    user_auth = await run_in_threadpool(crud.get_user_auth_by_email, db, email)
     if not user_auth:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    if not crud.verify_password(password, user_auth.password_hash):
+    try:
+        valid, new_hash = await verify_password(password, user_auth.password_hash)
+    except HashingBusyError as exc:
+        raise _busy(exc)
+
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    token = crud.create_access_token(user_auth.user_id)
-    return {"access_token": token, "user_id": user_auth.user_id}
\ No newline at end of file
+    # Transparently upgrade hashes made with old CryptContext parameters
+    if new_hash:
+        await run_in_threadpool(
+            crud.update_password_hash, db, user_auth.user_id, new_hash
+        )
+
+    token = create_access_token(user_auth.user_id)
+    return {"access_token": token, "user_id": user_auth.user_id}
@@ -1,32 +1,50 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, UploadFile, File, Form
+from concurrent.futures.process import BrokenProcessPool
+
+import anyio
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from app.api.utils import ALLOWED_IMAGE_MIME_TYPES, MAX_IMAGE_SIZE_BYTES
+from app.api.utils import ALLOWED_IMAGE_MIME_TYPES, MAX_IMAGE_SIZE_BYTES, sse_event
 from app.core.config import settings
+from app.db.blob_store import blob_store
 from app.db.database import get_db
 from app.db import crud
 from app.schemas.chat import ChatStreamRequest, ChatTitleRequest
 from app.api.dependencies import get_current_user_id
 from app.services.openai_service import (
     SYSTEM_PROMPT,
-    image_bytes_to_base64,
+    CachedReplyStream,
+    SharedReplyStream,
+    UpstreamError,
+    image_data_url,
+    image_url_cache,
     stream_assistant_reply,
     stream_title_from_prompt,
     stream_vision_reply,
-    summarize_chat,
 )
+from app.services.archiver import message_archiver
+from app.services.context_builder import fit_context
+from app.services.image_pipeline import choose_detail, normalize_image
+from app.services.purger import session_purger
+from app.services.summarizer import summary_queue
+from app.services.titles import lookup_title, remember_title
+from app.services.usage_aggregator import usage_aggregator
 
 router = APIRouter(tags=["chat"])
 
-WINDOW_LIMIT = 8
+# Most recent messages considered for the context window
+CONTEXT_MAX_MESSAGES = 32
 SUMMARY_UPDATE_EVERY = 8
+# ...or sooner, once this many tokens arrived since the last summary
+SUMMARY_UPDATE_TOKENS = 4_000
 
-# ✅ Allowed models
+# ✅ Allowed models -> prompt token budget for the context window
 ALLOWED_MODELS = {
-    "gpt-4o-mini",
-    "gpt-4o",
-    "gpt-4.1",
+    "gpt-4o-mini": 8_000,
+    "gpt-4o": 8_000,
+    "gpt-4.1": 16_000,
 }
 DEFAULT_MODEL = "gpt-4o-mini"
 
@@ -37,43 +55,239 @@ def _resolve_model(model: str | None) -> str:
     return DEFAULT_MODEL
 
 
+def _save_turn(db: Session, user_id: str, session_id: str, **message):
+    """
+    Saves the user's message and loads the context in one threadpool hop,
+    then hands the pooled connection back: the request holds none while it
+    waits for upstream and streams the reply (the final write checks out a
+    fresh one).
+    """
+    try:
+        crud.add_message(db, user_id, session_id, role="user", **message)
+        return _load_context(db, user_id, session_id)
+    finally:
+        db.close()
+
+
+def _load_context(db: Session, user_id: str, session_id: str):
+    # Activity brings archived history back into the hot table
+    message_archiver.rehydrate(db, user_id, session_id)
+    summary = crud.get_summary(db, user_id, session_id)
+    recent = crud.get_recent_messages(
+        db,
+        user_id,
+        session_id,
+        limit=CONTEXT_MAX_MESSAGES,
+    )
+    return summary, recent
+
+
+def _cache_messages(openai_messages: list[dict], prompt: str) -> list[dict]:
+    """
+    What the completion cache keys a turn on: the context before the turn
+    plus the prompt as the client sent it. Earlier attempts at the same
+    prompt at the end of the history (the user message and any reply)
+    are left out, so a retry keys like the first attempt did.
+    """
+    asked = {"role": "user", "content": prompt}
+    history = openai_messages[:-1]
+    while history:
+        if history[-1] == asked:
+            history = history[:-1]
+        elif history[-1]["role"] == "assistant" and history[-2:-1] == [asked]:
+            history = history[:-2]
+        else:
+            break
+    return history + [asked]
+
+
+def _persist_reply(
+    db: Session,
+    user_id: str,
+    session_id: str,
+    model: str,
+    content: str,
+    usage: dict[str, int],
+    title_if_new: str,
+) -> tuple[bool, str | None]:
+    """
+    Writes everything a finished reply produces in one transaction.
+    Returns (summary due, assistant message id).
+    """
+    summary_due = False
+    message_id = None
+
+    with crud.unit_of_work(db):
+        if content.strip():
+            msg = crud.add_message(
+                db,
+                user_id=user_id,
+                session_id=session_id,
+                role="assistant",
+                content=content,
+            )
+            message_id = msg.id
+
+            crud.touch_session(
+                db,
+                user_id,
+                session_id,
+                title_if_new=title_if_new,
+            )
+
+            counters = crud.get_session_counters(db, user_id, session_id)
+            summary_due = bool(counters) and (
+                counters.assistant_count % SUMMARY_UPDATE_EVERY == 0
+                or counters.tokens_since_summary >= SUMMARY_UPDATE_TOKENS
+            )
+
+    usage_aggregator.add(
+        user_id,
+        model,
+        usage.get("prompt_tokens", 0),
+        usage.get("completion_tokens", 0),
+    )
+
+    return summary_due, message_id
+
+
+async def _finish_reply(
+    db: Session,
+    user_id: str,
+    session_id: str,
+    model: str,
+    assistant_full: str,
+    usage: dict[str, int],
+    title_if_new: str,
+) -> str | None:
+    # Shielded so a client disconnect can't cancel the writes half-way
+    with anyio.CancelScope(shield=True):
+        summary_due, message_id = await run_in_threadpool(
+            _persist_reply,
+            db,
+            user_id,
+            session_id,
+            model,
+            assistant_full,
+            usage,
+            title_if_new,
+        )
+
+    if summary_due:
+        summary_queue.enqueue(user_id, session_id)
+    return message_id
+
+
+def _wants_sse(request: Request) -> bool:
+    return "text/event-stream" in request.headers.get("accept", "")
+
+
+def _reply_response(
+    reply: SharedReplyStream | CachedReplyStream,
+    sse: bool,
+    db: Session,
+    user_id: str,
+    session_id: str,
+    model: str,
+    title_if_new: str,
+    headers: dict[str, str] | None = None,
+) -> StreamingResponse:
+    """
+    Streams the reply as plain text, or as SSE `token` / `usage` / `done`
+    events (`error` if upstream fails mid-stream), and persists it once
+    the stream ends (or the client leaves).
+    """
+
+    async def generator():
+        finished = False
+        try:
+            try:
+                async for frame in reply:
+                    yield sse_event("token", {"text": frame}) if sse else frame
+            except UpstreamError:
+                # Headers are already sent; end the stream and keep the partial reply
+                if sse:
+                    yield sse_event("error", {"detail": "Upstream request failed"})
+                return
+
+            finished = True
+            message_id = await _finish_reply(
+                db,
+                user_id,
+                session_id,
+                model,
+                reply.text,
+                reply.usage,
+                title_if_new=title_if_new,
+            )
+            if sse:
+                yield sse_event("usage", reply.usage)
+                yield sse_event("done", {"message_id": message_id})
+        finally:
+            if not finished:
+                await _finish_reply(
+                    db,
+                    user_id,
+                    session_id,
+                    model,
+                    reply.text,
+                    reply.usage,
+                    title_if_new=title_if_new,
+                )
+
+    if sse:
+        headers = {**(headers or {}), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamingResponse(generator(), media_type="text/event-stream", headers=headers)
+    return StreamingResponse(generator(), media_type="text/plain", headers=headers)
+
+
+def _load_image_url(m) -> str:
+    url = image_url_cache.get(m.id)
+    if url is None:
+        url = image_data_url(blob_store.get(m.image_sha256), m.image_mime)
+        image_url_cache.set(m.id, url)
+    return url
+
+
+def _owns_session(db: Session, user_id: str, session_id: str) -> bool:
+    try:
+        return crud.session_exists(db, user_id, session_id)
+    finally:
+        # A cache miss reads the DB; don't keep the connection while awaiting
+        db.close()
+
+
+async def _require_session(db: Session, user_id: str, session_id: str):
+    exists = await run_in_threadpool(_owns_session, db, user_id, session_id)
+    if not exists:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+
 # ------------------------------------------------------------------
 # TEXT CHAT
 # ------------------------------------------------------------------
 
 @router.post("/chat")
-def chat_stream(
+async def chat_stream(
     body: ChatStreamRequest,
+    request: Request,
     user_id: str = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    crud.ensure_user(db, user_id)
-
-    session = crud.get_session(db, user_id, body.session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    await _require_session(db, user_id, body.session_id)
 
     # Resolve model safely
     model = _resolve_model(body.model)
 
-    # 1️⃣ Save user message
-    crud.add_message(
+    # 1️⃣ Save user message, 2️⃣ build context
+    summary, recent = await run_in_threadpool(
+        _save_turn,
         db,
         user_id,
         body.session_id,
-        role="user",
         content=body.message,
     )
 
-    # 2️⃣ Build context
-    summary = crud.get_summary(db, user_id, body.session_id)
-    recent = crud.get_recent_messages(
-        db,
-        user_id,
-        body.session_id,
-        limit=WINDOW_LIMIT,
-    )
-
     openai_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
 
     if summary.strip():
@@ -84,71 +298,33 @@ def chat_stream(
             }
         )
 
+    recent = fit_context(
+        openai_messages,
+        recent,
+        model=model,
+        budget=ALLOWED_MODELS[model],
+    )
     for m in recent:
-        openai_messages.append({"role": m.role, "content": m.content})
+        openai_messages.append({"role": m.role, "content": m.content or "[image]"})
 
     # 3️⃣ Stream assistant reply
-    assistant_stream, usage = stream_assistant_reply(
+    reply = await stream_assistant_reply(
         openai_messages,
         model=model,
+        user_id=user_id,
+        cache_messages=_cache_messages(openai_messages, body.message),
     )
 
-    def generator():
-        assistant_full = ""
-        try:
-            for token in assistant_stream:
-                assistant_full += token
-                yield token
-        finally:
-            if assistant_full.strip():
-                crud.add_message(
-                    db,
-                    user_id,
-                    body.session_id,
-                    role="assistant",
-                    content=assistant_full,
-                )
-
-                crud.touch_session(
-                    db,
-                    user_id,
-                    body.session_id,
-                    title_if_new=body.message,
-                )
-
-                assistant_count = crud.count_assistant_messages(
-                    db,
-                    user_id,
-                    body.session_id,
-                )
-
-                if assistant_count % SUMMARY_UPDATE_EVERY == 0:
-                    prev = crud.get_summary(db, user_id, body.session_id)
-                    recent2 = crud.get_recent_messages(
-                        db,
-                        user_id,
-                        body.session_id,
-                        limit=WINDOW_LIMIT,
-                    )
-
-                    recent_text = "\n".join(
-                        f"{m.role}: {m.content}" for m in recent2
-                    )
-                    new_summary = summarize_chat(prev, recent_text)
-                    crud.set_summary(db, user_id, body.session_id, new_summary)
-
-            prompt_tokens = usage.get("prompt_tokens", 0)
-            completion_tokens = usage.get("completion_tokens", 0)
-            if prompt_tokens or completion_tokens:
-                crud.add_token_usage(
-                    db,
-                    user_id,
-                    model,
-                    prompt_tokens,
-                    completion_tokens,
-                )
-
-    return StreamingResponse(generator(), media_type="text/plain")
+    return _reply_response(
+        reply,
+        _wants_sse(request),
+        db,
+        user_id,
+        body.session_id,
+        model,
+        title_if_new=body.message,
+        headers={"X-Completion-Cache": "hit" if reply.cached else "miss"},
+    )
 
 
 # ------------------------------------------------------------------
@@ -156,7 +332,8 @@ def chat_stream(
 # ------------------------------------------------------------------
 
 @router.post("/chat/image")
-def chat_image_stream(
+async def chat_image_stream(
+    request: Request,
     session_id: str = Form(...),
     image: UploadFile = File(...),
     text: str | None = Form(None),
@@ -164,11 +341,7 @@ def chat_image_stream(
     user_id: str = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    crud.ensure_user(db, user_id)
-
-    session = crud.get_session(db, user_id, session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    await _require_session(db, user_id, session_id)
 
     model = _resolve_model(model)
 
@@ -178,31 +351,35 @@ def chat_image_stream(
             detail=f"Unsupported image type: {image.content_type}",
         )
 
-    image_bytes = image.file.read()
+    image_bytes = await image.read()
     if len(image_bytes) > MAX_IMAGE_SIZE_BYTES:
         raise HTTPException(
             status_code=400,
             detail="Image exceeds 5MB limit",
         )
 
-    # 1️⃣ Save user message
-    crud.add_message(
-        db,
-        user_id=user_id,
-        session_id=session_id,
-        role="user",
-        content=text,
-        image_bytes=image_bytes,
-        image_mime=image.content_type,
-    )
+    try:
+        normalized = await normalize_image(image_bytes, image.content_type)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    except BrokenProcessPool:
+        raise HTTPException(
+            status_code=503,
+            detail="Image processing failed, please retry",
+            headers={"Retry-After": "1"},
+        )
 
-    # 2️⃣ Build context
-    summary = crud.get_summary(db, user_id, session_id)
-    recent = crud.get_recent_messages(
+    # 1️⃣ Save user message, 2️⃣ build context
+    summary, recent = await run_in_threadpool(
+        _save_turn,
         db,
         user_id,
         session_id,
-        limit=WINDOW_LIMIT,
+        content=text,
+        image_bytes=normalized.data,
+        image_mime=normalized.mime,
+        image_width=normalized.width,
+        image_height=normalized.height,
     )
 
     openai_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
@@ -215,87 +392,49 @@ def chat_image_stream(
             }
         )
 
+    recent = fit_context(
+        openai_messages,
+        recent,
+        model=model,
+        budget=ALLOWED_MODELS[model],
+        with_images=True,
+    )
     for m in recent:
-        if m.image_bytes:
+        if m.image_sha256:
             blocks = []
             if m.content:
                 blocks.append({"type": "text", "text": m.content})
 
-            blocks.append(
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{m.image_mime};base64,{image_bytes_to_base64(m.image_bytes)}"
-                    },
-                }
-            )
+            image_ref = {"url": await run_in_threadpool(_load_image_url, m)}
+            if m.image_width and m.image_height:
+                image_ref["detail"] = choose_detail(m.image_width, m.image_height)
+
+            blocks.append({"type": "image_url", "image_url": image_ref})
             openai_messages.append({"role": m.role, "content": blocks})
         else:
             openai_messages.append({"role": m.role, "content": m.content})
 
     # 3️⃣ Stream assistant reply
-    vision_stream, usage = stream_vision_reply(
+    reply = await stream_vision_reply(
         openai_messages,
         model=model,
+        user_id=user_id,
     )
 
-    def generator():
-        assistant_full = ""
-        try:
-            for token in vision_stream:
-                assistant_full += token
-                yield token
-        finally:
-            if assistant_full.strip():
-                crud.add_message(
-                    db,
-                    user_id=user_id,
-                    session_id=session_id,
-                    role="assistant",
-                    content=assistant_full,
-                )
-
-                crud.touch_session(
-                    db,
-                    user_id,
-                    session_id,
-                    title_if_new=text or "Image message",
-                )
-
-                assistant_count = crud.count_assistant_messages(
-                    db,
-                    user_id,
-                    session_id,
-                )
-
-                if assistant_count % SUMMARY_UPDATE_EVERY == 0:
-                    prev = crud.get_summary(db, user_id, session_id)
-                    recent2 = crud.get_recent_messages(
-                        db,
-                        user_id,
-                        session_id,
-                        limit=WINDOW_LIMIT,
-                    )
-
-                    recent_text = "\n".join(
-                        f"{m.role}: {m.content or '[image]'}"
-                        for m in recent2
-                    )
-                    new_summary = summarize_chat(prev, recent_text)
-                    crud.set_summary(db, user_id, session_id, new_summary)
-
-            prompt_tokens = usage.get("prompt_tokens", 0)
-            completion_tokens = usage.get("completion_tokens", 0)
-            if prompt_tokens or completion_tokens:
-                crud.add_token_usage(
-                    db,
-                    user_id,
-                    model,
-                    prompt_tokens,
-                    completion_tokens,
-                )
-
-    return StreamingResponse(generator(), media_type="text/plain")
+    return _reply_response(
+        reply,
+        _wants_sse(request),
+        db,
+        user_id,
+        session_id,
+        model,
+        title_if_new=text or "Image message",
+        headers={
+            "X-Image-Bytes-Saved": str(normalized.bytes_saved),
+            "X-Image-Tokens-Saved": str(normalized.tokens_saved),
+            "X-Image-Detail": normalized.detail,
+        },
+    )
 
 
 # ------------------------------------------------------------------
@@ -303,38 +442,55 @@ def chat_image_stream(
 # ------------------------------------------------------------------
 
 @router.post("/chat/title")
-def chat_title_stream(
+async def chat_title_stream(
     body: ChatTitleRequest,
     user_id: str = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    crud.ensure_user(db, user_id)
-
-    session = crud.get_session(db, user_id, body.session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    await _require_session(db, user_id, body.session_id)
 
     prompt = body.prompt.strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
 
-    def generator():
-        title_full = ""
+    title, source = lookup_title(prompt)
+    headers = {"X-Title-Source": source}
+
+    if title is not None:
+        # Answered without the model: save it and send it as a single frame
+        await run_in_threadpool(
+            crud.update_session_title,
+            db,
+            user_id,
+            body.session_id,
+            title,
+        )
+        return StreamingResponse(iter([title]), media_type="text/plain", headers=headers)
+    reply = await stream_title_from_prompt(prompt, user_id=user_id)
+
+    async def generator():
+        completed = False
         try:
-            for token in stream_title_from_prompt(prompt):
-                title_full += token
-                yield token
+            async for frame in reply:
+                yield frame
+            completed = True
+        except UpstreamError:
+            pass
         finally:
-            cleaned = title_full.strip()
+            cleaned = reply.text.strip()
             if cleaned:
-                crud.update_session_title(
-                    db,
-                    user_id,
-                    body.session_id,
-                    cleaned,
-                )
+                if completed:
+                    remember_title(prompt, cleaned)
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(
+                        crud.update_session_title,
+                        db,
+                        user_id,
+                        body.session_id,
+                        cleaned,
+                    )
 
-    return StreamingResponse(generator(), media_type="text/plain")
+    return StreamingResponse(generator(), media_type="text/plain", headers=headers)
 
 
 @router.delete("/chat/session/{session_id}")
@@ -343,11 +499,10 @@ def delete_chat_session(
     user_id: str = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    crud.ensure_user(db, user_id)
-
-    session = crud.get_session(db, user_id, session_id)
-    if not session:
+    if not crud.session_exists(db, user_id, session_id):
         raise HTTPException(status_code=404, detail="Session not found")
 
     crud.delete_session(db, user_id, session_id)
+    # Messages are removed in the background; the session is already hidden
+    session_purger.wake()
     return {"status": "ok"}
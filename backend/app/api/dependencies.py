@@ -1,14 +1,24 @@
+import hmac
+
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
+from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.db.database import get_db
+from app.db import crud
 
 security = HTTPBearer()
 
 def get_current_user_id(
     credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db),
 ) -> str:
+    """
+    Resolves the user from the bearer token and makes sure the user row
+    exists (cached, so steady-state requests don't touch the DB).
+    """
     token = credentials.credentials
 
     try:
@@ -22,7 +32,20 @@ def get_current_user_id(
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        return user_id
-
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    crud.ensure_user_cached(db, user_id)
+    return user_id
+
+def require_metrics_token(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> None:
+    """
+    Guards the operator endpoints: service metrics span all users, so a
+    user's JWT isn't enough. Refused outright when METRICS_TOKEN is unset.
+    """
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics are disabled")
+    if not hmac.compare_digest(credentials.credentials.encode(), settings.METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
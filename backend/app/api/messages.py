@@ -0,0 +1,111 @@
+import re
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from app.api.dependencies import get_current_user_id
+from app.db.blob_store import blob_store
+from app.db.database import get_db
+from app.db import crud
+
+router = APIRouter(prefix="/messages", tags=["messages"])
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parses a single-range `Range` header into inclusive (start, end).
+    Returns None for unsupported forms (e.g. multi-range), which are
+    answered with the full body. Raises ValueError if unsatisfiable.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    start_s, end_s = match.groups()
+    if not start_s and not end_s:
+        return None
+
+    if not start_s:
+        # Suffix range: last N bytes
+        length = int(end_s)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - length, 0), size - 1
+
+    start = int(start_s)
+    end = int(end_s) if end_s else size - 1
+    if start >= size or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+def _iter_blob(digest: str, start: int, end: int):
+    with blob_store.open(digest) as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@router.get("/{message_id}/image")
+def get_message_image(
+    message_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    user_id: str = Depends(get_current_user_id),
+):
+    msg = crud.get_message(db, user_id, message_id)
+    if not msg or not msg.image_sha256:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    digest = msg.image_sha256
+    size = msg.image_size
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        # Content-addressed: the bytes behind this URL never change
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{size}"},
+            )
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _iter_blob(digest, start, end),
+                status_code=206,
+                media_type=msg.image_mime,
+                headers=headers,
+            )
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        _iter_blob(digest, 0, size - 1),
+        media_type=msg.image_mime,
+        headers=headers,
+    )
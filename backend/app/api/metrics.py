@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends
+
+from app.api.dependencies import require_metrics_token
+from app.core.auth_utils import hash_executor
+from app.db.identity_cache import identity_cache
+from app.db.session_cache import session_cache
+from app.services.archiver import message_archiver
+from app.services.openai_service import (
+    completion_cache,
+    image_url_cache,
+    single_flight_stats,
+)
+from app.services.purger import session_purger
+from app.services.scheduler import upstream_scheduler
+from app.services.summarizer import summary_queue
+from app.services.usage_aggregator import usage_aggregator
+from app.services.titles import title_stats
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    dependencies=[Depends(require_metrics_token)],
+)
+
+
+@router.get("/summarizer")
+def summarizer_metrics():
+    return summary_queue.stats()
+
+
+@router.get("/image-cache")
+def image_cache_metrics():
+    return image_url_cache.stats()
+
+
+@router.get("/completion-cache")
+def completion_cache_metrics():
+    return completion_cache.stats()
+
+
+@router.get("/single-flight")
+def single_flight_metrics():
+    return single_flight_stats()
+
+
+@router.get("/scheduler")
+def scheduler_metrics():
+    return upstream_scheduler.stats()
+
+
+@router.get("/usage")
+def usage_metrics():
+    return usage_aggregator.stats()
+
+
+@router.get("/session-cache")
+def session_cache_metrics():
+    return session_cache.stats()
+
+
+@router.get("/identity-cache")
+def identity_cache_metrics():
+    return identity_cache.stats()
+
+
+@router.get("/password-hashing")
+def password_hashing_metrics():
+    return hash_executor.stats()
+
+
+@router.get("/titles")
+def title_metrics():
+    return title_stats()
+
+
+@router.get("/purger")
+def purger_metrics():
+    return session_purger.stats()
+
+
+@router.get("/archiver")
+def archiver_metrics():
+    return message_archiver.stats()
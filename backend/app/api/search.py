@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.orm import Session
+
+from app.db.database import get_db
+from app.db import crud
+from app.api.dependencies import get_current_user_id
+from app.schemas.chat import SearchResultOut
+
+router = APIRouter(tags=["search"])
+
+
+@router.get("/search", response_model=list[SearchResultOut])
+def search_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10_000),
+    db: Session = Depends(get_db),
+    user_id: str = Depends(get_current_user_id),
+):
+    """
+    Ranked full-text search over the caller's messages. Matched terms in
+    `snippet` are wrapped in <mark>...</mark>. X-Next-Offset is set when
+    there are more results.
+    """
+    if not crud.search_terms(q):
+        raise HTTPException(status_code=400, detail="Query has no searchable terms")
+
+    rows = crud.search_messages(db, user_id, q, limit=limit + 1, offset=offset)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Offset"] = str(offset + limit)
+
+    return [
+        SearchResultOut(
+            message_id=message_id,
+            session_id=session_id,
+            session_title=title,
+            role=role,
+            snippet=snippet,
+            created_at=created_at,
+            rank=rank,
+        )
+        for message_id, session_id, title, role, snippet, created_at, rank in rows
+    ]
@@ -1,7 +1,10 @@
 import base64
-from fastapi import APIRouter, Depends, HTTPException
+import hashlib
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 
+from app.api.utils import decode_cursor, encode_cursor
+from app.db.blob_store import blob_store
 from app.db.database import get_db
 from app.db import crud
 from app.api.dependencies import get_current_user_id
@@ -11,12 +14,59 @@ router = APIRouter(prefix="/sessions", tags=["sessions"])
 
 @router.get("", response_model=list[SessionOut])
 def list_sessions(
+    response: Response,
+    before: str | None = None,
+    limit: int = Query(50, ge=1, le=200),
+    include_preview: bool = False,
+    if_none_match: str | None = Header(None),
     db: Session = Depends(get_db),
     user_id: str = Depends(get_current_user_id),
 ):
-    crud.ensure_user(db, user_id)
-    sessions = crud.list_sessions(db, user_id)
-    return [SessionOut(id=s.id, title=s.title) for s in sessions]
+    """
+    Keyset-paginated sessions, most recently active first. X-Next-Cursor
+    carries the `before=` cursor for the next (older) page.
+
+    The weak ETag comes from one index-only query (session count and
+    latest update), so an unchanged sidebar is revalidated with a 304
+    without reading any rows.
+    """
+    try:
+        before_key = decode_cursor(before) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    count, latest = crud.get_sessions_fingerprint(db, user_id)
+    fingerprint = f"{count}|{latest}|{before}|{limit}|{include_preview}"
+    etag = f'W/"{hashlib.sha1(fingerprint.encode()).hexdigest()[:20]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    # One extra row tells us whether another page exists
+    rows = crud.list_sessions(
+        db,
+        user_id,
+        limit=limit + 1,
+        before=before_key,
+        include_preview=include_preview,
+    )
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.updated_at, last.id)
+
+    return [
+        SessionOut(
+            id=s.id,
+            title=s.title,
+            message_count=s.message_count,
+            last_message_at=s.last_message_at,
+            last_message_preview=s.last_message_preview if include_preview else None,
+        )
+        for s in rows
+    ]
 
 @router.post("", response_model=SessionOut)
 def create_session(
@@ -24,33 +74,75 @@ def create_session(
     db: Session = Depends(get_db),
     user_id: str = Depends(get_current_user_id),
 ):
-    crud.ensure_user(db, user_id)
     s = crud.create_session(db, user_id, title=body.title or "New chat")
     return SessionOut(id=s.id, title=s.title)
 
 @router.get("/{session_id}/messages", response_model=list[MessageOut])
 def get_messages(
     session_id: str,
+    response: Response,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    inline_images: bool = False,
     db: Session = Depends(get_db),
     user_id: str = Depends(get_current_user_id),
 ):
-    crud.ensure_user(db, user_id)
+    """
+    Keyset-paginated history, oldest first. Without a cursor the latest
+    page is returned. X-Prev-Cursor / X-Next-Cursor carry the cursors for
+    older (`before=`) and newer (`after=`) pages when they exist.
+
+    Images are returned as `image_url` references; `inline_images=true`
+    keeps the legacy base64 payload.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
 
-    session = crud.get_session(db, user_id, session_id)
-    if not session:
+    try:
+        before_key = decode_cursor(before) if before else None
+        after_key = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not crud.session_exists(db, user_id, session_id):
         raise HTTPException(status_code=404, detail="Session not found")
 
-    msgs = crud.list_messages(db, user_id, session_id, limit=500)
+    # One extra row tells us whether another page exists
+    msgs = crud.list_messages(
+        db,
+        user_id,
+        session_id,
+        limit=limit + 1,
+        before=before_key,
+        after=after_key,
+    )
+    has_more = len(msgs) > limit
+    if after_key:
+        msgs = msgs[:limit]
+    else:
+        msgs = msgs[-limit:]
+
+    if msgs:
+        first, last = msgs[0], msgs[-1]
+        if after_key or has_more:
+            response.headers["X-Prev-Cursor"] = encode_cursor(first.created_at, first.id)
+        if before_key or (after_key and has_more):
+            response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
 
     def to_message_out(m):
+        image_url = None
         encoded = None
-        if m.image_bytes:
-            encoded = base64.b64encode(m.image_bytes).decode("utf-8")
+        if m.image_sha256:
+            image_url = f"/messages/{m.id}/image"
+            if inline_images:
+                encoded = base64.b64encode(blob_store.get(m.image_sha256)).decode("utf-8")
 
         return MessageOut(
             id=m.id,
             role=m.role,
             content=m.content,
+            image_url=image_url,
             image_base64=encoded,
             image_mime=m.image_mime,
         )
@@ -1,25 +1,114 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from app.db.database import get_db
 from app.api.dependencies import get_current_user_id
-from app.db import models
+from app.db import crud
+from app.services.usage_aggregator import usage_aggregator
 
 router = APIRouter(tags=["user"])
 
+# Default window and largest range per granularity
+DEFAULT_RANGE = {
+    "hour": timedelta(hours=24),
+    "day": timedelta(days=30),
+}
+MAX_BUCKETS = {
+    "hour": 24 * 31,
+    "day": 366 * 5,
+}
+
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _usage_range(
+    db: Session,
+    user_id: str,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+) -> dict:
+    width = crud.USAGE_GRANULARITIES[granularity]
+    start = datetime.fromtimestamp(
+        int(start.timestamp()) // width * width, tz=timezone.utc
+    )
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if (end - start).total_seconds() / width > MAX_BUCKETS[granularity]:
+        raise HTTPException(status_code=400, detail="Range too large for granularity")
+
+    with usage_aggregator.consistent_read():
+        rows = crud.get_token_usage_buckets(db, user_id, granularity, start, end)
+        pending = usage_aggregator.pending_buckets(user_id)
+
+    buckets: dict[datetime, dict[str, int]] = {}
+    for bucket_start, model, tokens in rows:
+        by_model = buckets.setdefault(_utc(bucket_start), {})
+        by_model[model] = by_model.get(model, 0) + tokens
+
+    # Unflushed deltas are kept per hour; fold them into the requested buckets
+    for (hour, model), tokens in pending.items():
+        bucket_start = datetime.fromtimestamp(hour - hour % width, tz=timezone.utc)
+        if start <= bucket_start < end:
+            by_model = buckets.setdefault(bucket_start, {})
+            by_model[model] = by_model.get(model, 0) + tokens
+
+    totals: dict[str, int] = {}
+    out = []
+    for bucket_start in sorted(buckets):
+        by_model = buckets[bucket_start]
+        for model, tokens in by_model.items():
+            totals[model] = totals.get(model, 0) + tokens
+        out.append(
+            {
+                "start": bucket_start.isoformat(),
+                "total": sum(by_model.values()),
+                "by_model": by_model,
+            }
+        )
+
+    return {
+        "granularity": granularity,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "total": sum(totals.values()),
+        "by_model": totals,
+        "buckets": out,
+    }
+
+
 @router.get("/me/tokens")
 def get_my_tokens(
+    from_: datetime | None = Query(None, alias="from"),
+    to: datetime | None = None,
+    granularity: str | None = Query(None, pattern="^(hour|day)$"),
     db: Session = Depends(get_db),
     user_id: str = Depends(get_current_user_id),
 ):
-    rows = (
-        db.query(models.UserTokenUsage)
-        .filter(models.UserTokenUsage.user_id == user_id)
-        .all()
-    )
+    """
+    Lifetime totals, or with from / to / granularity the usage in that
+    range, bucketed by UTC hour or day (empty buckets omitted).
+    """
+    if from_ is not None or to is not None or granularity is not None:
+        granularity = granularity or "day"
+        end = _utc(to) if to else datetime.now(timezone.utc)
+        start = _utc(from_) if from_ else end - DEFAULT_RANGE[granularity]
+        return _usage_range(db, user_id, granularity, start, end)
+
+    # Stored totals plus deltas still buffered for the next flush
+    with usage_aggregator.consistent_read():
+        by_model = crud.get_token_usage(db, user_id)
+        pending = usage_aggregator.pending(user_id)
+
+    for model, tokens in pending.items():
+        by_model[model] = by_model.get(model, 0) + tokens
 
     return {
-        "total": sum(r.total_tokens for r in rows),
-        "by_model": {
-            r.model: r.total_tokens for r in rows
-        },
-    }
\ No newline at end of file
+        "total": sum(by_model.values()),
+        "by_model": by_model,
+    }
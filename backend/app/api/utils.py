@@ -1,3 +1,7 @@
+import base64
+import json
+from datetime import datetime
+
 ALLOWED_IMAGE_MIME_TYPES = {
     "image/png",
     "image/jpeg",
@@ -5,3 +9,28 @@ ALLOWED_IMAGE_MIME_TYPES = {
 }
 
 MAX_IMAGE_SIZE_BYTES = 5 * 1024 * 1024  # 5MB
+
+
+
+def encode_cursor(created_at: datetime, row_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """
+    Raises ValueError for malformed cursors.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        ts, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(ts), row_id
+    except (UnicodeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def sse_event(event: str, data) -> str:
+    """
+    One Server-Sent Events frame with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -1,23 +1,130 @@
-from passlib.context import CryptContext
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
 from jose import jwt
-from datetime import datetime, timedelta
+from passlib.context import CryptContext
+
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pinning min/max to the configured rounds makes verify_and_update flag
+# every hash made with other parameters, so it is upgraded on next login.
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=settings.PBKDF2_ROUNDS,
+    pbkdf2_sha256__min_rounds=settings.PBKDF2_ROUNDS,
+    pbkdf2_sha256__max_rounds=settings.PBKDF2_ROUNDS,
+)
+
+
+class HashingBusyError(Exception):
+    """
+    Raised when the hashing pool's queue is full.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing is busy")
+        self.retry_after = retry_after
 
-def hash_password(password: str) -> str:
+
+# -------------------------
+# Worker-side functions
+# -------------------------
+
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
-def verify_password(password: str, password_hash: str) -> bool:
-    return pwd_context.verify(password, password_hash)
+
+def _verify_and_update(password: str, password_hash: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+# -------------------------
+# Bounded executor
+# -------------------------
+
+class _HashExecutor:
+    """
+    Dedicated process pool for password hashing with admission control:
+    at most `workers + queue_limit` jobs are in flight, the rest are
+    rejected with HashingBusyError instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, retry_after: int):
+        self.workers = max(workers, 1)
+        self.capacity = self.workers + max(queue_limit, 0)
+        self.retry_after = retry_after
+        self._pool: ProcessPoolExecutor | None = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise HashingBusyError(self.retry_after)
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_pool(), fn, *args)
+            self.completed += 1
+            return result
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+hash_executor = _HashExecutor(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    queue_limit=settings.PASSWORD_HASH_QUEUE_LIMIT,
+    retry_after=settings.PASSWORD_HASH_RETRY_AFTER,
+)
+
+
+async def hash_password(password: str) -> str:
+    return await hash_executor.run(_hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> tuple[bool, str | None]:
+    """
+    Returns (valid, new_hash). new_hash is set when the stored hash was
+    made with outdated parameters and should be replaced.
+    """
+    return await hash_executor.run(_verify_and_update, password, password_hash)
+
 
 def create_access_token(user_id: str) -> str:
+    """
+    Simple JWT (7 days).
+    """
+    now = datetime.now(timezone.utc)
     payload = {
         "sub": user_id,
-        "exp": datetime.utcnow() + timedelta(days=7),
+        "iat": int(now.timestamp()),
+        "exp": int((now + timedelta(days=7)).timestamp()),
     }
-    return jwt.encode(
-        payload,
-        settings.JWT_SECRET,
-        algorithm="HS256",
-    )
\ No newline at end of file
+    return jwt.encode(payload, settings.JWT_SECRET, algorithm="HS256")
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and/or total size, with
+    an optional per-entry TTL in seconds.
+
+    sizeof(value) gives the cost of an entry when max_bytes is set; values
+    bigger than the whole budget are never cached.
+    """
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] | None = None,
+        ttl: float | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof or (lambda _value: 0)
+        # key -> (value, size, expires_at)
+        self._data: OrderedDict[Hashable, tuple[Any, int, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        size = self._sizeof(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, size, expires_at)
+            self.bytes += size
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._remove(key)
+            return entry[0] if entry else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _expired(entry) -> bool:
+        expires_at = entry[2]
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def _remove(self, key: Hashable):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        return entry
+
+    def _evict(self):
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _key, (_value, size, _expires_at) = self._data.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
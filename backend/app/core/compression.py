@@ -0,0 +1,32 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+
+# Codec used for new data; anything stored keeps the name of its codec
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+
+def compress(data: bytes, codec: str = DEFAULT_CODEC) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed data requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown codec: {codec}")
@@ -11,9 +11,100 @@ class Settings:
     # Database
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./chat.db")
 
+    # SQLite storage profile: "tuned" (WAL), "durable" (WAL + full sync) or "default"
+    SQLITE_PROFILE: str = os.getenv("SQLITE_PROFILE", "tuned")
+
+    # Connection pool; DB work runs on the threadpool, so size for its concurrency
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+    # Image blob storage ("local" only for now)
+    BLOB_STORE_BACKEND: str = os.getenv("BLOB_STORE_BACKEND", "local")
+    BLOB_STORE_PATH: str = os.getenv("BLOB_STORE_PATH", "./blobs")
+
+    # Encoded data: URLs kept for images in the vision context window
+    IMAGE_URL_CACHE_MB: int = int(os.getenv("IMAGE_URL_CACHE_MB", "64"))
+
+    # Processes used to decode / resize uploaded images
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "2"))
+
+    # Per-session prompt context cache (summary + last N messages). Sees
+    # only this process's writes, so it defaults to off when WEB_CONCURRENCY
+    # asks for several workers; set 0 for any other multi-process setup
+    SESSION_CACHE_SESSIONS: int = int(
+        os.getenv(
+            "SESSION_CACHE_SESSIONS",
+            "1000" if int(os.getenv("WEB_CONCURRENCY", "1")) <= 1 else "0",
+        )
+    )
+    SESSION_CACHE_MESSAGES: int = int(os.getenv("SESSION_CACHE_MESSAGES", "32"))
+    SESSION_CACHE_MB: int = int(os.getenv("SESSION_CACHE_MB", "64"))
+
+    # Cached per-message token counts for context packing
+    TOKEN_COUNT_CACHE_ENTRIES: int = int(os.getenv("TOKEN_COUNT_CACHE_ENTRIES", "100000"))
+
+    # Known-user / session-ownership cache
+    IDENTITY_CACHE_ENTRIES: int = int(os.getenv("IDENTITY_CACHE_ENTRIES", "10000"))
+    IDENTITY_CACHE_TTL_SECONDS: float = float(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "60"))
+
+    # Generated chat titles keyed by normalized opening prompt
+    TITLE_CACHE_ENTRIES: int = int(os.getenv("TITLE_CACHE_ENTRIES", "10000"))
+    TITLE_CACHE_TTL_SECONDS: float = float(os.getenv("TITLE_CACHE_TTL_SECONDS", "86400"))
+
+    # Exact-match completion cache for text chat (off unless enabled)
+    COMPLETION_CACHE_ENABLED: bool = os.getenv("COMPLETION_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    COMPLETION_CACHE_MB: int = int(os.getenv("COMPLETION_CACHE_MB", "32"))
+    COMPLETION_CACHE_TTL_SECONDS: float = float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", "3600"))
+
+    # Upstream scheduler: concurrency caps, per-user token buckets
+    # (estimated tokens) and the usage scale for fair-queuing weights
+    SCHEDULER_MAX_CONCURRENCY: int = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "16"))
+    SCHEDULER_USER_CONCURRENCY: int = int(os.getenv("SCHEDULER_USER_CONCURRENCY", "3"))
+    USER_TOKEN_BUCKET_CAPACITY: int = int(os.getenv("USER_TOKEN_BUCKET_CAPACITY", "60000"))
+    USER_TOKEN_REFILL_PER_SECOND: float = float(os.getenv("USER_TOKEN_REFILL_PER_SECOND", "500"))
+    SCHEDULER_WEIGHT_SCALE: int = int(os.getenv("SCHEDULER_WEIGHT_SCALE", "100000"))
+    SCHEDULER_MAX_TRACKED_USERS: int = int(os.getenv("SCHEDULER_MAX_TRACKED_USERS", "10000"))
+
+    # Token usage is buffered in memory and upserted in batches; each batch
+    # is journaled to disk first so a crash can replay it on startup
+    USAGE_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "5"))
+    USAGE_JOURNAL_PATH: str = os.getenv("USAGE_JOURNAL_PATH", "./usage_journal")
+    USAGE_JOURNAL_FSYNC: bool = os.getenv("USAGE_JOURNAL_FSYNC", "false").lower() in ("1", "true", "yes")
+
+    # Hourly usage rollups older than this are compacted into daily ones
+    USAGE_HOURLY_RETENTION_DAYS: int = int(os.getenv("USAGE_HOURLY_RETENTION_DAYS", "14"))
+
+    # Deleted sessions are tombstoned and purged in the background in small
+    # batches; freed pages go back to the filesystem via incremental_vacuum
+    PURGE_BATCH_SIZE: int = int(os.getenv("PURGE_BATCH_SIZE", "200"))
+    PURGE_INTERVAL_SECONDS: float = float(os.getenv("PURGE_INTERVAL_SECONDS", "30"))
+    PURGE_PAUSE_SECONDS: float = float(os.getenv("PURGE_PAUSE_SECONDS", "0.05"))
+    VACUUM_PAGES_PER_STEP: int = int(os.getenv("VACUUM_PAGES_PER_STEP", "512"))
+    # Unreferenced image blobs younger than this are kept (a re-upload may be in flight)
+    PURGE_BLOB_GRACE_SECONDS: float = float(os.getenv("PURGE_BLOB_GRACE_SECONDS", "300"))
+
+    # Text messages of sessions idle this long move to the compressed
+    # archive table; a session is restored when it sees activity again
+    ARCHIVE_ENABLED: bool = os.getenv("ARCHIVE_ENABLED", "true").lower() in ("1", "true", "yes")
+    ARCHIVE_AFTER_DAYS: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+    ARCHIVE_INTERVAL_SECONDS: float = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+    ARCHIVE_BATCH_MESSAGES: int = int(os.getenv("ARCHIVE_BATCH_MESSAGES", "500"))
+
     # Auth / Security
     JWT_SECRET: str = os.getenv("JWT_SECRET")
 
+    # Bearer token for the operator-only /metrics endpoints (disabled if unset)
+    METRICS_TOKEN: str | None = os.getenv("METRICS_TOKEN") or None
+
+    # Background rolling-summary workers
+    SUMMARY_WORKERS: int = int(os.getenv("SUMMARY_WORKERS", "2"))
+
+    # Password hashing (dedicated process pool with a bounded queue)
+    PBKDF2_ROUNDS: int = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_QUEUE_LIMIT: int = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+    PASSWORD_HASH_RETRY_AFTER: int = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
+
     # Dev fallback (temporary)
     DEFAULT_USER_ID: str = os.getenv("DEFAULT_USER_ID", "local_user")
 
@@ -0,0 +1,50 @@
+import functools
+import logging
+import math
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Per-message framing overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+DEFAULT_ENCODING = "o200k_base"
+
+# Fallback when no tokenizer is available: ~4 characters per token
+_CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=16)
+def _encoding_for(model: str | None):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model or "")
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:
+        # e.g. the BPE file can't be downloaded on an offline host
+        logger.warning("tiktoken encoding unavailable, estimating token counts")
+        return None
+
+
+def count_tokens(text: str | None, model: str | None = None) -> int:
+    """
+    Counts tokens locally with the model's tiktoken encoding, falling back
+    to a character-based estimate.
+    """
+    if not text:
+        return 0
+    encoding = _encoding_for(model)
+    if encoding is None:
+        return math.ceil(len(text) / _CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(content: str | None, model: str | None = None) -> int:
+    return count_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from typing import BinaryIO
+
+from app.core.config import settings
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore(ABC):
+    """
+    Content-addressed blob storage. Blobs are keyed by their SHA-256 hex
+    digest, so storing the same bytes twice is a no-op.
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        ...
+
+    def get(self, digest: str) -> bytes:
+        with self.open(digest) as f:
+            return f.read()
+
+    @abstractmethod
+    def open(self, digest: str) -> BinaryIO:
+        ...
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, digest: str):
+        ...
+
+    @abstractmethod
+    def modified_at(self, digest: str) -> float | None:
+        """
+        Unix time the blob was last written (or re-put), None if missing.
+        """
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Stores blobs on the local filesystem as <root>/ab/cd/<digest>.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        if not _DIGEST_RE.match(digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data: bytes) -> str:
+        digest = sha256_hex(data)
+        path = self._path(digest)
+        if os.path.exists(path):
+            try:
+                # Re-put refreshes mtime so the purger's grace period applies
+                os.utime(path)
+                return digest
+            except FileNotFoundError:
+                pass  # purged just now; write it again
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temp file and rename so readers never see partial blobs
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return digest
+
+    def open(self, digest: str) -> BinaryIO:
+        return open(self._path(digest), "rb")
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def delete(self, digest: str):
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def modified_at(self, digest: str) -> float | None:
+        try:
+            return os.path.getmtime(self._path(digest))
+        except FileNotFoundError:
+            return None
+
+
+def create_blob_store() -> BlobStore:
+    backend = settings.BLOB_STORE_BACKEND
+    if backend == "local":
+        return LocalBlobStore(settings.BLOB_STORE_PATH)
+    raise ValueError(f"Unknown blob store backend: {backend}")
+
+
+blob_store = create_blob_store()
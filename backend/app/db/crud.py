@@ -1,18 +1,22 @@
+import json
+import re
 import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
+from typing import Callable
 
-from jose import jwt
-from passlib.context import CryptContext
-from sqlalchemy import desc
+from sqlalchemy import bindparam, desc, exists, func, insert, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
-from app.core.config import settings
+from app.core.compression import DEFAULT_CODEC, compress, decompress
+from app.core.tokens import count_message_tokens
 from app.db import models
-
-pwd_context = CryptContext(
-    schemes=["pbkdf2_sha256"],
-    deprecated="auto",
-)
+from app.db.blob_store import blob_store
+from app.db.identity_cache import identity_cache
+from app.db.migrate import SEARCH_TABLE, SESSION_PREVIEW_CHARS
+from app.db.session_cache import CachedMessage, session_cache
 
 
 # =====================================================
@@ -33,25 +37,61 @@ def new_user_id() -> str:
     return create_new_user_id()
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# =====================================================
+# Unit of work
+# =====================================================
 
+@contextmanager
+def unit_of_work(db: Session):
+    """
+    Batches crud writes into one transaction.
 
-def verify_password(password: str, password_hash: str) -> bool:
-    return pwd_context.verify(password, password_hash)
+    Inside the block crud functions flush instead of committing and skip
+    their post-commit refreshes; a single commit happens on exit, after
+    which cache write-through callbacks run. Nested blocks join the outer
+    one. On error everything is rolled back and no callbacks run.
+    """
+    if db.info.get("uow_active"):
+        yield db
+        return
+
+    db.info["uow_active"] = True
+    db.info["uow_after_commit"] = []
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    else:
+        callbacks = db.info["uow_after_commit"]
+        for callback in callbacks:
+            callback()
+    finally:
+        db.info.pop("uow_active", None)
+        db.info.pop("uow_after_commit", None)
 
 
-def create_access_token(user_id: str) -> str:
-    """
-    Simple JWT (7 days).
-    """
-    now = datetime.now(timezone.utc)
-    payload = {
-        "sub": user_id,
-        "iat": int(now.timestamp()),
-        "exp": int((now + timedelta(days=7)).timestamp()),
-    }
-    return jwt.encode(payload, settings.JWT_SECRET, algorithm="HS256")
+def _in_unit_of_work(db: Session) -> bool:
+    return bool(db.info.get("uow_active"))
+
+
+def _commit(db: Session, obj=None):
+    if _in_unit_of_work(db):
+        # Make pending rows visible to later queries in the same transaction
+        db.flush()
+        return
+
+    db.commit()
+    if obj is not None:
+        db.refresh(obj)
+
+
+def _after_commit(db: Session, callback: Callable[[], None]):
+    if _in_unit_of_work(db):
+        db.info["uow_after_commit"].append(callback)
+    else:
+        callback()
 
 
 # =====================================================
@@ -65,14 +105,24 @@ def ensure_user(db: Session, user_id: str):
         db.add(user)
         db.commit()
         db.refresh(user)
+    identity_cache.add_user(user_id)
     return user
 
 
+def ensure_user_cached(db: Session, user_id: str):
+    """
+    ensure_user, skipped entirely for users recently seen.
+    """
+    if not identity_cache.has_user(user_id):
+        ensure_user(db, user_id)
+
+
 def create_user(db: Session, user_id: str):
     user = models.User(id=user_id)
     db.add(user)
     db.commit()
     db.refresh(user)
+    identity_cache.add_user(user_id)
     return user
 
 
@@ -85,6 +135,13 @@ def get_user_by_email(db: Session, email: str):
     return get_user_auth_by_email(db, email)
 
 
+def update_password_hash(db: Session, user_id: str, password_hash: str):
+    db.query(models.UserAuth).filter(
+        models.UserAuth.user_id == user_id,
+    ).update({models.UserAuth.password_hash: password_hash}, synchronize_session=False)
+    db.commit()
+
+
 def create_user_auth(db: Session, user_id: str, email: str, password_hash: str):
     auth = models.UserAuth(
         user_id=user_id,
@@ -123,29 +180,96 @@ def create_session(db: Session, user_id: str, title: str = "New chat") -> models
     db.add(summary)
     db.commit()
 
+    identity_cache.add_session(user_id, session.id)
     return session
 
 
-def list_sessions(db: Session, user_id: str):
+def list_sessions(
+    db: Session,
+    user_id: str,
+    limit: int = 50,
+    before: tuple[datetime, str] | None = None,
+    include_preview: bool = False,
+):
+    """
+    One page of the user's sessions, most recently active first, as
+    column rows (no ORM objects). `before` is an (updated_at, id) keyset
+    cursor: only sessions strictly older than it are returned.
+    """
+    columns = [
+        models.ChatSession.id,
+        models.ChatSession.title,
+        models.ChatSession.updated_at,
+        models.ChatSession.message_count,
+        models.ChatSession.last_message_at,
+    ]
+    if include_preview:
+        columns.append(models.ChatSession.last_message_preview)
+
+    q = db.query(*columns).filter(
+        models.ChatSession.user_id == user_id,
+        models.ChatSession.deleted_at.is_(None),
+    )
+    if before is not None:
+        q = q.filter(
+            tuple_(models.ChatSession.updated_at, models.ChatSession.id) < before
+        )
+
     return (
-        db.query(models.ChatSession)
-        .filter(models.ChatSession.user_id == user_id)
-        .order_by(desc(models.ChatSession.updated_at))
+        q.order_by(desc(models.ChatSession.updated_at), desc(models.ChatSession.id))
+        .limit(limit)
         .all()
     )
 
 
+def get_sessions_fingerprint(db: Session, user_id: str) -> tuple[int, datetime | None]:
+    """
+    (session count, latest updated_at) for the user's live sessions,
+    answered from the (user_id, deleted_at, updated_at, id) index. Every
+    change the session list shows moves one of the two, so it works as an
+    ETag source.
+    """
+    count, latest = (
+        db.query(
+            func.count(models.ChatSession.id),
+            func.max(models.ChatSession.updated_at),
+        )
+        .filter(
+            models.ChatSession.user_id == user_id,
+            models.ChatSession.deleted_at.is_(None),
+        )
+        .one()
+    )
+    return count, latest
+
+
 def get_session(db: Session, user_id: str, session_id: str) -> models.ChatSession | None:
+    """
+    The user's session, unless it has been deleted.
+    """
     return (
         db.query(models.ChatSession)
         .filter(
             models.ChatSession.user_id == user_id,
             models.ChatSession.id == session_id,
+            models.ChatSession.deleted_at.is_(None),
         )
         .first()
     )
 
 
+def session_exists(db: Session, user_id: str, session_id: str) -> bool:
+    """
+    Ownership check backed by the identity cache.
+    """
+    if identity_cache.owns_session(user_id, session_id):
+        return True
+    if get_session(db, user_id, session_id) is None:
+        return False
+    identity_cache.add_session(user_id, session_id)
+    return True
+
+
 def touch_session(db: Session, user_id: str, session_id: str, title_if_new: str | None = None):
     session = get_session(db, user_id, session_id)
     if not session:
@@ -155,8 +279,7 @@ def touch_session(db: Session, user_id: str, session_id: str, title_if_new: str
         session.title = title_if_new[:80]
 
     session.updated_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(session)
+    _commit(db, session)
     return session
 
 
@@ -171,27 +294,134 @@ def update_session_title(db: Session, user_id: str, session_id: str, title: str)
 
     session.title = sanitized[:80]
     session.updated_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(session)
+    _commit(db, session)
     return session
 
 
-def delete_session(db: Session, user_id: str, session_id: str):
-    db.query(models.ChatMessage).filter(
-        models.ChatMessage.user_id == user_id,
-        models.ChatMessage.session_id == session_id,
-    ).delete(synchronize_session=False)
+def delete_session(db: Session, user_id: str, session_id: str) -> bool:
+    """
+    Tombstones the session: it disappears from every read at once, and
+    its messages, search rows and summary are purged later in small
+    batches by the session purger. Returns False if it was already gone.
+    """
+    deleted = (
+        db.query(models.ChatSession)
+        .filter(
+            models.ChatSession.user_id == user_id,
+            models.ChatSession.id == session_id,
+            models.ChatSession.deleted_at.is_(None),
+        )
+        .update(
+            {models.ChatSession.deleted_at: datetime.now(timezone.utc)},
+            synchronize_session=False,
+        )
+    )
+
+    # Forget ownership right away so new requests stop passing the check
+    identity_cache.forget_session(user_id, session_id)
+    _commit(db)
+    _after_commit(db, lambda: session_cache.invalidate(user_id, session_id))
+    return bool(deleted)
+
+
+def list_tombstoned_sessions(db: Session, limit: int = 100) -> list[str]:
+    """
+    Ids of deleted sessions still waiting to be purged, oldest first.
+    """
+    rows = (
+        db.query(models.ChatSession.id)
+        .filter(models.ChatSession.deleted_at.isnot(None))
+        .order_by(models.ChatSession.deleted_at)
+        .limit(limit)
+        .all()
+    )
+    return [row.id for row in rows]
+
+
+def purge_session_batch(db: Session, session_id: str, batch_size: int) -> tuple[int, bool]:
+    """
+    Deletes up to batch_size messages (and their search rows) of a
+    tombstoned session in one short transaction, then its archive batches
+    one at a time. Once none are left the summary and session rows go too.
+    Image digests the messages referenced are queued in
+    pending_blob_deletions in the same transaction.
+
+    Returns (messages deleted, finished).
+    """
+    rows = db.execute(
+        text(
+            "SELECT rowid, image_sha256, search_key FROM chat_messages "
+            "WHERE session_id = :session_id LIMIT :limit"
+        ),
+        {"session_id": session_id, "limit": batch_size},
+    ).all()
+
+    if rows:
+        rowids = [row[0] for row in rows]
+        _delete_search_rows(db, [row[2] for row in rows if row[2] is not None])
+        db.execute(
+            text("DELETE FROM chat_messages WHERE rowid IN :rowids").bindparams(
+                bindparam("rowids", expanding=True)
+            ),
+            {"rowids": rowids},
+        )
+        digests = sorted({row[1] for row in rows if row[1]})
+        if digests:
+            db.execute(
+                sqlite_insert(models.PendingBlobDeletion)
+                .values([{"digest": digest} for digest in digests])
+                .on_conflict_do_nothing()
+            )
+        db.commit()
+        return len(rows), False
+
+    # Then archived history, one batch per call
+    batch = (
+        db.query(models.ChatMessageArchive)
+        .filter(models.ChatMessageArchive.session_id == session_id)
+        .first()
+    )
+    if batch is not None:
+        keys = [m["search_key"] for m in _archive_payload(batch)]
+        _delete_search_rows(db, [key for key in keys if key is not None])
+        db.delete(batch)
+        db.commit()
+        return batch.message_count, False
 
     db.query(models.ChatSummary).filter(
-        models.ChatSummary.user_id == user_id,
         models.ChatSummary.session_id == session_id,
     ).delete(synchronize_session=False)
-
     db.query(models.ChatSession).filter(
-        models.ChatSession.user_id == user_id,
         models.ChatSession.id == session_id,
+        models.ChatSession.deleted_at.isnot(None),
     ).delete(synchronize_session=False)
+    db.commit()
+    return 0, True
+
+
+def blob_referenced(db: Session, digest: str) -> bool:
+    return (
+        db.query(models.ChatMessage.id)
+        .filter(models.ChatMessage.image_sha256 == digest)
+        .first()
+        is not None
+    )
+
 
+def list_pending_blob_deletions(db: Session, limit: int = 1000) -> list[str]:
+    rows = (
+        db.query(models.PendingBlobDeletion.digest)
+        .order_by(models.PendingBlobDeletion.queued_at)
+        .limit(limit)
+        .all()
+    )
+    return [row.digest for row in rows]
+
+
+def drop_pending_blob_deletion(db: Session, digest: str):
+    db.query(models.PendingBlobDeletion).filter(
+        models.PendingBlobDeletion.digest == digest,
+    ).delete(synchronize_session=False)
     db.commit()
 
 
@@ -199,6 +429,11 @@ def delete_session(db: Session, user_id: str, session_id: str):
 # Messages
 # =====================================================
 
+def _message_preview(content: str | None) -> str:
+    flat = " ".join((content or "").split())
+    return (flat or "[image]")[:SESSION_PREVIEW_CHARS]
+
+
 def add_message(
     db: Session,
     user_id: str,
@@ -207,23 +442,57 @@ def add_message(
     content: str | None = None,
     image_bytes: bytes | None = None,
     image_mime: str | None = None,
+    image_width: int | None = None,
+    image_height: int | None = None,
 ):
+    now = datetime.now(timezone.utc)
+    image_sha256 = None
+    image_size = None
+    if image_bytes:
+        image_sha256 = blob_store.put(image_bytes)
+        image_size = len(image_bytes)
+
     msg = models.ChatMessage(
         id=str(uuid.uuid4()),
         user_id=user_id,
         session_id=session_id,
         role=role,
         content=content,
-        image_bytes=image_bytes,
+        image_sha256=image_sha256,
+        image_size=image_size,
         image_mime=image_mime,
+        image_width=image_width,
+        image_height=image_height,
+        created_at=now,
     )
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
+
+    # Keep the session's denormalized counters in the same transaction
+    session_cols = models.ChatSession
+    db.query(models.ChatSession).filter(
+        models.ChatSession.user_id == user_id,
+        models.ChatSession.id == session_id,
+    ).update(
+        {
+            session_cols.message_count: session_cols.message_count + 1,
+            session_cols.assistant_count: session_cols.assistant_count
+            + (1 if role == "assistant" else 0),
+            session_cols.last_message_at: now,
+            session_cols.last_message_preview: _message_preview(content),
+            session_cols.updated_at: now,
+            session_cols.tokens_since_summary: session_cols.tokens_since_summary
+            + count_message_tokens(content),
+        },
+        synchronize_session=False,
+    )
+
+    snapshot = CachedMessage.from_row(msg)
+    _commit(db, msg)
+    _after_commit(db, lambda: session_cache.append_message(user_id, session_id, snapshot))
     return msg
 
 
-def get_recent_messages(db: Session, user_id: str, session_id: str, limit: int):
+def _query_recent_messages(db: Session, user_id: str, session_id: str, limit: int):
     rows = (
         db.query(models.ChatMessage)
         .filter(
@@ -237,36 +506,497 @@ def get_recent_messages(db: Session, user_id: str, session_id: str, limit: int):
     return list(reversed(rows))
 
 
-def list_messages(db: Session, user_id: str, session_id: str, limit: int = 200):
+def get_recent_messages(db: Session, user_id: str, session_id: str, limit: int):
+    """
+    Latest `limit` messages, oldest first. Served from the session context
+    cache when possible; a miss loads the whole ring buffer.
+    """
+    ctx = session_cache.get(user_id, session_id)
+    if ctx is not None:
+        recent = ctx.recent(limit)
+        if recent is not None:
+            return recent
+
+    if not session_cache.enabled or limit > session_cache.capacity or _in_unit_of_work(db):
+        return _query_recent_messages(db, user_id, session_id, limit)
+
+    generation = session_cache.begin_load(user_id, session_id)
+    try:
+        # Read from a snapshot taken after begin_load(): one opened earlier
+        # (rehydrate, get_summary) may predate a write it can't detect
+        if db.in_transaction():
+            db.commit()
+        summary = _query_summary(db, user_id, session_id)
+        rows = _query_recent_messages(db, user_id, session_id, session_cache.capacity)
+        session_cache.install(user_id, session_id, summary, rows, generation)
+    finally:
+        session_cache.end_load(user_id, session_id)
+    return rows[-limit:]
+
+
+def list_messages(
+    db: Session,
+    user_id: str,
+    session_id: str,
+    limit: int = 200,
+    before: tuple[datetime, str] | None = None,
+    after: tuple[datetime, str] | None = None,
+):
+    """
+    Keyset page of messages ordered by (created_at, id), oldest first.
+
+    before/after are (created_at, id) cursors. Without a cursor the most
+    recent `limit` messages are returned. Archived messages are read
+    through and merged in (as CachedMessage rows).
+    """
+    created_at = models.ChatMessage.created_at
+    message_id = models.ChatMessage.id
+
+    q = db.query(models.ChatMessage).filter(
+        models.ChatMessage.user_id == user_id,
+        models.ChatMessage.session_id == session_id,
+    )
+
+    if after is not None:
+        ts, cursor_id = after
+        rows = (
+            q.filter(tuple_(created_at, message_id) > tuple_(ts, cursor_id))
+            .order_by(created_at, message_id)
+            .limit(limit)
+            .all()
+        )
+    else:
+        if before is not None:
+            ts, cursor_id = before
+            q = q.filter(tuple_(created_at, message_id) < tuple_(ts, cursor_id))
+        rows = list(reversed(q.order_by(desc(created_at), desc(message_id)).limit(limit).all()))
+
+    archived = _archived_messages(db, user_id, session_id, limit, before, after)
+    if not archived:
+        return rows
+
+    merged = sorted(rows + archived, key=lambda m: (m.created_at, m.id))
+    return merged[:limit] if after is not None else merged[-limit:]
+
+
+def get_message(db: Session, user_id: str, message_id: str) -> models.ChatMessage | None:
     return (
         db.query(models.ChatMessage)
+        .join(models.ChatSession, models.ChatSession.id == models.ChatMessage.session_id)
         .filter(
             models.ChatMessage.user_id == user_id,
-            models.ChatMessage.session_id == session_id,
+            models.ChatMessage.id == message_id,
+            models.ChatSession.deleted_at.is_(None),
         )
-        .order_by(models.ChatMessage.created_at)
+        .first()
+    )
+
+
+def get_session_counters(db: Session, user_id: str, session_id: str):
+    """
+    (message_count, assistant_count, last_message_at, tokens_since_summary)
+    read straight from the row, bypassing any stale ORM instance.
+    """
+    return (
+        db.query(
+            models.ChatSession.message_count,
+            models.ChatSession.assistant_count,
+            models.ChatSession.last_message_at,
+            models.ChatSession.tokens_since_summary,
+        )
+        .filter(
+            models.ChatSession.user_id == user_id,
+            models.ChatSession.id == session_id,
+        )
+        .first()
+    )
+
+
+def count_assistant_messages(db: Session, user_id: str, session_id: str) -> int:
+    counters = get_session_counters(db, user_id, session_id)
+    return counters.assistant_count if counters else 0
+
+
+# =====================================================
+# Search
+# =====================================================
+
+# Wrapped around matched terms in snippets
+SEARCH_HIGHLIGHT = ("<mark>", "</mark>")
+
+# Characters kept either side of the first match in LIKE-fallback snippets
+SEARCH_SNIPPET_CONTEXT = 60
+
+_SEARCH_TERM_RE = re.compile(r"\w+")
+
+# Whether the FTS5 table exists; looked up once
+_search_index: bool | None = None
+
+
+def _search_enabled(db: Session) -> bool:
+    global _search_index
+    if _search_index is None:
+        _search_index = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": SEARCH_TABLE},
+        ).first() is not None
+    return _search_index
+
+
+def search_terms(query: str) -> list[str]:
+    return _SEARCH_TERM_RE.findall(query)
+
+
+def _fts_query(user_id: str, terms: list[str]) -> str:
+    # Every word must match; the last one as a prefix (search-as-you-type)
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    owner = user_id.replace('"', '""')
+    return f'user_id : "{owner}" AND content : ({" ".join(quoted)})'
+
+
+def _like_snippet(content: str, terms: list[str]) -> str:
+    lowered = content.lower()
+    hits = [lowered.find(term.lower()) for term in terms]
+    first = min((i for i in hits if i >= 0), default=0)
+
+    start = max(first - SEARCH_SNIPPET_CONTEXT, 0)
+    end = min(first + SEARCH_SNIPPET_CONTEXT, len(content))
+    snippet = content[start:end]
+
+    pattern = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE)
+    snippet = pattern.sub(lambda m: f"{SEARCH_HIGHLIGHT[0]}{m.group(0)}{SEARCH_HIGHLIGHT[1]}", snippet)
+    return ("…" if start else "") + snippet + ("…" if end < len(content) else "")
+
+
+def search_messages(
+    db: Session,
+    user_id: str,
+    query: str,
+    limit: int = 20,
+    offset: int = 0,
+) -> list:
+    """
+    Full-text search over the user's messages, best match first.
+    Rows: (message_id, session_id, session_title, role, snippet,
+    created_at, rank). Without FTS5, falls back to LIKE (newest first,
+    rank None).
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    if _search_enabled(db):
+        return db.execute(
+            text(
+                f"""
+                SELECT f.message_id, f.session_id, s.title, f.role,
+                       snippet({SEARCH_TABLE}, 0, :open, :close, '…', 16),
+                       f.created_at, bm25({SEARCH_TABLE}, 1.0, 0.0) AS rank
+                FROM {SEARCH_TABLE} f
+                JOIN chat_sessions s ON s.id = f.session_id AND s.user_id = f.user_id
+                    AND s.deleted_at IS NULL
+                -- MATCH narrows by user_id tokens; the equality makes it exact
+                WHERE {SEARCH_TABLE} MATCH :query AND f.user_id = :user_id
+                ORDER BY rank
+                LIMIT :limit OFFSET :offset
+                """
+            ),
+            {
+                "query": _fts_query(user_id, terms),
+                "user_id": user_id,
+                "open": SEARCH_HIGHLIGHT[0],
+                "close": SEARCH_HIGHLIGHT[1],
+                "limit": limit,
+                "offset": offset,
+            },
+        ).all()
+
+    q = (
+        db.query(
+            models.ChatMessage.id,
+            models.ChatMessage.session_id,
+            models.ChatSession.title,
+            models.ChatMessage.role,
+            models.ChatMessage.content,
+            models.ChatMessage.created_at,
+        )
+        .join(models.ChatSession, models.ChatSession.id == models.ChatMessage.session_id)
+        .filter(
+            models.ChatMessage.user_id == user_id,
+            models.ChatSession.deleted_at.is_(None),
+        )
+    )
+    for term in terms:
+        q = q.filter(models.ChatMessage.content.ilike(f"%{term}%"))
+
+    rows = (
+        q.order_by(desc(models.ChatMessage.created_at), desc(models.ChatMessage.id))
         .limit(limit)
+        .offset(offset)
         .all()
     )
+    return [
+        (m_id, s_id, title, role, _like_snippet(content, terms), created_at, None)
+        for m_id, s_id, title, role, content, created_at in rows
+    ]
 
 
-def count_assistant_messages(db: Session, user_id: str, session_id: str) -> int:
+# =====================================================
+# Archive (cold tier)
+# =====================================================
+
+def _archive_payload(batch: models.ChatMessageArchive) -> list[dict]:
+    return json.loads(decompress(batch.payload, batch.codec))
+
+
+def _cursor_key(cursor: tuple[datetime, str]) -> tuple[datetime, str]:
+    # Stored timestamps are naive UTC; compare cursors the same way
+    ts, cursor_id = cursor
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts, cursor_id
+
+
+def _archived_messages(
+    db: Session,
+    user_id: str,
+    session_id: str,
+    limit: int,
+    before: tuple[datetime, str] | None = None,
+    after: tuple[datetime, str] | None = None,
+) -> list[CachedMessage]:
+    """
+    Up to `limit` archived messages on the cursor's side (or the latest
+    ones), oldest first. Batches don't overlap in time, so only the ones
+    next to the cursor are decompressed.
+    """
+    archive = models.ChatMessageArchive
+    q = db.query(archive.id).filter(
+        archive.session_id == session_id,
+        archive.user_id == user_id,
+    )
+    if after is not None:
+        after = _cursor_key(after)
+        q = q.filter(archive.last_created_at >= after[0]).order_by(archive.last_created_at, archive.id)
+    else:
+        if before is not None:
+            before = _cursor_key(before)
+            q = q.filter(archive.first_created_at <= before[0])
+        q = q.order_by(desc(archive.last_created_at), desc(archive.id))
+
+    out: list[CachedMessage] = []
+    for (batch_id,) in q.all():
+        batch = db.get(archive, batch_id)
+        page = []
+        for m in _archive_payload(batch):
+            key = (datetime.fromisoformat(m["created_at"]), m["id"])
+            if (after is not None and key <= after) or (before is not None and key >= before):
+                continue
+            page.append(
+                CachedMessage(
+                    id=m["id"],
+                    role=m["role"],
+                    content=m["content"],
+                    image_sha256=None,
+                    image_mime=None,
+                    image_width=None,
+                    image_height=None,
+                    created_at=key[0],
+                )
+            )
+        out = out + page if after is not None else page + out
+        if len(out) >= limit:
+            break
+
+    return out[:limit] if after is not None else out[-limit:]
+
+
+def _delete_search_rows(db: Session, keys: list[int]):
+    if keys and _search_enabled(db):
+        db.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN :keys").bindparams(
+                bindparam("keys", expanding=True)
+            ),
+            {"keys": keys},
+        )
+
+
+def list_idle_sessions(db: Session, idle_before: datetime, limit: int = 100) -> list:
+    """
+    (id, user_id) of live sessions untouched since idle_before that still
+    have text messages in the hot table older than that.
+    """
+    m = models.ChatMessage
+    s = models.ChatSession
     return (
-        db.query(models.ChatMessage)
+        db.query(s.id, s.user_id)
         .filter(
-            models.ChatMessage.user_id == user_id,
-            models.ChatMessage.session_id == session_id,
-            models.ChatMessage.role == "assistant",
+            s.deleted_at.is_(None),
+            s.updated_at < idle_before,
+            exists().where(
+                m.session_id == s.id,
+                m.image_sha256.is_(None),
+                m.created_at < idle_before,
+            ),
+        )
+        .limit(limit)
+        .all()
+    )
+
+
+def archive_session_batch(
+    db: Session,
+    user_id: str,
+    session_id: str,
+    idle_before: datetime,
+    batch_size: int,
+    codec: str = DEFAULT_CODEC,
+) -> tuple[int, int, int]:
+    """
+    Moves the session's oldest text messages (up to batch_size, created
+    before idle_before) into one compressed archive row, in one short
+    transaction. Messages with images stay hot so their image URLs keep
+    resolving. Does nothing once the session is active again.
+
+    Their search rows stay as they are: the payload keeps each message's
+    search_key, so search still finds archived history and rehydration
+    or purging can address the rows later.
+
+    Returns (messages moved, raw bytes, compressed bytes).
+    """
+    m = models.ChatMessage
+    rows = (
+        db.query(
+            m.search_key,
+            m.id,
+            m.role,
+            m.content,
+            m.created_at,
+        )
+        .join(models.ChatSession, models.ChatSession.id == m.session_id)
+        .filter(
+            m.user_id == user_id,
+            m.session_id == session_id,
+            m.image_sha256.is_(None),
+            m.created_at < idle_before,
+            models.ChatSession.updated_at < idle_before,
+            models.ChatSession.deleted_at.is_(None),
+        )
+        .order_by(m.created_at, m.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not rows:
+        return 0, 0, 0
+
+    raw = json.dumps(
+        [
+            {
+                "search_key": search_key,
+                "id": message_id,
+                "role": role,
+                "content": content,
+                "created_at": created_at.isoformat(),
+            }
+            for search_key, message_id, role, content, created_at in rows
+        ],
+        separators=(",", ":"),
+    ).encode("utf-8")
+    payload = compress(raw, codec)
+
+    db.add(
+        models.ChatMessageArchive(
+            session_id=session_id,
+            user_id=user_id,
+            codec=codec,
+            message_count=len(rows),
+            first_created_at=rows[0].created_at,
+            last_created_at=rows[-1].created_at,
+            raw_size=len(raw),
+            payload=payload,
+        )
+    )
+
+    db.execute(
+        text("DELETE FROM chat_messages WHERE id IN :ids").bindparams(
+            bindparam("ids", expanding=True)
+        ),
+        {"ids": [row.id for row in rows]},
+    )
+    db.commit()
+
+    session_cache.invalidate(user_id, session_id)
+    return len(rows), len(raw), len(payload)
+
+
+def rehydrate_session(db: Session, user_id: str, session_id: str) -> int:
+    """
+    Moves a session's archived messages back into chat_messages with
+    their search_key, so their search rows stay valid. Returns the number
+    restored; a session with no archive costs one index probe.
+    """
+    batches = (
+        db.query(models.ChatMessageArchive)
+        .filter(
+            models.ChatMessageArchive.session_id == session_id,
+            models.ChatMessageArchive.user_id == user_id,
         )
-        .count()
+        .order_by(models.ChatMessageArchive.last_created_at, models.ChatMessageArchive.id)
+        .all()
     )
+    if not batches:
+        return 0
+
+    restored = 0
+    for batch in batches:
+        messages = _archive_payload(batch)
+        db.execute(
+            insert(models.ChatMessage),
+            [
+                {
+                    "id": msg["id"],
+                    "session_id": session_id,
+                    "user_id": user_id,
+                    "role": msg["role"],
+                    "content": msg["content"],
+                    "created_at": datetime.fromisoformat(msg["created_at"]),
+                    "search_key": msg["search_key"],
+                }
+                for msg in messages
+            ],
+        )
+        db.delete(batch)
+        restored += len(messages)
+
+    _commit(db)
+    _after_commit(db, lambda: session_cache.invalidate(user_id, session_id))
+    return restored
+
+
+def get_table_size(db: Session, table: str) -> int | None:
+    """
+    Bytes used by a table and its indexes, or None without the dbstat
+    virtual table. Reads every page of the table: for reporting only.
+    """
+    try:
+        return db.execute(
+            text(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat "
+                "WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = :table)"
+            ),
+            {"table": table},
+        ).scalar()
+    except OperationalError:
+        db.rollback()
+        return None
 
 
 # =====================================================
 # Summary (memory)
 # =====================================================
 
-def get_summary(db: Session, user_id: str, session_id: str) -> str:
+def _query_summary(db: Session, user_id: str, session_id: str) -> str:
     row = (
         db.query(models.ChatSummary)
         .filter(
@@ -278,6 +1008,13 @@ def get_summary(db: Session, user_id: str, session_id: str) -> str:
     return row.summary if row else ""
 
 
+def get_summary(db: Session, user_id: str, session_id: str) -> str:
+    ctx = session_cache.get(user_id, session_id)
+    if ctx is not None:
+        return ctx.summary
+    return _query_summary(db, user_id, session_id)
+
+
 def set_summary(db: Session, user_id: str, session_id: str, summary: str):
     row = (
         db.query(models.ChatSummary)
@@ -300,43 +1037,182 @@ def set_summary(db: Session, user_id: str, session_id: str, summary: str):
         row.summary = summary
         row.updated_at = datetime.now(timezone.utc)
 
-    db.commit()
+    db.query(models.ChatSession).filter(
+        models.ChatSession.user_id == user_id,
+        models.ChatSession.id == session_id,
+    ).update({models.ChatSession.tokens_since_summary: 0}, synchronize_session=False)
+
+    _commit(db)
+    _after_commit(db, lambda: session_cache.set_summary(user_id, session_id, summary))
 
 
 # =====================================================
 # Token usage
 # =====================================================
 
-def add_token_usage(
+# Statement size per upsert; keeps bound parameters under SQLite's limit
+USAGE_UPSERT_CHUNK = 500
+
+# Applied-batch ids are kept this long for journal replay
+USAGE_FLUSH_RETENTION = timedelta(days=30)
+
+USAGE_ROLLUPS = {
+    "hour": models.UserTokenUsageHourly,
+    "day": models.UserTokenUsageDaily,
+}
+
+
+USAGE_COUNTERS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+# Rollup granularities -> bucket width in seconds
+USAGE_GRANULARITIES = {
+    "hour": 3600,
+    "day": 86400,
+}
+
+
+def _usage_bucket(ts: int, granularity: str) -> datetime:
+    width = USAGE_GRANULARITIES[granularity]
+    return datetime.fromtimestamp(ts - ts % width, tz=timezone.utc)
+
+
+def _upsert_usage(db: Session, table, key_columns: list, rows: list[dict], **extra_set):
+    """
+    Adds the counter columns of rows onto existing ones (or inserts them),
+    USAGE_UPSERT_CHUNK rows per statement.
+    """
+    for start in range(0, len(rows), USAGE_UPSERT_CHUNK):
+        stmt = sqlite_insert(table).values(rows[start:start + USAGE_UPSERT_CHUNK])
+        set_ = {
+            name: getattr(table, name) + getattr(stmt.excluded, name)
+            for name in USAGE_COUNTERS
+        }
+        set_.update(extra_set)
+        stmt = stmt.on_conflict_do_update(index_elements=key_columns, set_=set_)
+        db.execute(stmt)
+
+
+def apply_token_usage_batch(
     db: Session,
-    user_id: str,
-    model: str,
-    prompt_tokens: int,
-    completion_tokens: int,
-):
-    total = max(prompt_tokens, 0) + max(completion_tokens, 0)
+    batch_id: str,
+    deltas: dict[tuple[str, str, int], tuple[int, int]],
+) -> bool:
+    """
+    Adds (user_id, model, unix time) -> (prompt, completion) deltas to the
+    lifetime totals and the hourly / daily rollups, with batched
+    INSERT ... ON CONFLICT DO UPDATE, exactly once per batch_id.
+    Returns False when the batch was already applied.
+    """
+    if db.get(models.UsageFlush, batch_id) is not None:
+        return False
+
+    lifetime: dict[tuple, list[int]] = {}
+    buckets: dict[str, dict[tuple, list[int]]] = {g: {} for g in USAGE_GRANULARITIES}
+
+    for (user_id, model, ts), (prompt_tokens, completion_tokens) in deltas.items():
+        targets = [lifetime.setdefault((user_id, model), [0, 0])]
+        for granularity, rollup in buckets.items():
+            key = (user_id, _usage_bucket(ts, granularity), model)
+            targets.append(rollup.setdefault(key, [0, 0]))
+        for counters in targets:
+            counters[0] += prompt_tokens
+            counters[1] += completion_tokens
+
+    def counters(p: int, c: int) -> dict:
+        return {"prompt_tokens": p, "completion_tokens": c, "total_tokens": p + c}
+
+    usage = models.UserTokenUsage
+    _upsert_usage(
+        db,
+        usage,
+        [usage.user_id, usage.model],
+        [
+            {"user_id": user_id, "model": model, **counters(p, c)}
+            for (user_id, model), (p, c) in lifetime.items()
+        ],
+        updated_at=func.now(),
+    )
 
-    row = (
-        db.query(models.UserTokenUsage)
+    for granularity, rollup in buckets.items():
+        table = USAGE_ROLLUPS[granularity]
+        _upsert_usage(
+            db,
+            table,
+            [table.user_id, table.bucket_start, table.model],
+            [
+                {"user_id": user_id, "bucket_start": bucket, "model": model, **counters(p, c)}
+                for (user_id, bucket, model), (p, c) in rollup.items()
+            ],
+        )
+
+    db.add(models.UsageFlush(batch_id=batch_id))
+    db.query(models.UsageFlush).filter(
+        models.UsageFlush.flushed_at < datetime.now(timezone.utc) - USAGE_FLUSH_RETENTION
+    ).delete(synchronize_session=False)
+    db.commit()
+    return True
+
+
+def get_token_usage_buckets(
+    db: Session,
+    user_id: str,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+) -> list[tuple[datetime, str, int]]:
+    """
+    (bucket_start, model, total_tokens) rows with start <= bucket_start < end.
+    """
+    table = USAGE_ROLLUPS[granularity]
+    return (
+        db.query(table.bucket_start, table.model, table.total_tokens)
         .filter(
-            models.UserTokenUsage.user_id == user_id,
-            models.UserTokenUsage.model == model,
+            table.user_id == user_id,
+            table.bucket_start >= start,
+            table.bucket_start < end,
         )
-        .first()
+        .order_by(table.bucket_start)
+        .all()
     )
 
-    if not row:
-        row = models.UserTokenUsage(
-            user_id=user_id,
-            model=model,
-            prompt_tokens=max(prompt_tokens, 0),
-            completion_tokens=max(completion_tokens, 0),
-            total_tokens=total,
-        )
-        db.add(row)
-    else:
-        row.prompt_tokens += max(prompt_tokens, 0)
-        row.completion_tokens += max(completion_tokens, 0)
-        row.total_tokens += total
 
+def compact_token_usage(db: Session, before: datetime) -> int:
+    """
+    Drops hourly buckets older than `before`. Their tokens are already in
+    the daily rollup (both are written by the same upsert), so this folds
+    old history down to one row per user, model and day.
+    """
+    deleted = (
+        db.query(models.UserTokenUsageHourly)
+        .filter(models.UserTokenUsageHourly.bucket_start < before)
+        .delete(synchronize_session=False)
+    )
     db.commit()
+    return deleted
+
+
+def get_token_usage(db: Session, user_id: str) -> dict[str, int]:
+    """
+    Stored total tokens per model for one user.
+    """
+    rows = (
+        db.query(models.UserTokenUsage.model, models.UserTokenUsage.total_tokens)
+        .filter(models.UserTokenUsage.user_id == user_id)
+        .all()
+    )
+    return {model: total for model, total in rows}
+
+
+def get_token_usage_totals(db: Session) -> dict[str, int]:
+    """
+    Lifetime tokens per user across all models.
+    """
+    rows = (
+        db.query(
+            models.UserTokenUsage.user_id,
+            func.sum(models.UserTokenUsage.total_tokens),
+        )
+        .group_by(models.UserTokenUsage.user_id)
+        .all()
+    )
+    return {user_id: int(total or 0) for user_id, total in rows}
@@ -1,13 +1,58 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import settings
 
+# PRAGMAs applied to every pooled SQLite connection, by profile
+SQLITE_PROFILES: dict[str, dict[str, str | int]] = {
+    # SQLite's built-in behaviour: rollback journal, full sync, no busy wait
+    "default": {},
+    # Concurrent readers alongside one writer, fsync only at checkpoints
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # KiB
+        "temp_store": "MEMORY",
+    },
+    # WAL concurrency, but every commit is fsynced
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
+
+_is_sqlite = settings.DATABASE_URL.startswith("sqlite")
+
 engine = create_engine(
     settings.DATABASE_URL,
-    connect_args={"check_same_thread": False},  # required for SQLite
+    connect_args={"check_same_thread": False} if _is_sqlite else {},  # required for SQLite
     pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
 )
 
+
+if _is_sqlite:
+    if settings.SQLITE_PROFILE not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE: {settings.SQLITE_PROFILE}")
+
+    _pragmas = SQLITE_PROFILES[settings.SQLITE_PROFILE]
+
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_profile(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # Must come first: switching to WAL writes the file header, after
+            # which a new database can only change auto_vacuum with a VACUUM
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            for name, value in _pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
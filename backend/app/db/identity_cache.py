@@ -0,0 +1,43 @@
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+
+class IdentityCache:
+    """
+    Bounded, TTL'd memory of users known to exist and of (user_id,
+    session_id) ownership, so steady-state requests skip those lookups.
+
+    Deletions made by this process are applied immediately; other worker
+    processes see them once the entry expires.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._users = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._sessions = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def has_user(self, user_id: str) -> bool:
+        return self._users.get(user_id) is not None
+
+    def add_user(self, user_id: str):
+        self._users.set(user_id, True)
+
+    def owns_session(self, user_id: str, session_id: str) -> bool:
+        return self._sessions.get((user_id, session_id)) is not None
+
+    def add_session(self, user_id: str, session_id: str):
+        self._sessions.set((user_id, session_id), True)
+
+    def forget_session(self, user_id: str, session_id: str):
+        self._sessions.pop((user_id, session_id))
+
+    def stats(self) -> dict:
+        return {
+            "users": self._users.stats(),
+            "sessions": self._sessions.stats(),
+        }
+
+
+identity_cache = IdentityCache(
+    max_entries=settings.IDENTITY_CACHE_ENTRIES,
+    ttl=settings.IDENTITY_CACHE_TTL_SECONDS,
+)
@@ -1,6 +1,19 @@
+import json
+import logging
+import sys
+
 from sqlalchemy import text
 from sqlalchemy.engine import Engine
 
+from app.core.compression import decompress
+from app.db.blob_store import BlobStore
+
+logger = logging.getLogger(__name__)
+
+# Length of chat_sessions.last_message_preview
+SESSION_PREVIEW_CHARS = 120
+
+
 def ensure_image_columns(engine: Engine):
     with engine.connect() as conn:
         result = conn.execute(
@@ -19,4 +32,524 @@ def ensure_image_columns(engine: Engine):
                 text("ALTER TABLE chat_messages ADD COLUMN image_mime TEXT")
             )
 
+        if "image_sha256" not in existing_cols:
+            conn.execute(
+                text("ALTER TABLE chat_messages ADD COLUMN image_sha256 TEXT")
+            )
+
+        if "image_size" not in existing_cols:
+            conn.execute(
+                text("ALTER TABLE chat_messages ADD COLUMN image_size INTEGER")
+            )
+
+        if "image_width" not in existing_cols:
+            conn.execute(
+                text("ALTER TABLE chat_messages ADD COLUMN image_width INTEGER")
+            )
+
+        if "image_height" not in existing_cols:
+            conn.execute(
+                text("ALTER TABLE chat_messages ADD COLUMN image_height INTEGER")
+            )
+
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_chat_messages_image_sha256 "
+                "ON chat_messages (image_sha256)"
+            )
+        )
+
+        conn.commit()
+
+
+def ensure_session_counters(engine: Engine):
+    """
+    Adds the denormalized counter columns to chat_sessions and backfills
+    them the first time they appear.
+    """
+    with engine.connect() as conn:
+        result = conn.execute(
+            text("PRAGMA table_info(chat_sessions)")
+        ).fetchall()
+
+        existing_cols = {row[1] for row in result}
+        added = False
+
+        for name, ddl in (
+            ("message_count", "INTEGER NOT NULL DEFAULT 0"),
+            ("assistant_count", "INTEGER NOT NULL DEFAULT 0"),
+            ("last_message_at", "DATETIME"),
+            ("tokens_since_summary", "INTEGER NOT NULL DEFAULT 0"),
+            ("last_message_preview", "TEXT"),
+            ("deleted_at", "DATETIME"),
+        ):
+            if name not in existing_cols:
+                conn.execute(
+                    text(f"ALTER TABLE chat_sessions ADD COLUMN {name} {ddl}")
+                )
+                added = True
+
+        conn.commit()
+
+    if added:
+        backfill_session_counters(engine)
+
+
+def backfill_session_counters(engine: Engine):
+    """
+    Recomputes every session's counters from chat_messages. Safe to re-run.
+    tokens_since_summary is estimated at ~4 characters per token.
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                UPDATE chat_sessions SET
+                    message_count = (
+                        SELECT COUNT(*) FROM chat_messages m
+                        WHERE m.session_id = chat_sessions.id
+                    ),
+                    assistant_count = (
+                        SELECT COUNT(*) FROM chat_messages m
+                        WHERE m.session_id = chat_sessions.id
+                          AND m.role = 'assistant'
+                    ),
+                    last_message_at = (
+                        SELECT MAX(m.created_at) FROM chat_messages m
+                        WHERE m.session_id = chat_sessions.id
+                    ),
+                    last_message_preview = (
+                        SELECT SUBSTR(COALESCE(NULLIF(m.content, ''), '[image]'), 1, :preview_chars)
+                        FROM chat_messages m
+                        WHERE m.session_id = chat_sessions.id
+                        ORDER BY m.created_at DESC, m.id DESC
+                        LIMIT 1
+                    ),
+                    tokens_since_summary = (
+                        SELECT COALESCE(SUM(LENGTH(COALESCE(m.content, '')) / 4 + 4), 0)
+                        FROM chat_messages m
+                        WHERE m.session_id = chat_sessions.id
+                          AND m.created_at > COALESCE(
+                              (
+                                  SELECT s.updated_at FROM chat_summaries s
+                                  WHERE s.session_id = chat_sessions.id
+                                    AND s.summary != ''
+                              ),
+                              ''
+                          )
+                    )
+                """
+            ),
+            {"preview_chars": SESSION_PREVIEW_CHARS},
+        )
+    logger.info("Backfilled chat session counters")
+
+
+# Composite indexes for the hot crud queries. create_all only builds
+# indexes for new tables, so existing databases get them here.
+COMPOSITE_INDEXES = {
+    "ix_chat_messages_session_created": "chat_messages (session_id, created_at, id)",
+    "ix_chat_sessions_user_live_updated": "chat_sessions (user_id, deleted_at, updated_at, id)",
+    # The purger's scan for tombstones; stays tiny
+    "ix_chat_sessions_tombstones": "chat_sessions (deleted_at) WHERE deleted_at IS NOT NULL",
+}
+
+# Indexes superseded by a composite one
+REDUNDANT_INDEXES = (
+    "ix_chat_messages_session_id",
+    "ix_chat_sessions_user_id",
+)
+
+
+def ensure_indexes(engine: Engine):
+    with engine.connect() as conn:
+        for name, target in COMPOSITE_INDEXES.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+
+        for name in REDUNDANT_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
         conn.commit()
+
+
+def ensure_incremental_vacuum(engine: Engine):
+    """
+    Makes sure the database uses auto_vacuum=INCREMENTAL so the purger can
+    hand freed pages back to the filesystem with PRAGMA incremental_vacuum.
+    New databases get it from the connect hook in database.py.
+
+    An existing database needs a one-time VACUUM for that, which rewrites
+    the whole file under an exclusive lock; startup only logs a hint and
+    leaves it to `python -m app.db.migrate incremental-vacuum`.
+    """
+    with engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        if mode == 2:
+            return
+
+        has_tables = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1"
+        ).first()
+        if not has_tables:
+            conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            return
+
+    logger.warning(
+        "Database is not in incremental auto-vacuum mode; purged space stays in the file. "
+        "Run `python -m app.db.migrate incremental-vacuum` once during maintenance."
+    )
+
+
+def convert_to_incremental_vacuum(engine: Engine):
+    """
+    One-off maintenance: switches an existing database to incremental
+    auto-vacuum with a full VACUUM. Blocks all writers while it runs;
+    stop the app first. Search rows are keyed by search_key, which the
+    VACUUM doesn't touch.
+    """
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            logger.info("Database already uses incremental auto-vacuum")
+            return
+
+        logger.info("Converting database to incremental auto-vacuum (VACUUM)")
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.commit()
+        conn.exec_driver_sql("VACUUM")
+
+
+def reclaim_free_pages(engine: Engine, max_pages: int) -> tuple[int, int]:
+    """
+    Returns up to max_pages free pages to the filesystem.
+    Returns (pages reclaimed, free pages left).
+    """
+    raw = engine.raw_connection()
+    try:
+        sqlite_conn = raw.driver_connection
+        before = sqlite_conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before:
+            # execute() steps this pragma once (one page); executescript
+            # runs it to completion in its own transaction
+            sqlite_conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+        after = sqlite_conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        raw.close()
+    return before - after, after
+
+
+# One-off data migrations that have finished, so startup can skip them
+MARKERS_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS migration_markers (
+    name TEXT PRIMARY KEY,
+    done_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def migration_done(engine: Engine, name: str) -> bool:
+    with engine.begin() as conn:
+        conn.exec_driver_sql(MARKERS_TABLE_DDL)
+        return conn.execute(
+            text("SELECT 1 FROM migration_markers WHERE name = :name"),
+            {"name": name},
+        ).first() is not None
+
+
+def mark_migration_done(engine: Engine, name: str):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(MARKERS_TABLE_DDL)
+        conn.execute(
+            text("INSERT OR IGNORE INTO migration_markers (name) VALUES (:name)"),
+            {"name": name},
+        )
+
+
+def migrate_image_blobs(engine: Engine, store: BlobStore, batch_size: int = 50) -> int:
+    """
+    Moves inline image_bytes out of chat_messages into the blob store.
+
+    Each batch writes the blobs first and then clears the column in one
+    transaction, so an interrupted run is simply resumed next startup.
+    New messages never fill the column, so once a run finishes it is
+    marked done and later startups skip the table scan.
+    """
+    if migration_done(engine, "image_blobs"):
+        return 0
+
+    moved = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT id, image_bytes FROM chat_messages "
+                    "WHERE image_bytes IS NOT NULL LIMIT :limit"
+                ),
+                {"limit": batch_size},
+            ).fetchall()
+
+            if not rows:
+                break
+
+            for message_id, data in rows:
+                digest = store.put(data)
+                conn.execute(
+                    text(
+                        "UPDATE chat_messages "
+                        "SET image_sha256 = :digest, image_size = :size, image_bytes = NULL "
+                        "WHERE id = :id"
+                    ),
+                    {"digest": digest, "size": len(data), "id": message_id},
+                )
+
+        moved += len(rows)
+
+    if moved:
+        logger.info("Moved %d inline image(s) to the blob store", moved)
+    mark_migration_done(engine, "image_blobs")
+    return moved
+
+
+# Timestamp columns that feed keyset cursors, with the scope their order
+# matters in. Rows written through server_default (func.now()) carry
+# 'YYYY-MM-DD HH:MM:SS'; everything else is stored with microseconds.
+TIMESTAMP_COLUMNS = (
+    ("chat_messages", "created_at", "session_id"),
+    ("chat_sessions", "updated_at", "user_id"),
+    ("chat_sessions", "created_at", "user_id"),
+)
+
+
+def normalize_timestamps(engine: Engine):
+    """
+    Rewrites second-resolution timestamps to the microsecond format the
+    ORM writes, so they compare correctly against bound cursors. Rows that
+    share a second within their scope get .000000, .000001, ... in rowid
+    (insertion) order, so ties keep their original order instead of
+    falling back to the random id. Runs once.
+    """
+    if migration_done(engine, "microsecond_timestamps"):
+        return
+
+    with engine.begin() as conn:
+        for table, column, scope in TIMESTAMP_COLUMNS:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS temp.timestamp_fix")
+            conn.exec_driver_sql(
+                "CREATE TEMP TABLE timestamp_fix (rid INTEGER PRIMARY KEY, ts TEXT NOT NULL)"
+            )
+            conn.exec_driver_sql(
+                f"""
+                INSERT INTO timestamp_fix (rid, ts)
+                SELECT rowid, {column} || printf(
+                    '.%06d',
+                    ROW_NUMBER() OVER (PARTITION BY {scope}, {column} ORDER BY rowid) - 1
+                )
+                FROM {table}
+                WHERE length({column}) = 19
+                """
+            )
+            fixed = conn.exec_driver_sql(
+                f"""
+                UPDATE {table}
+                SET {column} = (SELECT ts FROM timestamp_fix WHERE rid = {table}.rowid)
+                WHERE rowid IN (SELECT rid FROM timestamp_fix)
+                """
+            ).rowcount
+            conn.exec_driver_sql("DROP TABLE temp.timestamp_fix")
+            if fixed:
+                logger.info("Normalized %d %s.%s timestamp(s)", fixed, table, column)
+
+    mark_migration_done(engine, "microsecond_timestamps")
+
+
+# Full-text index over message content. user_id is indexed too, so a
+# query is scoped to one user inside MATCH instead of filtering every
+# user's hits afterwards; prefix indexes keep search-as-you-type cheap.
+# The other columns search returns are stored UNINDEXED, so results never
+# join back to chat_messages. Its rowid is chat_messages.search_key: taken
+# from a counter once per message and never reused, unlike the implicit
+# rowid (reused after deletes, renumbered by VACUUM), so index rows stay
+# attached to their message through archiving and rehydration.
+SEARCH_TABLE = "chat_messages_fts"
+
+# Single-row counter behind chat_messages.search_key
+SEARCH_KEY_SEQ_DDL = """
+CREATE TABLE IF NOT EXISTS search_key_seq (value INTEGER NOT NULL)
+"""
+
+SEARCH_TABLE_DDL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    content,
+    user_id,
+    message_id UNINDEXED,
+    session_id UNINDEXED,
+    role UNINDEXED,
+    created_at UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+# Inserts are indexed by trigger, which assigns the message's search_key.
+# Rows inserted with a search_key already (rehydrated from the archive,
+# whose index rows were never removed) are skipped. Deletes go through
+# crud explicitly.
+SEARCH_INSERT_TRIGGER_DDL = f"""
+CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai
+AFTER INSERT ON chat_messages
+WHEN new.search_key IS NULL AND new.content IS NOT NULL AND new.content != ''
+BEGIN
+    UPDATE search_key_seq SET value = value + 1;
+    UPDATE chat_messages SET search_key = (SELECT value FROM search_key_seq)
+    WHERE rowid = new.rowid;
+    INSERT INTO {SEARCH_TABLE} (rowid, content, message_id, session_id, user_id, role, created_at)
+    VALUES (
+        (SELECT value FROM search_key_seq),
+        new.content, new.id, new.session_id, new.user_id, new.role, new.created_at
+    );
+END
+"""
+
+
+def fts5_available(engine: Engine) -> bool:
+    with engine.connect() as conn:
+        options = {row[0] for row in conn.execute(text("PRAGMA compile_options"))}
+    return "ENABLE_FTS5" in options
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """
+    Adds the search_key column, then creates the FTS5 table, key counter
+    and trigger, indexing existing messages the first time. Returns False
+    (search falls back to LIKE) without FTS5.
+    """
+    # The model maps search_key either way, so it can't wait on FTS5
+    with engine.begin() as conn:
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(chat_messages)"))}
+        if "search_key" not in columns:
+            conn.execute(text("ALTER TABLE chat_messages ADD COLUMN search_key INTEGER"))
+
+    if not fts5_available(engine):
+        logger.warning("SQLite was built without FTS5; message search will use LIKE")
+        return False
+
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": SEARCH_TABLE},
+        ).first()
+        conn.execute(text(SEARCH_TABLE_DDL))
+        conn.execute(text(SEARCH_KEY_SEQ_DDL))
+        if conn.execute(text("SELECT 1 FROM search_key_seq")).first() is None:
+            conn.execute(
+                text(
+                    f"""
+                    INSERT INTO search_key_seq (value) SELECT MAX(
+                        COALESCE((SELECT MAX(search_key) FROM chat_messages), 0),
+                        COALESCE((SELECT MAX(rowid) FROM {SEARCH_TABLE}), 0)
+                    )
+                    """
+                )
+            )
+        conn.execute(text(SEARCH_INSERT_TRIGGER_DDL))
+
+    if not exists:
+        rebuild_search_index(engine)
+    return True
+
+
+def _index_archived_messages(conn) -> int:
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_message_archive'")
+    ).first()
+    if not exists:
+        return 0
+
+    indexed = 0
+    batch_ids = conn.execute(text("SELECT id FROM chat_message_archive")).scalars().all()
+    for batch_id in batch_ids:
+        session_id, user_id, codec, payload = conn.execute(
+            text("SELECT session_id, user_id, codec, payload FROM chat_message_archive WHERE id = :id"),
+            {"id": batch_id},
+        ).one()
+        rows = [
+            {
+                "rowid": m["search_key"],
+                "content": m["content"],
+                "message_id": m["id"],
+                "session_id": session_id,
+                "user_id": user_id,
+                "role": m["role"],
+                "created_at": m["created_at"],
+            }
+            for m in json.loads(decompress(payload, codec))
+            if m["search_key"] is not None
+        ]
+        if rows:
+            conn.execute(
+                text(
+                    f"INSERT INTO {SEARCH_TABLE} (rowid, content, message_id, session_id, user_id, role, created_at) "
+                    "VALUES (:rowid, :content, :message_id, :session_id, :user_id, :role, :created_at)"
+                ),
+                rows,
+            )
+            indexed += len(rows)
+    return indexed
+
+
+def rebuild_search_index(engine: Engine) -> int:
+    """
+    Re-indexes every message from chat_messages and the archive under its
+    search_key, assigning keys to messages that have none yet. Safe to
+    re-run; use it after restoring a backup.
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                UPDATE chat_messages
+                SET search_key = (SELECT value FROM search_key_seq) + rowid
+                WHERE search_key IS NULL AND content IS NOT NULL AND content != ''
+                """
+            )
+        )
+        conn.execute(
+            text(
+                """
+                UPDATE search_key_seq SET value = MAX(
+                    value, COALESCE((SELECT MAX(search_key) FROM chat_messages), 0)
+                )
+                """
+            )
+        )
+
+        conn.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+        result = conn.execute(
+            text(
+                f"""
+                INSERT INTO {SEARCH_TABLE} (rowid, content, message_id, session_id, user_id, role, created_at)
+                SELECT search_key, content, id, session_id, user_id, role, created_at
+                FROM chat_messages
+                WHERE search_key IS NOT NULL
+                """
+            )
+        )
+        indexed = result.rowcount + _index_archived_messages(conn)
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+
+    logger.info("Indexed %d message(s) for search", indexed)
+    return indexed
+
+
+if __name__ == "__main__":
+    # python -m app.db.migrate rebuild-search | incremental-vacuum
+    from app.db.database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["rebuild-search"]:
+        if not ensure_search_index(engine):
+            sys.exit("FTS5 is not available in this SQLite build")
+        rebuild_search_index(engine)
+    elif sys.argv[1:] == ["incremental-vacuum"]:
+        convert_to_incremental_vacuum(engine)
+    else:
+        sys.exit("usage: python -m app.db.migrate rebuild-search | incremental-vacuum")
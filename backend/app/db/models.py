@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Integer
+from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Integer, Index
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from sqlalchemy import LargeBinary
 
@@ -22,29 +23,98 @@ class UserAuth(Base):
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        # list_sessions: live sessions newest first per user
+        Index("ix_chat_sessions_user_live_updated", "user_id", "deleted_at", "updated_at", "id"),
+    )
+
     id = Column(String, primary_key=True, index=True)
-    user_id = Column(String, ForeignKey("users.id"), index=True, nullable=False)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
     title = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    # Denormalized counters, maintained by crud.add_message / crud.set_summary
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    assistant_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    tokens_since_summary = Column(Integer, nullable=False, default=0, server_default="0")
+    # First characters of the latest message, for the sidebar
+    last_message_preview = Column(String, nullable=True)
+
+    # Set on delete; the session is hidden at once and purged in the background
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Recent-window and keyset history reads, in (created_at, id) order
+        Index("ix_chat_messages_session_created", "session_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, index=True)
-    session_id = Column(String, ForeignKey("chat_sessions.id"), index=True, nullable=False)
+    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False)
     user_id = Column(String, ForeignKey("users.id"), index=True, nullable=False)
 
     role = Column(String, nullable=False)  # "user" | "assistant"
 
     content = Column(Text, nullable=True)
 
-    image_bytes = Column(LargeBinary, nullable=True)
+    # Image bytes live in the blob store, keyed by SHA-256
+    image_sha256 = Column(String, index=True, nullable=True)
+    image_size = Column(Integer, nullable=True)
     image_mime = Column(String, nullable=True)
+    image_width = Column(Integer, nullable=True)
+    image_height = Column(Integer, nullable=True)
+
+    # Legacy inline storage, emptied by migrate.migrate_image_blobs
+    image_bytes = deferred(Column(LargeBinary, nullable=True))
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    # Rowid of the message's search index row. Assigned once by the insert
+    # trigger (see migrate.SEARCH_INSERT_TRIGGER_DDL) and kept in the archive
+    search_key = Column(Integer, nullable=True)
+
+
+class ChatMessageArchive(Base):
+    """
+    Cold tier: a compressed batch of one session's older text messages,
+    moved out of chat_messages by the archiver. The payload is a JSON list
+    of message rows compressed with `codec`; message order is
+    (created_at, id) within and across batches.
+    """
+    __tablename__ = "chat_message_archive"
+    __table_args__ = (
+        Index("ix_chat_message_archive_session_last", "session_id", "last_created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+
+    codec = Column(String, nullable=False)  # "zstd" | "zlib"
+    message_count = Column(Integer, nullable=False)
+    first_created_at = Column(DateTime(timezone=True), nullable=False)
+    last_created_at = Column(DateTime(timezone=True), nullable=False)
+    raw_size = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+
+    archived_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class PendingBlobDeletion(Base):
+    """
+    Image blobs freed by purged messages, waiting for the purger to delete
+    them (once unreferenced and past the grace period). Persisted so a
+    restart doesn't leak them.
+    """
+    __tablename__ = "pending_blob_deletions"
+
+    digest = Column(String, primary_key=True)
+    queued_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
 
 class ChatSummary(Base):
     __tablename__ = "chat_summaries"
@@ -69,3 +139,49 @@ class UserTokenUsage(Base):
         onupdate=func.now(),
         nullable=False,
     )
+
+
+class UserTokenUsageHourly(Base):
+    """
+    Token usage per user, model and UTC hour. Compacted away after
+    USAGE_HOURLY_RETENTION_DAYS; the daily rollup keeps the history.
+    """
+    __tablename__ = "user_token_usage_hourly"
+    __table_args__ = (
+        # Compaction deletes by age across all users
+        Index("ix_user_token_usage_hourly_bucket", "bucket_start"),
+    )
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    model = Column(String, primary_key=True)
+
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+
+
+class UserTokenUsageDaily(Base):
+    """
+    Token usage per user, model and UTC day.
+    """
+    __tablename__ = "user_token_usage_daily"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    model = Column(String, primary_key=True)
+
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+
+
+class UsageFlush(Base):
+    """
+    Token-usage batches already applied, so a replayed journal can't be
+    counted twice.
+    """
+    __tablename__ = "usage_flushes"
+
+    batch_id = Column(String, primary_key=True)
+    flushed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
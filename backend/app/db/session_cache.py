@@ -0,0 +1,179 @@
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+SessionKey = tuple[str, str]  # (user_id, session_id)
+
+# Rough per-message overhead on top of the text itself
+_MESSAGE_OVERHEAD_BYTES = 200
+
+
+@dataclass(frozen=True)
+class CachedMessage:
+    """
+    Detached copy of the ChatMessage columns used for prompt assembly.
+    """
+
+    id: str
+    role: str
+    content: str | None
+    image_sha256: str | None
+    image_mime: str | None
+    image_width: int | None
+    image_height: int | None
+    created_at: datetime
+
+    @classmethod
+    def from_row(cls, m) -> "CachedMessage":
+        return cls(
+            id=m.id,
+            role=m.role,
+            content=m.content,
+            image_sha256=m.image_sha256,
+            image_mime=m.image_mime,
+            image_width=m.image_width,
+            image_height=m.image_height,
+            created_at=m.created_at,
+        )
+
+
+@dataclass
+class SessionContext:
+    summary: str
+    messages: deque[CachedMessage]
+    # True when `messages` holds the session's entire history
+    complete: bool
+
+    def recent(self, limit: int) -> list[CachedMessage] | None:
+        if len(self.messages) < limit and not self.complete:
+            return None
+        return list(self.messages)[-limit:]
+
+
+def _context_size(ctx: SessionContext) -> int:
+    size = len(ctx.summary)
+    for m in ctx.messages:
+        size += _MESSAGE_OVERHEAD_BYTES + len(m.content or "")
+    return size
+
+
+class SessionContextCache:
+    """
+    In-process cache of each active session's summary plus a ring buffer
+    of its latest messages, kept current write-through by crud.
+
+    Only writes made by this process are seen, so it is only safe with a
+    single worker per database (see SESSION_CACHE_SESSIONS).
+    """
+
+    def __init__(self, capacity: int, max_sessions: int, max_bytes: int):
+        self.capacity = capacity
+        self.enabled = max_sessions > 0 and capacity > 0
+        self._cache = LRUCache(
+            max_entries=max_sessions,
+            max_bytes=max_bytes,
+            sizeof=_context_size,
+        )
+        self._lock = threading.Lock()
+        # Per-session write counters, kept only while a load is in flight:
+        # key -> [loads in flight, writes since the first began]. A load
+        # that raced a write to its session is discarded.
+        self._loads: dict[SessionKey, list[int]] = {}
+
+    def begin_load(self, user_id: str, session_id: str) -> int:
+        """
+        Marks a DB load of the session as started. Returns the generation
+        to pass to install(); pair with end_load().
+        """
+        with self._lock:
+            entry = self._loads.setdefault((user_id, session_id), [0, 0])
+            entry[0] += 1
+            return entry[1]
+
+    def end_load(self, user_id: str, session_id: str):
+        with self._lock:
+            key = (user_id, session_id)
+            entry = self._loads[key]
+            entry[0] -= 1
+            if not entry[0]:
+                del self._loads[key]
+
+    def _bump(self, key: SessionKey):
+        entry = self._loads.get(key)
+        if entry is not None:
+            entry[1] += 1
+
+    def get(self, user_id: str, session_id: str) -> SessionContext | None:
+        if not self.enabled:
+            return None
+        return self._cache.get((user_id, session_id))
+
+    def install(
+        self,
+        user_id: str,
+        session_id: str,
+        summary: str,
+        messages: list,
+        generation: int,
+    ):
+        """
+        Installs a context loaded from the DB (oldest message first).
+        `generation` is the value begin_load() returned.
+        """
+        if not self.enabled:
+            return
+        ctx = SessionContext(
+            summary=summary,
+            messages=deque(
+                (CachedMessage.from_row(m) for m in messages),
+                maxlen=self.capacity,
+            ),
+            complete=len(messages) < self.capacity,
+        )
+        key = (user_id, session_id)
+        with self._lock:
+            entry = self._loads.get(key)
+            if entry is not None and generation == entry[1]:
+                self._cache.set(key, ctx)
+
+    def append_message(self, user_id: str, session_id: str, message: CachedMessage):
+        key = (user_id, session_id)
+        with self._lock:
+            self._bump(key)
+            ctx = self._cache.pop(key)
+            if ctx is None:
+                return
+            # A load that ran between the commit and this call has it already
+            if all(m.id != message.id for m in ctx.messages):
+                ctx.messages.append(message)
+            self._cache.set(key, ctx)
+
+    def set_summary(self, user_id: str, session_id: str, summary: str):
+        key = (user_id, session_id)
+        with self._lock:
+            self._bump(key)
+            ctx = self._cache.pop(key)
+            if ctx is None:
+                return
+            ctx.summary = summary
+            self._cache.set(key, ctx)
+
+    def invalidate(self, user_id: str, session_id: str):
+        key = (user_id, session_id)
+        with self._lock:
+            self._bump(key)
+            self._cache.pop(key)
+
+    def stats(self) -> dict:
+        return {"capacity": self.capacity, **self._cache.stats()}
+
+
+session_cache = SessionContextCache(
+    capacity=settings.SESSION_CACHE_MESSAGES,
+    max_sessions=settings.SESSION_CACHE_SESSIONS,
+    max_bytes=settings.SESSION_CACHE_MB * 1024 * 1024,
+)
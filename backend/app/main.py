@@ -1,20 +1,88 @@
-from fastapi import FastAPI
-from app.db.database import Base, engine
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from app.db.database import Base, SessionLocal, engine
+from app.db import crud
 from app.api.sessions import router as sessions_router
+from app.api.messages import router as messages_router
 from app.api.chat import router as chat_router
 from app.api.auth import router as auth_router
 from app.api.user import router as user_router
-from app.db.migrate import ensure_image_columns
+from app.api.metrics import router as metrics_router
+from app.api.search import router as search_router
+from app.core.auth_utils import hash_executor
+from app.db.blob_store import blob_store
+from app.db.migrate import (
+    ensure_image_columns,
+    ensure_incremental_vacuum,
+    ensure_indexes,
+    ensure_search_index,
+    ensure_session_counters,
+    migrate_image_blobs,
+    normalize_timestamps,
+)
+from app.services.archiver import message_archiver
+from app.services.image_pipeline import shutdown_pool
+from app.services.openai_service import UpstreamError
+from app.services.purger import session_purger
+from app.services.scheduler import RateLimitedError, upstream_scheduler
+from app.services.summarizer import summary_queue
+from app.services.usage_aggregator import usage_aggregator
 
 def create_tables():
+    if engine.dialect.name == "sqlite":
+        ensure_incremental_vacuum(engine)
     Base.metadata.create_all(bind=engine)
     ensure_image_columns(engine)
+    ensure_session_counters(engine)
+    ensure_indexes(engine)
+    ensure_search_index(engine)
+    migrate_image_blobs(engine, blob_store)
+    normalize_timestamps(engine)
 
 create_tables()
 
-app = FastAPI(title="Multimodal Chat Backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    usage_aggregator.recover()
+    with SessionLocal() as db:
+        upstream_scheduler.seed(crud.get_token_usage_totals(db))
+    usage_aggregator.start()
+    summary_queue.start()
+    session_purger.start()
+    message_archiver.start()
+    yield
+    await message_archiver.stop()
+    await session_purger.stop()
+    await summary_queue.stop()
+    await usage_aggregator.stop()
+    shutdown_pool()
+    hash_executor.shutdown()
+
+
+app = FastAPI(title="Multimodal Chat Backend", lifespan=lifespan)
+
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    return JSONResponse(status_code=502, content={"detail": "Upstream request failed"})
+
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited_handler(request: Request, exc: RateLimitedError):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Rate limit exceeded, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 app.include_router(sessions_router)
+app.include_router(messages_router)
 app.include_router(chat_router)
 app.include_router(auth_router)
 app.include_router(user_router)
+app.include_router(metrics_router)
+app.include_router(search_router)
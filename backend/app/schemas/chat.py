@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional, Literal, List
 
@@ -7,14 +8,27 @@ class CreateSessionRequest(BaseModel):
 class SessionOut(BaseModel):
     id: str
     title: str
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None  # only with ?include_preview=true
 
 class MessageOut(BaseModel):
     id: str
     role: Literal["user", "assistant"]
     content: Optional[str] = None
-    image_base64: Optional[str] = None
+    image_url: Optional[str] = None
+    image_base64: Optional[str] = None  # only with ?inline_images=true
     image_mime: Optional[str] = None
 
+class SearchResultOut(BaseModel):
+    message_id: str
+    session_id: str
+    session_title: str
+    role: Literal["user", "assistant"]
+    snippet: str
+    created_at: datetime
+    rank: Optional[float] = None  # bm25, lower is better; None without FTS5
+
 class ChatStreamRequest(BaseModel):
     session_id: str
     message: str
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.core.compression import DEFAULT_CODEC
+from app.core.config import settings
+from app.db import crud
+from app.db.database import SessionLocal
+from app.services.purger import session_purger
+
+logger = logging.getLogger(__name__)
+
+# Idle sessions picked up per listing
+SESSIONS_PER_PASS = 100
+
+# Breather between archive batches, so other writers get the lock
+BATCH_PAUSE_SECONDS = 0.05
+
+
+# -------------------------
+# DB helpers (run in threadpool)
+# -------------------------
+
+def _list_idle_sessions(idle_before: datetime) -> list:
+    db = SessionLocal()
+    try:
+        return crud.list_idle_sessions(db, idle_before, limit=SESSIONS_PER_PASS)
+    finally:
+        db.close()
+
+
+def _archive_batch(user_id: str, session_id: str, idle_before: datetime, batch_size: int):
+    db = SessionLocal()
+    try:
+        return crud.archive_session_batch(db, user_id, session_id, idle_before, batch_size)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _hot_table_size() -> int | None:
+    db = SessionLocal()
+    try:
+        return crud.get_table_size(db, "chat_messages")
+    finally:
+        db.close()
+
+
+# -------------------------
+# Archiver
+# -------------------------
+
+class MessageArchiver:
+    """
+    Moves history of idle sessions into the compressed cold tier.
+
+    Every interval, text messages older than after_days in sessions idle
+    for as long are packed into per-session archive rows of up to
+    batch_size messages (zstd, or zlib without the zstandard package),
+    one short transaction per batch. list_messages reads through to the
+    archive; rehydrate() moves a session back when it becomes active.
+    """
+
+    def __init__(self, enabled: bool, after_days: int, interval: float, batch_size: int):
+        self.enabled = enabled
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = max(batch_size, 1)
+        self._task: asyncio.Task | None = None
+
+        self.passes = 0
+        self.sessions_archived = 0
+        self.messages_archived = 0
+        self.messages_rehydrated = 0
+        self.bytes_raw = 0
+        self.bytes_stored = 0
+        self.failures = 0
+        self.last_pass_seconds = 0.0
+
+    # -------------------------
+    # Lifecycle
+    # -------------------------
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.archive()
+            except Exception:
+                self.failures += 1
+                logger.exception("Message archive pass failed")
+
+    # -------------------------
+    # Archiving
+    # -------------------------
+
+    async def archive(self):
+        started = time.monotonic()
+        idle_before = datetime.now(timezone.utc) - timedelta(days=self.after_days)
+
+        sessions = await run_in_threadpool(_list_idle_sessions, idle_before)
+        if not sessions:
+            self.passes += 1
+            return
+
+        moved_total = 0
+        while sessions:
+            moved_listing = 0
+            for session_id, user_id in sessions:
+                try:
+                    moved = await self._archive_session(user_id, session_id, idle_before)
+                except Exception:
+                    # One bad session must not stall the rest of the pass
+                    self.failures += 1
+                    logger.exception("Archiving session %s failed", session_id)
+                    continue
+                moved_listing += moved
+                if moved:
+                    self.sessions_archived += 1
+            moved_total += moved_listing
+            if not moved_listing:
+                break  # only sessions that turned active meanwhile
+            sessions = await run_in_threadpool(_list_idle_sessions, idle_before)
+
+        logger.info("Archived %d message(s)", moved_total)
+
+        await session_purger.reclaim_space()
+        self.passes += 1
+        self.last_pass_seconds = time.monotonic() - started
+
+    async def _archive_session(self, user_id: str, session_id: str, idle_before: datetime) -> int:
+        moved_total = 0
+        while True:
+            moved, raw, stored = await run_in_threadpool(
+                _archive_batch, user_id, session_id, idle_before, self.batch_size
+            )
+            moved_total += moved
+            self.messages_archived += moved
+            self.bytes_raw += raw
+            self.bytes_stored += stored
+            if moved < self.batch_size:
+                return moved_total
+            await asyncio.sleep(BATCH_PAUSE_SECONDS)
+
+    def rehydrate(self, db: Session, user_id: str, session_id: str) -> int:
+        """
+        Restores a session's archived messages before it is used again.
+        """
+        restored = crud.rehydrate_session(db, user_id, session_id)
+        self.messages_rehydrated += restored
+        return restored
+
+    # -------------------------
+    # Monitoring
+    # -------------------------
+
+    def stats(self) -> dict:
+        """
+        Counters plus the current size of chat_messages. The size is a
+        dbstat scan, so call this from a worker thread, not the event loop.
+        """
+        return {
+            "enabled": self.enabled,
+            "after_days": self.after_days,
+            "codec": DEFAULT_CODEC,
+            "passes": self.passes,
+            "sessions_archived": self.sessions_archived,
+            "messages_archived": self.messages_archived,
+            "messages_rehydrated": self.messages_rehydrated,
+            "bytes_raw": self.bytes_raw,
+            "bytes_stored": self.bytes_stored,
+            "compression_ratio": round(self.bytes_raw / self.bytes_stored, 2) if self.bytes_stored else None,
+            "hot_table_bytes": _hot_table_size(),
+            "failures": self.failures,
+            "last_pass_seconds": round(self.last_pass_seconds, 4),
+        }
+
+
+message_archiver = MessageArchiver(
+    enabled=settings.ARCHIVE_ENABLED,
+    after_days=settings.ARCHIVE_AFTER_DAYS,
+    interval=settings.ARCHIVE_INTERVAL_SECONDS,
+    batch_size=settings.ARCHIVE_BATCH_MESSAGES,
+)
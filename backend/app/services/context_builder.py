@@ -0,0 +1,58 @@
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.tokens import count_message_tokens
+from app.services.image_pipeline import choose_detail, estimate_image_tokens
+
+# Images stored before dimensions were recorded are sent with detail "auto";
+# budget them as a typical high-detail image.
+LEGACY_IMAGE_TOKENS = 765
+
+# Text token counts of stored messages, keyed by message id. Content never
+# changes after insert, so history is tokenized once.
+message_token_cache = LRUCache(max_entries=settings.TOKEN_COUNT_CACHE_ENTRIES)
+
+
+def image_tokens(m) -> int:
+    if not m.image_sha256:
+        return 0
+    if not (m.image_width and m.image_height):
+        return LEGACY_IMAGE_TOKENS
+    detail = choose_detail(m.image_width, m.image_height)
+    return estimate_image_tokens(m.image_width, m.image_height, detail)
+
+
+def message_tokens(m, model: str, with_images: bool) -> int:
+    text_tokens = message_token_cache.get(m.id)
+    if text_tokens is None:
+        text_tokens = count_message_tokens(m.content, model)
+        message_token_cache.set(m.id, text_tokens)
+
+    if with_images:
+        return text_tokens + image_tokens(m)
+    return text_tokens
+
+
+def fit_context(
+    prefix: list[dict],
+    candidates: list,
+    model: str,
+    budget: int,
+    with_images: bool = False,
+) -> list:
+    """
+    Picks the newest messages from `candidates` (oldest first) that fit in
+    `budget` prompt tokens after the `prefix` system messages. The newest
+    message is always kept so the current turn is never dropped.
+    """
+    used = sum(count_message_tokens(p["content"], model) for p in prefix)
+
+    selected = []
+    for m in reversed(candidates):
+        cost = message_tokens(m, model, with_images)
+        if selected and used + cost > budget:
+            break
+        used += cost
+        selected.append(m)
+
+    selected.reverse()
+    return selected
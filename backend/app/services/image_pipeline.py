@@ -0,0 +1,185 @@
+import asyncio
+import io
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.core.config import settings
+
+# -------------------------
+# Vision sizing rules
+# -------------------------
+# High detail images are fitted into 2048x2048, then the short side is
+# scaled to 768 and the result is billed per 512px tile. Anything larger
+# is downscaled by the API anyway, so we do it before storing.
+
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+TILE_SIZE = 512
+TILE_TOKENS = 170
+BASE_TOKENS = 85
+
+# Images this small carry no extra information at high detail
+LOW_DETAIL_MAX_SIDE = 512
+
+JPEG_QUALITY = 85
+WEBP_QUALITY = 85
+
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    mime: str
+    width: int
+    height: int
+    detail: str
+    original_size: int
+    original_tokens: int
+    tokens: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_size - len(self.data)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+def choose_detail(width: int, height: int) -> str:
+    return "low" if max(width, height) <= LOW_DETAIL_MAX_SIDE else "high"
+
+
+def _target_scale(width: int, height: int) -> float:
+    return min(
+        1.0,
+        MAX_LONG_SIDE / max(width, height),
+        MAX_SHORT_SIDE / min(width, height),
+    )
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    Estimated prompt tokens for one image at the given detail level.
+    """
+    if detail == "low":
+        return BASE_TOKENS
+
+    scale = _target_scale(width, height)
+    w = math.ceil(width * scale)
+    h = math.ceil(height * scale)
+    tiles = math.ceil(w / TILE_SIZE) * math.ceil(h / TILE_SIZE)
+    return TILE_TOKENS * tiles + BASE_TOKENS
+
+
+def _normalize(data: bytes, mime: str) -> NormalizedImage:
+    """
+    Decodes, EXIF-rotates, downscales and re-encodes one upload.
+    Runs inside the worker process.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as exc:
+        raise ValueError("Could not decode image") from exc
+
+    original_width, original_height = img.size
+    original_tokens = estimate_image_tokens(original_width, original_height)
+
+    rotated = ImageOps.exif_transpose(img)
+    changed = rotated is not img
+    img = rotated
+
+    scale = _target_scale(*img.size)
+    if scale < 1.0:
+        size = (
+            max(1, round(img.width * scale)),
+            max(1, round(img.height * scale)),
+        )
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        changed = True
+
+    width, height = img.size
+    detail = choose_detail(width, height)
+    tokens = estimate_image_tokens(width, height, detail)
+
+    has_alpha = img.mode in ("RGBA", "LA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
+
+    out = io.BytesIO()
+    if has_alpha:
+        img.convert("RGBA").save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+        out_mime = "image/webp"
+    else:
+        img.convert("RGB").save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        out_mime = "image/jpeg"
+    encoded = out.getvalue()
+
+    # Already small and upright: keep the original bytes if they're smaller
+    if not changed and len(data) <= len(encoded):
+        encoded = data
+        out_mime = mime
+
+    return NormalizedImage(
+        data=encoded,
+        mime=out_mime,
+        width=width,
+        height=height,
+        detail=detail,
+        original_size=len(data),
+        original_tokens=original_tokens,
+        tokens=tokens,
+    )
+
+
+# -------------------------
+# Process pool
+# -------------------------
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    # A dead worker breaks the executor for good; the next call starts a
+    # fresh one. Concurrent failures may race here, so only drop our own.
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def normalize_image(data: bytes, mime: str) -> NormalizedImage:
+    """
+    Normalizes an upload off the event loop. Raises ValueError if the
+    bytes can't be decoded as an image, and BrokenProcessPool if the
+    worker died (e.g. out of memory); the pool is replaced for later calls.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        return await loop.run_in_executor(pool, _normalize, data, mime)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
@@ -1,9 +1,22 @@
-from openai import OpenAI
+from openai import AsyncOpenAI
+from app.core.cache import LRUCache
 from app.core.config import settings
+from app.services.scheduler import (
+    SYSTEM_USER,
+    estimate_request_tokens,
+    upstream_scheduler,
+)
+import anyio
+import asyncio
 import base64
-from typing import Iterator
+import hashlib
+import json
+import logging
+from typing import AsyncIterator
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+
+logger = logging.getLogger(__name__)
 
 # -------------------------
 # Defaults & constants
@@ -13,64 +26,484 @@ DEFAULT_CHAT_MODEL = "gpt-4o-mini"
 
 SYSTEM_PROMPT = "You are a helpful AI assistant."
 
+# Deltas are coalesced into one frame until it holds this many characters
+# or the oldest buffered delta has waited this long.
+FRAME_MAX_CHARS = 256
+FRAME_MAX_DELAY_SECONDS = 0.05
+
+# -------------------------
+# Streaming engine
+# -------------------------
+
+class ReplyStream:
+    """
+    One streamed completion.
+
+    Iterating yields coalesced text frames. The full reply is accumulated
+    in a list and exposed as `text`; `usage` is filled in from the final
+    usage chunk. Both are complete once iteration ends.
+    """
+
+    cached = False
+
+    def __init__(
+        self,
+        resp,
+        max_chars: int = FRAME_MAX_CHARS,
+        max_delay: float = FRAME_MAX_DELAY_SECONDS,
+        cache_key: str | None = None,
+    ):
+        self._resp = resp
+        self._parts: list[str] = []
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self.cache_key = cache_key
+        self.frames = 0
+        self.usage: dict[str, int] = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+        }
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._frames()
+
+    async def _deltas(self) -> AsyncIterator[str]:
+        try:
+            async for chunk in self._resp:
+                if not chunk.choices:
+                    chunk_usage = getattr(chunk, "usage", None)
+                    if chunk_usage is not None:
+                        self.usage["prompt_tokens"] = getattr(
+                            chunk_usage, "prompt_tokens", 0
+                        ) or 0
+                        self.usage["completion_tokens"] = getattr(
+                            chunk_usage, "completion_tokens", 0
+                        ) or 0
+                        self.usage["total_tokens"] = getattr(
+                            chunk_usage, "total_tokens", 0
+                        ) or 0
+                    continue
+
+                delta = chunk.choices[0].delta
+                if delta and delta.content:
+                    self._parts.append(delta.content)
+                    yield delta.content
+        finally:
+            # Release the upstream connection if the client went away early
+            await self._resp.close()
+
+    async def _frames(self) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        deltas = self._deltas()
+        buffer: list[str] = []
+        buffered = 0
+        first_at = 0.0
+        pending: asyncio.Future | None = None
+
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(deltas.__anext__())
+
+                timeout = None
+                if buffer:
+                    timeout = max(0.0, self.max_delay - (loop.time() - first_at))
+
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    # Time window elapsed with no new delta: flush what we have
+                    self.frames += 1
+                    yield "".join(buffer)
+                    buffer, buffered = [], 0
+                    continue
+
+                future, pending = pending, None
+                try:
+                    delta = future.result()
+                except StopAsyncIteration:
+                    break
+
+                if not buffer:
+                    first_at = loop.time()
+                buffer.append(delta)
+                buffered += len(delta)
+
+                if buffered >= self.max_chars:
+                    self.frames += 1
+                    yield "".join(buffer)
+                    buffer, buffered = [], 0
+
+            if buffer:
+                self.frames += 1
+                yield "".join(buffer)
+
+            # Only complete replies are worth replaying
+            text = self.text
+            if self.cache_key is not None and text:
+                completion_cache.set(self.cache_key, text)
+        finally:
+            with anyio.CancelScope(shield=True):
+                if pending is not None:
+                    pending.cancel()
+                    try:
+                        await pending
+                    except BaseException:
+                        pass
+                await deltas.aclose()
+
+
+class CachedReplyStream:
+    """
+    A reply served from completion_cache. Same interface as ReplyStream;
+    frames are replayed back-to-back and no upstream tokens are used.
+    """
+
+    cached = True
+
+    def __init__(self, text: str, max_chars: int = FRAME_MAX_CHARS):
+        self.text = text
+        self.max_chars = max_chars
+        self.frames = 0
+        self.usage: dict[str, int] = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+        }
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        for start in range(0, len(self.text), self.max_chars):
+            self.frames += 1
+            yield self.text[start:start + self.max_chars]
+
+
+# -------------------------
+# Completion cache (opt-in)
+# -------------------------
+
+# Full reply texts keyed by completion_cache_key()
+completion_cache = LRUCache(
+    max_bytes=settings.COMPLETION_CACHE_MB * 1024 * 1024,
+    sizeof=lambda text: len(text.encode("utf-8")),
+    ttl=settings.COMPLETION_CACHE_TTL_SECONDS,
+)
+
+
+def completion_cache_key(user_id: str, model: str, messages_for_openai: list[dict]) -> str:
+    """
+    Hash of the user, model and canonical JSON of the request messages.
+    Scoped per user so replies never cross accounts.
+    """
+    payload = json.dumps(
+        [user_id, model, messages_for_openai],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class UpstreamError(RuntimeError):
+    """
+    An upstream completion failed. Raised to every caller sharing the
+    request; the original exception is chained as __cause__.
+    """
+
+
+# -------------------------
+# Single-flight
+# -------------------------
+
+def _flight_key(user_id: str, model: str, messages_for_openai: list[dict], params: dict) -> str:
+    """
+    Hash of the request, scoped per user like completion_cache_key: only
+    the same user's identical requests share a flight, so nobody's reply
+    or token usage is billed to someone else.
+    """
+    payload = json.dumps(
+        [user_id, model, messages_for_openai, params],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """
+    One upstream streamed completion shared by every identical request
+    of the same user that arrives while it is running.
+
+    A background task drives the ReplyStream and appends its frames to
+    `chunks`; subscribers replay `chunks` from the start, so late joiners
+    still get the whole reply. The task is cancelled once nobody is
+    listening any more.
+    """
+
+    def __init__(self, key: str, open_stream, user_id: str, reserved: int):
+        self.key = key
+        self.user_id = user_id
+        self.reserved = reserved
+        self.reply: ReplyStream | None = None
+        self.chunks: list[str] = []
+        self.finished = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.usage_claimed = False
+        self.opened: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._run(open_stream))
+
+    async def _run(self, open_stream):
+        try:
+            async with upstream_scheduler.slot(self.user_id, self.reserved):
+                self.reply = await open_stream()
+                self.opened.set_result(None)
+                async for frame in self.reply:
+                    self.chunks.append(frame)
+                    self._notify()
+        except BaseException as exc:
+            self.error = exc
+            if not self.opened.done():
+                self.opened.set_exception(UpstreamError("Upstream request failed"))
+                # Retrieved here so an unobserved failure isn't logged twice
+                self.opened.exception()
+            if not isinstance(exc, Exception):
+                raise
+            logger.warning("Upstream completion failed: %s", exc)
+        finally:
+            used = 0
+            if self.reply is not None:
+                # No usage chunk (cut short): assume the estimate was spent
+                used = self.reply.usage["total_tokens"] or self.reserved
+            upstream_scheduler.settle(self.user_id, self.reserved, used)
+
+            self.finished = True
+            if _flights.get(self.key) is self:
+                del _flights[self.key]
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+    def detach(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.finished:
+            self.task.cancel()
+
+
+class SharedReplyStream:
+    """
+    A subscriber's view of a _Flight. Same interface as ReplyStream.
+
+    Upstream usage is credited to exactly one subscriber: the first to
+    see the reply complete. Everyone else records zero tokens.
+    """
+
+    cached = False
+
+    def __init__(self, flight: _Flight):
+        self._flight = flight
+        self._parts: list[str] = []
+        self._detached = False
+        self.frames = 0
+        self.usage: dict[str, int] = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+        }
+        flight.subscribers += 1
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def _detach(self):
+        if not self._detached:
+            self._detached = True
+            self._flight.detach()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        flight = self._flight
+        seen = 0
+        try:
+            while True:
+                if seen < len(flight.chunks):
+                    frame = flight.chunks[seen]
+                    seen += 1
+                    self._parts.append(frame)
+                    self.frames += 1
+                    yield frame
+                    continue
+                if flight.finished:
+                    break
+                await flight.wait()
+
+            if flight.error is not None:
+                raise UpstreamError("Upstream request failed") from flight.error
+
+            if not flight.usage_claimed:
+                flight.usage_claimed = True
+                self.usage = dict(flight.reply.usage)
+        finally:
+            self._detach()
+
+
+# Running flights by request hash
+_flights: dict[str, _Flight] = {}
+
+# Non-streaming calls (summaries) by request hash
+_calls: dict[str, asyncio.Future] = {}
+
+flight_stats = {
+    "leaders": 0,
+    "followers": 0,
+}
+
+
+def single_flight_stats() -> dict:
+    return {
+        "in_flight": len(_flights) + len(_calls),
+        "leaders": flight_stats["leaders"],
+        "followers": flight_stats["followers"],
+    }
+
+
+async def _single_flight_call(key: str, factory):
+    """
+    Awaits factory() once for all concurrent callers with the same key.
+    """
+    future = _calls.get(key)
+    if future is None:
+        flight_stats["leaders"] += 1
+        future = asyncio.ensure_future(factory())
+        _calls[key] = future
+        future.add_done_callback(
+            lambda done: _calls.pop(key, None) if _calls.get(key) is done else None
+        )
+    else:
+        flight_stats["followers"] += 1
+
+    try:
+        # Shielded so one caller leaving doesn't cancel it for the rest
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        raise UpstreamError("Upstream request failed") from exc
+
+
+async def stream_completion(
+    messages_for_openai: list[dict],
+    model: str | None = None,
+    cache_key: str | None = None,
+    user_id: str | None = None,
+    **params,
+) -> SharedReplyStream:
+    """
+    Opens a streamed chat completion, or joins an identical one of the
+    same user that is already running, and returns this caller's view of it.
+
+    A new upstream call is charged to user_id's token bucket (raising
+    RateLimitedError when it is empty) and waits for a scheduler slot;
+    joining the user's running call costs nothing more.
+
+    With cache_key the finished reply is stored in completion_cache.
+    Extra keyword arguments are passed through to the API
+    (temperature, max_tokens, ...).
+    """
+    model = model or DEFAULT_CHAT_MODEL
+    user_id = user_id or SYSTEM_USER
+    key = _flight_key(user_id, model, messages_for_openai, params)
+
+    flight = _flights.get(key)
+    if flight is None:
+        reserved = await upstream_scheduler.reserve(
+            user_id,
+            estimate_request_tokens(messages_for_openai, model, params.get("max_tokens")),
+        )
+        flight_stats["leaders"] += 1
+
+        async def open_stream() -> ReplyStream:
+            resp = await client.chat.completions.create(
+                model=model,
+                messages=messages_for_openai,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params,
+            )
+            return ReplyStream(resp, cache_key=cache_key)
+
+        flight = _Flight(key, open_stream, user_id, reserved)
+        _flights[key] = flight
+    else:
+        flight_stats["followers"] += 1
+
+    stream = SharedReplyStream(flight)
+    try:
+        await asyncio.shield(flight.opened)
+    except BaseException:
+        stream._detach()
+        raise
+    return stream
+
+
 # -------------------------
 # Text-only streaming
 # -------------------------
 
-def stream_assistant_reply(
+async def stream_assistant_reply(
     messages_for_openai: list[dict],
     model: str | None = None,
-) -> tuple[Iterator[str], dict[str, int]]:
+    user_id: str | None = None,
+    cache_messages: list[dict] | None = None,
+) -> SharedReplyStream | CachedReplyStream:
     """
     Streams text-only assistant replies.
 
     messages_for_openai: list of {"role": "...", "content": "..."}
     model: OpenAI model name (defaults to gpt-4o-mini)
+    user_id: scopes the completion cache and is who the upstream call is
+             scheduled and rate limited for
+    cache_messages: what the completion cache key is built from, when it
+                    should differ from messages_for_openai
     """
     model = model or DEFAULT_CHAT_MODEL
 
-    resp = client.chat.completions.create(
+    cache_key = None
+    if settings.COMPLETION_CACHE_ENABLED and user_id:
+        cache_key = completion_cache_key(user_id, model, cache_messages or messages_for_openai)
+        cached = completion_cache.get(cache_key)
+        if cached is not None:
+            return CachedReplyStream(cached)
+
+    return await stream_completion(
+        messages_for_openai,
         model=model,
-        messages=messages_for_openai,
-        stream=True,
-        stream_options={"include_usage": True},
+        cache_key=cache_key,
+        user_id=user_id,
     )
 
-    usage: dict[str, int] = {
-        "prompt_tokens": 0,
-        "completion_tokens": 0,
-        "total_tokens": 0,
-    }
-
-    def iterator():
-        for chunk in resp:
-            if not chunk.choices:
-                chunk_usage = getattr(chunk, "usage", None)
-                if chunk_usage is not None:
-                    usage["prompt_tokens"] = getattr(
-                        chunk_usage, "prompt_tokens", 0
-                    ) or 0
-                    usage["completion_tokens"] = getattr(
-                        chunk_usage, "completion_tokens", 0
-                    ) or 0
-                    usage["total_tokens"] = getattr(
-                        chunk_usage, "total_tokens", 0
-                    ) or 0
-                continue
-
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                yield delta.content
-
-    return iterator(), usage
-
     
 
 # -------------------------
-# Rolling summary (unchanged)
+# Rolling summary
 # -------------------------
 
-def summarize_chat(previous_summary: str, recent_messages_text: str) -> str:
+async def summarize_chat(
+    previous_summary: str,
+    recent_messages_text: str,
+    user_id: str | None = None,
+) -> str:
     """
     Produces a rolling summary. Keep it short, stable, and focused on:
     goals, decisions, constraints, and key facts.
@@ -88,67 +521,55 @@ def summarize_chat(previous_summary: str, recent_messages_text: str) -> str:
     Return the updated summary only.
     """.strip()
 
-    resp = client.chat.completions.create(
-        model=DEFAULT_CHAT_MODEL,
-        messages=[
-            {"role": "system", "content": "You are a summarization engine."},
-            {"role": "user", "content": prompt},
-        ],
+    messages = [
+        {"role": "system", "content": "You are a summarization engine."},
+        {"role": "user", "content": prompt},
+    ]
+
+    owner = user_id or SYSTEM_USER
+
+    async def create() -> str:
+        # Background work: wait for the bucket instead of failing
+        reserved = await upstream_scheduler.reserve(
+            owner,
+            estimate_request_tokens(messages, DEFAULT_CHAT_MODEL),
+            wait=True,
+        )
+        used = 0
+        try:
+            async with upstream_scheduler.slot(owner, reserved):
+                resp = await client.chat.completions.create(
+                    model=DEFAULT_CHAT_MODEL,
+                    messages=messages,
+                )
+            used = getattr(resp.usage, "total_tokens", 0) or reserved
+        finally:
+            upstream_scheduler.settle(owner, reserved, used)
+        return resp.choices[0].message.content or ""
+
+    return await _single_flight_call(
+        _flight_key(owner, DEFAULT_CHAT_MODEL, messages, {}),
+        create,
     )
 
-    return resp.choices[0].message.content or ""
-
 
 # -------------------------
 # Vision (image + text)
 # -------------------------
 
-def stream_vision_reply(
+async def stream_vision_reply(
     messages_for_openai: list[dict],
     model: str | None = None,
-) -> tuple[Iterator[str], dict[str, int]]:
+    user_id: str | None = None,
+) -> SharedReplyStream:
     """
     Streams vision + text replies.
 
     messages_for_openai: multimodal OpenAI messages
     model: OpenAI model name (defaults to gpt-4o-mini)
+    user_id: who the upstream call is scheduled and rate limited for
     """
-    model = model or DEFAULT_CHAT_MODEL
-
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages_for_openai,
-        stream=True,
-        stream_options={"include_usage": True},
-    )
-
-    usage: dict[str, int] = {
-        "prompt_tokens": 0,
-        "completion_tokens": 0,
-        "total_tokens": 0,
-    }
-
-    def iterator():
-        for chunk in resp:
-            if not chunk.choices:
-                chunk_usage = getattr(chunk, "usage", None)
-                if chunk_usage is not None:
-                    usage["prompt_tokens"] = getattr(
-                        chunk_usage, "prompt_tokens", 0
-                    ) or 0
-                    usage["completion_tokens"] = getattr(
-                        chunk_usage, "completion_tokens", 0
-                    ) or 0
-                    usage["total_tokens"] = getattr(
-                        chunk_usage, "total_tokens", 0
-                    ) or 0
-                continue
-
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                yield delta.content
-
-    return iterator(), usage
+    return await stream_completion(messages_for_openai, model=model, user_id=user_id)
 
 
 # -------------------------
@@ -159,11 +580,26 @@ def image_bytes_to_base64(image_bytes: bytes) -> str:
     return base64.b64encode(image_bytes).decode("utf-8")
 
 
+def image_data_url(image_bytes: bytes, mime: str) -> str:
+    return f"data:{mime};base64,{image_bytes_to_base64(image_bytes)}"
+
+
+# Ready-to-send data: URLs keyed by message id, so images in the context
+# window are read and encoded once instead of on every turn.
+image_url_cache = LRUCache(
+    max_bytes=settings.IMAGE_URL_CACHE_MB * 1024 * 1024,
+    sizeof=len,
+)
+
+
 # -------------------------
-# Title generation (unchanged)
+# Title generation
 # -------------------------
 
-def stream_title_from_prompt(user_prompt: str):
+async def stream_title_from_prompt(
+    user_prompt: str,
+    user_id: str | None = None,
+) -> SharedReplyStream:
     """
     Generates a short chat title based on the first user prompt.
     """
@@ -172,9 +608,8 @@ def stream_title_from_prompt(user_prompt: str):
         "Use Title Case and avoid quotes or punctuation at the end."
     )
 
-    resp = client.chat.completions.create(
-        model=DEFAULT_CHAT_MODEL,
-        messages=[
+    return await stream_completion(
+        [
             {"role": "system", "content": instruction},
             {
                 "role": "user",
@@ -185,12 +620,8 @@ def stream_title_from_prompt(user_prompt: str):
                 ),
             },
         ],
+        model=DEFAULT_CHAT_MODEL,
+        user_id=user_id,
         temperature=0.3,
         max_tokens=32,
-        stream=True,
     )
-
-    for chunk in resp:
-        delta = chunk.choices[0].delta
-        if delta and delta.content:
-            yield delta.content
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db import crud
+from app.db.blob_store import blob_store
+from app.db.database import SessionLocal, engine
+from app.db.migrate import reclaim_free_pages
+
+logger = logging.getLogger(__name__)
+
+# Tombstones picked up per pass
+SESSIONS_PER_PASS = 100
+
+
+# -------------------------
+# DB helpers (run in threadpool)
+# -------------------------
+
+def _list_tombstones() -> list[str]:
+    db = SessionLocal()
+    try:
+        return crud.list_tombstoned_sessions(db, limit=SESSIONS_PER_PASS)
+    finally:
+        db.close()
+
+
+def _purge_batch(session_id: str, batch_size: int) -> tuple[int, bool]:
+    db = SessionLocal()
+    try:
+        return crud.purge_session_batch(db, session_id, batch_size)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _list_pending_blobs() -> list[str]:
+    db = SessionLocal()
+    try:
+        return crud.list_pending_blob_deletions(db)
+    finally:
+        db.close()
+
+
+def _delete_blob_if_orphaned(digest: str, grace: float) -> bool | None:
+    """
+    True if deleted, False if kept for now (too fresh), None if the blob
+    is gone or still referenced. Unless kept, the digest leaves the queue.
+    """
+    db = SessionLocal()
+    try:
+        if crud.blob_referenced(db, digest):
+            crud.drop_pending_blob_deletion(db, digest)
+            return None
+
+        modified = blob_store.modified_at(digest)
+        if modified is not None:
+            if time.time() - modified < grace:
+                return False
+            blob_store.delete(digest)
+
+        crud.drop_pending_blob_deletion(db, digest)
+        return modified is not None
+    finally:
+        db.close()
+
+
+# -------------------------
+# Purger
+# -------------------------
+
+class SessionPurger:
+    """
+    Background removal of tombstoned sessions.
+
+    delete_session only marks a session deleted. This worker then removes
+    its messages in batches of batch_size, each its own short transaction
+    with a pause in between, so other writers never wait behind one big
+    delete. The image digests they referenced are queued in the database;
+    each blob is deleted once no message references it and it is older
+    than the grace period (a concurrent upload of the same bytes
+    refreshes it). Finally, freed pages are handed back to the filesystem
+    with PRAGMA incremental_vacuum, a few pages per step.
+
+    wake() starts a pass right away; otherwise one runs every interval,
+    which also picks up tombstones left by a previous process.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        interval: float,
+        pause: float,
+        vacuum_pages: int,
+        blob_grace: float,
+    ):
+        self.batch_size = max(batch_size, 1)
+        self.interval = interval
+        self.pause = pause
+        self.vacuum_pages = max(vacuum_pages, 1)
+        self.blob_grace = blob_grace
+
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+        self.passes = 0
+        self.sessions_purged = 0
+        self.messages_purged = 0
+        self.blobs_deleted = 0
+        self.blobs_pending = 0
+        self.pages_reclaimed = 0
+        self.failures = 0
+        self.last_pass_seconds = 0.0
+
+    # -------------------------
+    # Lifecycle
+    # -------------------------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Unfinished purges resume from their tombstones on next startup
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.purge()
+            except Exception:
+                self.failures += 1
+                logger.exception("Session purge pass failed")
+
+    # -------------------------
+    # Purging
+    # -------------------------
+
+    async def purge(self):
+        started = time.monotonic()
+        purged_any = False
+
+        while True:
+            session_ids = await run_in_threadpool(_list_tombstones)
+            if not session_ids:
+                break
+            for session_id in session_ids:
+                await self._purge_session(session_id)
+            purged_any = True
+
+        await self._delete_orphan_blobs()
+        if purged_any:
+            await self.reclaim_space()
+
+        self.passes += 1
+        self.last_pass_seconds = time.monotonic() - started
+
+    async def _purge_session(self, session_id: str):
+        while True:
+            deleted, finished = await run_in_threadpool(
+                _purge_batch, session_id, self.batch_size
+            )
+            self.messages_purged += deleted
+            if finished:
+                self.sessions_purged += 1
+                return
+            await asyncio.sleep(self.pause)
+
+    async def _delete_orphan_blobs(self):
+        # Queued digests survive restarts, so this also finishes earlier runs
+        digests = await run_in_threadpool(_list_pending_blobs)
+        kept = 0
+        for digest in digests:
+            try:
+                result = await run_in_threadpool(
+                    _delete_blob_if_orphaned, digest, self.blob_grace
+                )
+            except Exception:
+                self.failures += 1
+                logger.exception("Could not delete orphaned blob %s", digest)
+                kept += 1
+                continue
+            if result is False:
+                kept += 1  # too fresh; retried next pass
+            elif result:
+                self.blobs_deleted += 1
+        self.blobs_pending = kept
+
+    async def reclaim_space(self):
+        """
+        Hands free pages back to the filesystem, a few at a time.
+        """
+        if engine.dialect.name != "sqlite":
+            return
+
+        while True:
+            reclaimed, left = await run_in_threadpool(
+                reclaim_free_pages, engine, self.vacuum_pages
+            )
+            self.pages_reclaimed += reclaimed
+            # Stops when done, or when auto_vacuum isn't incremental (no progress)
+            if not left or not reclaimed:
+                return
+            await asyncio.sleep(self.pause)
+
+    # -------------------------
+    # Monitoring
+    # -------------------------
+
+    def stats(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "interval_seconds": self.interval,
+            "running": self._task is not None,
+            "passes": self.passes,
+            "sessions_purged": self.sessions_purged,
+            "messages_purged": self.messages_purged,
+            "blobs_deleted": self.blobs_deleted,
+            "blobs_pending": self.blobs_pending,
+            "pages_reclaimed": self.pages_reclaimed,
+            "failures": self.failures,
+            "last_pass_seconds": round(self.last_pass_seconds, 4),
+        }
+
+
+session_purger = SessionPurger(
+    batch_size=settings.PURGE_BATCH_SIZE,
+    interval=settings.PURGE_INTERVAL_SECONDS,
+    pause=settings.PURGE_PAUSE_SECONDS,
+    vacuum_pages=settings.VACUUM_PAGES_PER_STEP,
+    blob_grace=settings.PURGE_BLOB_GRACE_SECONDS,
+)
@@ -0,0 +1,303 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+
+from app.core.config import settings
+from app.core.tokens import count_message_tokens
+from app.services.context_builder import LEGACY_IMAGE_TOKENS
+
+# Completion allowance when a request sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+
+# Calls not made on behalf of a user share this key
+SYSTEM_USER = "_system"
+
+
+class RateLimitedError(Exception):
+    """
+    Raised when a user's token bucket can't cover a request.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Upstream token rate limit exceeded")
+        self.retry_after = retry_after
+
+
+def estimate_request_tokens(
+    messages_for_openai: list[dict],
+    model: str,
+    max_tokens: int | None = None,
+) -> int:
+    """
+    Rough upstream cost of a request: prompt tokens plus the completion
+    allowance. Image blocks are charged a flat high-detail cost.
+    """
+    total = 0
+    for m in messages_for_openai:
+        content = m.get("content")
+        if isinstance(content, list):
+            text = " ".join(b.get("text", "") for b in content if b.get("type") == "text")
+            images = sum(1 for b in content if b.get("type") == "image_url")
+            total += count_message_tokens(text, model) + images * LEGACY_IMAGE_TOKENS
+        else:
+            total += count_message_tokens(content, model)
+    return total + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class _UserState:
+    __slots__ = ("tokens", "refilled_at", "active", "queued", "last_finish", "history")
+
+    def __init__(self, capacity: float, history: int):
+        self.tokens = capacity
+        self.refilled_at = time.monotonic()
+        self.active = 0
+        self.queued = 0
+        self.last_finish = 0.0
+        self.history = history
+
+
+class _Waiter:
+    __slots__ = ("user_id", "start", "future", "cancelled")
+
+    def __init__(self, user_id: str, start: float, future: asyncio.Future):
+        self.user_id = user_id
+        self.start = start
+        self.future = future
+        self.cancelled = False
+
+
+class UpstreamScheduler:
+    """
+    Admission and ordering for upstream completion calls.
+
+    - Token bucket per user, in estimated tokens: reserve() rejects (or
+      waits) when the bucket can't cover a request; settle() refunds the
+      difference once real usage is known.
+    - slot() caps concurrent calls globally and per user. When slots are
+      contended, waiters are served by weighted fair queuing on virtual
+      finish time, so a user with many queued calls can't starve others.
+    - Weights come from lifetime usage (seeded from UserTokenUsage):
+      heavy users get a smaller share under contention.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_user_concurrency: int,
+        bucket_capacity: int,
+        refill_per_second: float,
+        weight_scale: int,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.bucket_capacity = bucket_capacity
+        self.refill_per_second = refill_per_second
+        self.weight_scale = weight_scale
+
+        self._users: dict[str, _UserState] = {}
+        self._history: dict[str, int] = {}
+        self._queue: list[tuple[float, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self.active = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.queued_total = 0
+
+    # -------------------------
+    # Weights
+    # -------------------------
+
+    def seed(self, totals: dict[str, int]):
+        """
+        Loads lifetime token totals per user.
+        """
+        self._history.update(totals)
+        for user_id, state in self._users.items():
+            state.history = self._history.get(user_id, 0)
+
+    def weight(self, user_id: str) -> float:
+        history = self._user(user_id).history
+        return 1.0 / (1.0 + math.log10(1.0 + history / self.weight_scale))
+
+    def _user(self, user_id: str) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = _UserState(self.bucket_capacity, self._history.get(user_id, 0))
+            self._users[user_id] = state
+        return state
+
+    # -------------------------
+    # Token buckets
+    # -------------------------
+
+    def _refill(self, state: _UserState):
+        now = time.monotonic()
+        state.tokens = min(
+            self.bucket_capacity,
+            state.tokens + (now - state.refilled_at) * self.refill_per_second,
+        )
+        state.refilled_at = now
+
+    async def reserve(self, user_id: str, tokens: int, wait: bool = False) -> int:
+        """
+        Takes tokens from the user's bucket and returns the amount taken.
+        Raises RateLimitedError, or sleeps until refilled when wait=True.
+        """
+        tokens = min(tokens, self.bucket_capacity)
+        state = self._user(user_id)
+
+        while True:
+            self._refill(state)
+            if state.tokens >= tokens:
+                state.tokens -= tokens
+                self.admitted += 1
+                return tokens
+
+            delay = (tokens - state.tokens) / self.refill_per_second
+            if not wait:
+                self.rejected += 1
+                raise RateLimitedError(retry_after=max(1, math.ceil(delay)))
+            await asyncio.sleep(delay)
+
+    def settle(self, user_id: str, reserved: int, used: int):
+        """
+        Refunds an over-estimate (or charges an under-estimate) and adds
+        the real usage to the user's history.
+        """
+        state = self._user(user_id)
+        self._refill(state)
+        state.tokens = min(self.bucket_capacity, state.tokens + reserved - used)
+        state.history += used
+        self._history[user_id] = state.history
+
+    # -------------------------
+    # Concurrency slots
+    # -------------------------
+
+    def _can_run(self, state: _UserState) -> bool:
+        return (
+            self.active < self.max_concurrency
+            and state.active < self.per_user_concurrency
+        )
+
+    def _grant(self, state: _UserState):
+        self.active += 1
+        state.active += 1
+
+    def _dispatch(self):
+        skipped = []
+        while self._queue and self.active < self.max_concurrency:
+            entry = heapq.heappop(self._queue)
+            waiter = entry[2]
+            if waiter.cancelled:
+                continue
+            state = self._users[waiter.user_id]
+            if state.active >= self.per_user_concurrency:
+                skipped.append(entry)
+                continue
+            state.queued -= 1
+            self._vtime = max(self._vtime, waiter.start)
+            self._grant(state)
+            waiter.future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+    def _release(self, user_id: str):
+        state = self._users[user_id]
+        self.active -= 1
+        state.active -= 1
+        self._dispatch()
+        self._prune()
+
+    def _prune(self):
+        # Drop idle users whose bucket has refilled; their state is implied
+        if len(self._users) <= settings.SCHEDULER_MAX_TRACKED_USERS:
+            return
+        for user_id in list(self._users):
+            state = self._users[user_id]
+            if state.active or state.queued:
+                continue
+            self._refill(state)
+            if state.tokens >= self.bucket_capacity:
+                del self._users[user_id]
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, tokens: int):
+        """
+        Holds one upstream concurrency slot for the duration of the block.
+        """
+        state = self._user(user_id)
+        start = max(self._vtime, state.last_finish)
+        finish = start + tokens / self.weight(user_id)
+        state.last_finish = finish
+
+        if self._can_run(state) and not self._queue:
+            # Advance virtual time as _dispatch does, or uncontended calls
+            # pile up finish tags and the user loses out once contended
+            self._vtime = max(self._vtime, start)
+            self._grant(state)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            waiter = _Waiter(user_id, start, future)
+            heapq.heappush(self._queue, (finish, next(self._seq), waiter))
+            state.queued += 1
+            self.queued_total += 1
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just as we were cancelled: hand the slot back
+                    self._release(user_id)
+                else:
+                    waiter.cancelled = True
+                    state.queued -= 1
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    # -------------------------
+    # Monitoring
+    # -------------------------
+
+    def stats(self) -> dict:
+        users = {}
+        for user_id, state in self._users.items():
+            if not (state.active or state.queued):
+                continue
+            self._refill(state)
+            users[user_id] = {
+                "active": state.active,
+                "queued": state.queued,
+                "bucket_tokens": int(state.tokens),
+                "weight": round(self.weight(user_id), 4),
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "per_user_concurrency": self.per_user_concurrency,
+            "bucket_capacity": self.bucket_capacity,
+            "refill_per_second": self.refill_per_second,
+            "active": self.active,
+            "queued": sum(1 for _, _, w in self._queue if not w.cancelled),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queued_total": self.queued_total,
+            "users": users,
+        }
+
+
+upstream_scheduler = UpstreamScheduler(
+    max_concurrency=settings.SCHEDULER_MAX_CONCURRENCY,
+    per_user_concurrency=settings.SCHEDULER_USER_CONCURRENCY,
+    bucket_capacity=settings.USER_TOKEN_BUCKET_CAPACITY,
+    refill_per_second=settings.USER_TOKEN_REFILL_PER_SECOND,
+    weight_scale=settings.SCHEDULER_WEIGHT_SCALE,
+)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db import crud
+from app.db.database import SessionLocal
+from app.services.openai_service import summarize_chat
+
+logger = logging.getLogger(__name__)
+
+# How many recent messages feed each summary update
+SUMMARY_WINDOW = 8
+
+SessionKey = tuple[str, str]  # (user_id, session_id)
+
+
+# -------------------------
+# DB helpers (run in threadpool)
+# -------------------------
+
+def _load_summary_input(user_id: str, session_id: str) -> tuple[str, str] | None:
+    db = SessionLocal()
+    try:
+        if not crud.get_session(db, user_id, session_id):
+            return None
+
+        prev = crud.get_summary(db, user_id, session_id)
+        recent = crud.get_recent_messages(
+            db,
+            user_id,
+            session_id,
+            limit=SUMMARY_WINDOW,
+        )
+        recent_text = "\n".join(
+            f"{m.role}: {m.content or '[image]'}" for m in recent
+        )
+        return prev, recent_text
+    finally:
+        db.close()
+
+
+def _store_summary(user_id: str, session_id: str, summary: str):
+    db = SessionLocal()
+    try:
+        if crud.get_session(db, user_id, session_id):
+            crud.set_summary(db, user_id, session_id, summary)
+    finally:
+        db.close()
+
+
+# -------------------------
+# Queue
+# -------------------------
+
+class SummaryQueue:
+    """
+    Background rolling-summary updates, off the response path.
+
+    Triggers are coalesced per session: while a session is waiting in the
+    queue, further triggers for it are folded into the pending one. A
+    trigger that arrives while the session is being summarized schedules
+    exactly one follow-up run. The summary always reads the latest
+    messages, so nothing is lost by coalescing.
+    """
+
+    def __init__(self, workers: int):
+        self._workers_count = max(workers, 1)
+        self._queue: asyncio.Queue[SessionKey] = asyncio.Queue()
+        self._pending: dict[SessionKey, float] = {}
+        self._running: set[SessionKey] = set()
+        self._rerun: set[SessionKey] = set()
+        self._workers: list[asyncio.Task] = []
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(self._workers_count)
+        ]
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Gives queued summaries a short grace period, then cancels workers.
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Dropping %d pending summary update(s) on shutdown",
+                len(self._pending),
+            )
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def enqueue(self, user_id: str, session_id: str):
+        key = (user_id, session_id)
+        if key in self._pending:
+            self.coalesced += 1
+            return
+
+        self.enqueued += 1
+        self._pending[key] = time.monotonic()
+        self._queue.put_nowait(key)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        oldest = min(self._pending.values(), default=None)
+        return {
+            "workers": self._workers_count,
+            "queue_depth": len(self._pending),
+            "running": len(self._running),
+            "oldest_pending_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "last_lag_seconds": round(self.last_lag_seconds, 3),
+            "max_lag_seconds": round(self.max_lag_seconds, 3),
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                enqueued_at = self._pending.pop(key, time.monotonic())
+
+                if key in self._running:
+                    # Another worker has this session; run once more after it
+                    self._rerun.add(key)
+                    continue
+
+                lag = time.monotonic() - enqueued_at
+                self.last_lag_seconds = lag
+                self.max_lag_seconds = max(self.max_lag_seconds, lag)
+
+                self._running.add(key)
+                try:
+                    await self._summarize(*key)
+                    self.completed += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Summary update failed for session %s", key[1])
+                finally:
+                    self._running.discard(key)
+
+                if key in self._rerun:
+                    self._rerun.discard(key)
+                    self.enqueue(*key)
+            finally:
+                self._queue.task_done()
+
+    async def _summarize(self, user_id: str, session_id: str):
+        summary_input = await run_in_threadpool(
+            _load_summary_input, user_id, session_id
+        )
+        if summary_input is None:
+            return
+
+        new_summary = await summarize_chat(*summary_input, user_id=user_id)
+        await run_in_threadpool(_store_summary, user_id, session_id, new_summary)
+
+
+summary_queue = SummaryQueue(workers=settings.SUMMARY_WORKERS)
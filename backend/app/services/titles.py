@@ -0,0 +1,111 @@
+import re
+from collections import Counter
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+# Prompts this short are titled locally instead of asking the model
+LOCAL_TITLE_MAX_WORDS = 6
+
+# Title for openers that carry no topic at all ("hi", "thanks!", ...)
+SMALL_TALK_TITLE = "Casual Chat"
+
+SMALL_TALK = {
+    "hi", "hii", "hello", "hey", "heya", "yo", "sup", "hola", "howdy",
+    "good", "morning", "afternoon", "evening", "there",
+    "thanks", "thank", "you", "thx", "ty", "ok", "okay", "cool",
+    "test", "testing", "ping", "hmm", "lol",
+}
+
+# Lower-cased inside a title (never as the first word)
+MINOR_WORDS = {
+    "a", "an", "and", "as", "at", "but", "by", "for", "from", "in",
+    "into", "nor", "of", "on", "or", "the", "to", "vs", "with",
+}
+
+_WORD_RE = re.compile(r"[\w][\w'’.+#-]*")
+
+# Model-generated titles keyed by normalized prompt
+title_cache = LRUCache(
+    max_entries=settings.TITLE_CACHE_ENTRIES,
+    ttl=settings.TITLE_CACHE_TTL_SECONDS,
+)
+
+# Which path served each /chat/title request: "cache", "local" or "model"
+title_sources: Counter = Counter()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Cache key for a prompt: case-folded, whitespace collapsed and
+    surrounding punctuation dropped.
+    """
+    return " ".join(prompt.casefold().split()).strip(" .,!?;:'\"")
+
+
+def _title_case(words: list[str]) -> str:
+    out = []
+    for i, word in enumerate(words):
+        lower = word.lower()
+        if i and lower in MINOR_WORDS:
+            out.append(lower)
+        else:
+            # Keep existing capitals (acronyms, product names)
+            out.append(word[:1].upper() + word[1:])
+    return " ".join(out)
+
+
+def local_title(prompt: str) -> str | None:
+    """
+    Extractive title for short or low-information prompts.
+    Returns None when the prompt should go to the model.
+    """
+    words = [w.rstrip(".-'’") for w in _WORD_RE.findall(prompt)]
+    words = [w for w in words if w]
+
+    if not words or all(w.lower() in SMALL_TALK for w in words):
+        return SMALL_TALK_TITLE
+
+    if len(words) > LOCAL_TITLE_MAX_WORDS:
+        return None
+
+    # Drop a leading greeting: "hey, docker networking" -> "Docker Networking"
+    while words and words[0].lower() in SMALL_TALK:
+        words.pop(0)
+
+    return _title_case(words)
+
+
+def lookup_title(prompt: str) -> tuple[str | None, str]:
+    """
+    Resolves a title without the model when possible.
+    Returns (title, source); title is None when the model must be asked.
+    """
+    cached = title_cache.get(normalize_prompt(prompt))
+    if cached is not None:
+        title_sources["cache"] += 1
+        return cached, "cache"
+
+    title = local_title(prompt)
+    if title is not None:
+        title_sources["local"] += 1
+        return title, "local"
+
+    title_sources["model"] += 1
+    return None, "model"
+
+
+def remember_title(prompt: str, title: str):
+    title_cache.set(normalize_prompt(prompt), title)
+
+
+def title_stats() -> dict:
+    served = sum(title_sources.values())
+    return {
+        "served": served,
+        "cache": title_sources["cache"],
+        "local": title_sources["local"],
+        "model": title_sources["model"],
+        "model_skip_rate": round(1 - title_sources["model"] / served, 4) if served else 0.0,
+        "cache_stats": title_cache.stats(),
+    }
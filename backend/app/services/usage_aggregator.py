@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db import crud
+from app.db.database import SessionLocal
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process journal locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+UsageKey = tuple[str, str, int]  # (user_id, model, hour as unix time)
+UsageDelta = tuple[int, int]  # (prompt_tokens, completion_tokens)
+
+HOUR_SECONDS = 3600
+
+# Hourly rollups are compacted at most this often
+COMPACT_EVERY_SECONDS = 3600
+
+
+def _current_hour() -> int:
+    now = int(time.time())
+    return now - now % HOUR_SECONDS
+
+
+def _merge(into: dict[UsageKey, UsageDelta], key: UsageKey, prompt: int, completion: int):
+    p, c = into.get(key, (0, 0))
+    into[key] = (p + prompt, c + completion)
+
+
+class _Batch:
+    """
+    Deltas accumulated since the last flush, mirrored line-by-line to a
+    journal file named after the batch id.
+    """
+
+    def __init__(self, journal_dir: str):
+        self.batch_id = uuid.uuid4().hex
+        self.deltas: dict[UsageKey, UsageDelta] = {}
+        self.path = os.path.join(journal_dir, f"{self.batch_id}.jsonl")
+        self._file = None
+
+    def append(self, key: UsageKey, prompt: int, completion: int, fsync: bool):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            if fcntl is not None:
+                # Held while we own the batch; recovery skips locked files
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._file.write(json.dumps([key[0], key[1], prompt, completion, key[2]]) + "\n")
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        _merge(self.deltas, key, prompt, completion)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class UsageAggregator:
+    """
+    In-process buffer for token usage.
+
+    add() only touches memory and appends one line to the current batch's
+    journal. flush() applies the batch in one transaction (lifetime
+    totals, hourly and daily rollups, and its id in usage_flushes), then
+    deletes the journal. After a crash, recover() replays journals whose
+    batch id isn't recorded yet, so every delta counts exactly once.
+
+    Readers combine stored totals with pending() under consistent_read()
+    so numbers stay exact while batches are in flight.
+    """
+
+    def __init__(
+        self,
+        journal_dir: str,
+        interval: float,
+        fsync: bool = False,
+        hourly_retention_days: int = 14,
+    ):
+        self.journal_dir = journal_dir
+        self.interval = interval
+        self.fsync = fsync
+        self.hourly_retention_days = hourly_retention_days
+        self._compacted_at = 0.0
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._current: _Batch | None = None
+        # Swapped-out batches not yet committed (in flight or failed)
+        self._unflushed: list[_Batch] = []
+        self._task: asyncio.Task | None = None
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failures = 0
+        self.replayed_batches = 0
+        self.compacted_rows = 0
+        self.last_flush_seconds = 0.0
+
+    # -------------------------
+    # Recording
+    # -------------------------
+
+    def add(self, user_id: str, model: str, prompt_tokens: int, completion_tokens: int):
+        prompt_tokens = max(prompt_tokens, 0)
+        completion_tokens = max(completion_tokens, 0)
+        if not (prompt_tokens or completion_tokens):
+            return
+
+        with self._lock:
+            if self._current is None:
+                os.makedirs(self.journal_dir, exist_ok=True)
+                self._current = _Batch(self.journal_dir)
+            self._current.append(
+                (user_id, model, _current_hour()),
+                prompt_tokens,
+                completion_tokens,
+                self.fsync,
+            )
+
+    def pending(self, user_id: str) -> dict[str, int]:
+        """
+        Unflushed total tokens per model for one user.
+        """
+        totals: dict[str, int] = {}
+        for (_hour, model), tokens in self.pending_buckets(user_id).items():
+            totals[model] = totals.get(model, 0) + tokens
+        return totals
+
+    def pending_buckets(self, user_id: str) -> dict[tuple[int, str], int]:
+        """
+        Unflushed total tokens per (hour as unix time, model) for one user.
+        """
+        totals: dict[tuple[int, str], int] = {}
+        with self._lock:
+            batches = self._unflushed + ([self._current] if self._current else [])
+            for batch in batches:
+                for (uid, model, hour), (p, c) in batch.deltas.items():
+                    if uid == user_id:
+                        totals[(hour, model)] = totals.get((hour, model), 0) + p + c
+        return totals
+
+    @contextmanager
+    def consistent_read(self):
+        """
+        Blocks flushes, so stored rows plus pending() count each delta once.
+        """
+        with self._flush_lock:
+            yield
+
+    # -------------------------
+    # Flushing
+    # -------------------------
+
+    def flush(self) -> int:
+        """
+        Applies every buffered batch. Returns the number of rows upserted.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._current is not None:
+                    self._current.close()
+                    self._unflushed.append(self._current)
+                    self._current = None
+                batches = list(self._unflushed)
+
+            rows = 0
+            started = time.monotonic()
+            for batch in batches:
+                db = SessionLocal()
+                try:
+                    crud.apply_token_usage_batch(db, batch.batch_id, batch.deltas)
+                except Exception:
+                    db.rollback()
+                    self.failures += 1
+                    # Kept in memory and on disk; retried on the next flush
+                    logger.exception("Token usage flush failed for batch %s", batch.batch_id)
+                    break
+                finally:
+                    db.close()
+
+                with self._lock:
+                    self._unflushed.remove(batch)
+                batch.discard()
+                rows += len(batch.deltas)
+
+            if rows:
+                self.flushes += 1
+                self.rows_flushed += rows
+                self.last_flush_seconds = time.monotonic() - started
+            return rows
+
+    def recover(self) -> int:
+        """
+        Replays journals left behind by a crash. Returns batches applied.
+        """
+        if not os.path.isdir(self.journal_dir):
+            return 0
+
+        applied = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            batch_id = name[: -len(".jsonl")]
+
+            with open(path, "r", encoding="utf-8") as f:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # another live process owns this batch
+
+                deltas: dict[UsageKey, UsageDelta] = {}
+                for line in f:
+                    try:
+                        user_id, model, prompt, completion, hour = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from the crash
+                    _merge(deltas, (user_id, model, hour), prompt, completion)
+
+                db = SessionLocal()
+                try:
+                    if crud.apply_token_usage_batch(db, batch_id, deltas):
+                        applied += 1
+                except Exception:
+                    # Left on disk for the next startup
+                    logger.exception("Token usage replay failed for batch %s", batch_id)
+                    continue
+                finally:
+                    db.close()
+
+            os.remove(path)
+
+        if applied:
+            logger.info("Replayed %d token usage batch(es) from the journal", applied)
+        self.replayed_batches += applied
+        return applied
+
+    # -------------------------
+    # Lifecycle
+    # -------------------------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await run_in_threadpool(self.flush)
+
+    def compact(self) -> int:
+        """
+        Folds hourly rollups past retention into the daily ones.
+        """
+        before = datetime.now(timezone.utc) - timedelta(days=self.hourly_retention_days)
+        db = SessionLocal()
+        try:
+            deleted = crud.compact_token_usage(db, before)
+        finally:
+            db.close()
+        self.compacted_rows += deleted
+        self._compacted_at = time.monotonic()
+        return deleted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_in_threadpool(self.flush)
+                if time.monotonic() - self._compacted_at >= COMPACT_EVERY_SECONDS:
+                    await run_in_threadpool(self.compact)
+            except Exception:
+                logger.exception("Token usage flush loop error")
+
+    def stats(self) -> dict:
+        with self._lock:
+            batches = self._unflushed + ([self._current] if self._current else [])
+            pending_rows = sum(len(b.deltas) for b in batches)
+        return {
+            "interval_seconds": self.interval,
+            "pending_batches": len(batches),
+            "pending_rows": pending_rows,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "failures": self.failures,
+            "replayed_batches": self.replayed_batches,
+            "compacted_rows": self.compacted_rows,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+
+usage_aggregator = UsageAggregator(
+    journal_dir=settings.USAGE_JOURNAL_PATH,
+    interval=settings.USAGE_FLUSH_INTERVAL_SECONDS,
+    fsync=settings.USAGE_JOURNAL_FSYNC,
+    hourly_retention_days=settings.USAGE_HOURLY_RETENTION_DAYS,
+)
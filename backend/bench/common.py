@@ -0,0 +1,140 @@
+"""
+Shared helpers for the benchmark scripts in this directory.
+
+Scripts run from the backend directory (python -m bench.<name>). Each one
+points the app at a throwaway database and blob directory, and the ones
+that exercise chat replace the OpenAI client with a local fake, so no
+network access or API key is needed.
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_env(name: str, **overrides: str) -> str:
+    """
+    Points the app at a fresh working directory. Must run before anything
+    under `app` is imported. Returns the directory.
+    """
+    workdir = os.path.join(tempfile.gettempdir(), f"chat-bench-{name}")
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("JWT_SECRET", "bench")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'chat.db')}"
+    os.environ["BLOB_STORE_PATH"] = os.path.join(workdir, "blobs")
+    os.environ["USAGE_JOURNAL_PATH"] = os.path.join(workdir, "usage_journal")
+    os.environ.update(overrides)
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return workdir
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct), len(ordered) - 1)]
+
+
+# -------------------------
+# Fake upstream
+# -------------------------
+
+class _FakeStream:
+    def __init__(self, parts: list[str], delay: float):
+        self.parts = parts
+        self.delay = delay
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for part in self.parts:
+            await asyncio.sleep(self.delay)
+            delta = types.SimpleNamespace(content=part)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+        usage = types.SimpleNamespace(
+            prompt_tokens=20,
+            completion_tokens=len(self.parts),
+            total_tokens=20 + len(self.parts),
+        )
+        yield types.SimpleNamespace(choices=[], usage=usage)
+
+    async def close(self):
+        pass
+
+
+class _FakeCompletions:
+    def __init__(self, tokens: int, delay: float):
+        self.tokens = tokens
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if kwargs.get("stream"):
+            return _FakeStream(["tok "] * self.tokens, self.delay)
+        await asyncio.sleep(self.delay)
+        message = types.SimpleNamespace(content="summary")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+def install_fake_openai(tokens: int = 20, delay: float = 0.05) -> _FakeCompletions:
+    """
+    Replaces the OpenAI client with one that streams `tokens` deltas,
+    `delay` seconds apart.
+    """
+    from app.services import openai_service
+
+    completions = _FakeCompletions(tokens, delay)
+    openai_service.client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=completions)
+    )
+    return completions
+
+
+# -------------------------
+# Minimal HTTP/1.1 client (stdlib only)
+# -------------------------
+
+async def http_request(
+    host: str,
+    port: int,
+    method: str,
+    path: str,
+    body: bytes = b"",
+    headers: dict[str, str] | None = None,
+) -> tuple[int, bytes, float, float]:
+    """
+    Sends one request and reads the response to the end.
+    Returns (status, raw body, seconds to first byte, total seconds).
+    """
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}",
+        "Connection: close",
+        f"Content-Length: {len(body)}",
+    ]
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    first_byte = time.perf_counter() - started
+    data = await reader.read()
+    writer.close()
+
+    status = int(status_line.split()[1]) if status_line else 0
+    _, _, payload = data.partition(b"\r\n\r\n")
+    return status, payload, first_byte, time.perf_counter() - started
@@ -0,0 +1,125 @@
+"""
+Concurrent streaming load test for /chat.
+
+Opens --streams concurrent streaming replies (each one slow, from a fake
+upstream) against a single in-process uvicorn worker, while probing a
+cheap authenticated endpoint. With a threadpool-bound (sync) streaming
+path the probes stall once ~40 streams are open; with the async path
+every stream completes and probe latency stays flat.
+
+    cd backend && python -m bench.load_streams --streams 400
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from bench.common import http_request, install_fake_openai, percentile, setup_env
+
+HOST = "127.0.0.1"
+
+
+def _start_server(port: int):
+    import uvicorn
+
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host=HOST, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def _json(port: int, method: str, path: str, payload: dict | None = None, token: str | None = None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    body = json.dumps(payload).encode() if payload is not None else b""
+    status, raw, _, _ = await http_request(HOST, port, method, path, body, headers)
+    if status != 200:
+        raise RuntimeError(f"{method} {path} -> {status}: {raw[:200]!r}")
+    return json.loads(raw)
+
+
+async def run(port: int, streams: int, probe_interval: float):
+    token = (
+        await _json(port, "POST", "/auth/register", {"email": "load@example.com", "password": "bench-password"})
+    )["access_token"]
+
+    # One session per stream, and distinct prompts, so nothing coalesces
+    sessions = [
+        (await _json(port, "POST", "/sessions", {"title": f"load {i}"}, token))["id"]
+        for i in range(streams)
+    ]
+
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+    results = []
+    probes = []
+    done = asyncio.Event()
+
+    async def one_stream(i: int, session_id: str):
+        body = json.dumps({"session_id": session_id, "message": f"load test prompt {i}"}).encode()
+        results.append(await http_request(HOST, port, "POST", "/chat", body, headers))
+
+    async def probe():
+        while not done.is_set():
+            status, _, _, total = await http_request(HOST, port, "GET", "/sessions?limit=1", headers=headers)
+            probes.append((status, total))
+            await asyncio.sleep(probe_interval)
+
+    # Warm-up (tokenizer, caches) outside the measurement
+    await one_stream(-1, (await _json(port, "POST", "/sessions", {"title": "warm-up"}, token))["id"])
+    results.clear()
+
+    prober = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(one_stream(i, s) for i, s in enumerate(sessions)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await prober
+
+    ok = [r for r in results if r[0] == 200]
+    ttfb = [r[2] for r in ok]
+    totals = [r[3] for r in ok]
+    probe_times = [p[1] for p in probes if p[0] == 200]
+    print(f"streams:        {len(ok)}/{streams} completed in {elapsed:.2f}s")
+    print(f"stream ttfb:    p50 {percentile(ttfb, 0.5) * 1000:.0f} ms, p95 {percentile(ttfb, 0.95) * 1000:.0f} ms")
+    print(f"stream total:   p50 {percentile(totals, 0.5):.2f} s, max {max(totals, default=0):.2f} s")
+    print(
+        f"probe latency:  p50 {percentile(probe_times, 0.5) * 1000:.1f} ms, "
+        f"p95 {percentile(probe_times, 0.95) * 1000:.1f} ms, max {max(probe_times, default=0) * 1000:.1f} ms "
+        f"({len(probe_times)} probes)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=40, help="deltas per reply")
+    parser.add_argument("--delay", type=float, default=0.1, help="seconds between deltas")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--probe-interval", type=float, default=0.1)
+    args = parser.parse_args()
+
+    # Lift the per-user limits: this measures the worker, not the scheduler
+    setup_env(
+        "load-streams",
+        SCHEDULER_MAX_CONCURRENCY=str(args.streams * 2),
+        SCHEDULER_USER_CONCURRENCY=str(args.streams * 2),
+        USER_TOKEN_BUCKET_CAPACITY=str(10**9),
+        USER_TOKEN_REFILL_PER_SECOND=str(10**9),
+    )
+    server, thread = _start_server(args.port)
+    install_fake_openai(tokens=args.tokens, delay=args.delay)
+    try:
+        asyncio.run(run(args.port, args.streams, args.probe_interval))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Write throughput and reader latency per SQLITE_PROFILE.
+
+--writers threads each persist --replies replies (assistant message plus
+session touch, one transaction each) to one session while --readers
+threads page its history. The engine reads SQLITE_PROFILE at import, so
+every profile runs in a fresh subprocess.
+
+    cd backend && python -m bench.sqlite_profiles
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+
+from bench.common import percentile, setup_env
+
+PROFILES = ("default", "durable", "tuned")
+
+# Between a reader's page loads (a busy client, not a tight loop)
+READ_PAUSE_SECONDS = 0.01
+
+
+def run(profile: str, writers: int, readers: int, replies: int):
+    setup_env(f"profile-{profile}", SQLITE_PROFILE=profile)
+    import app.main  # noqa: F401  (creates the schema)
+    from app.db import crud
+    from app.db.database import SessionLocal
+
+    db = SessionLocal()
+    user_id = crud.create_new_user_id()
+    crud.ensure_user(db, user_id)
+    session_id = crud.create_session(db, user_id).id
+    db.close()
+
+    write_errors: list[str] = []
+    read_errors: list[str] = []
+    read_times: list[float] = []
+    writing = threading.Event()
+    writing.set()
+
+    def write():
+        db = SessionLocal()
+        try:
+            for i in range(replies):
+                try:
+                    with crud.unit_of_work(db):
+                        crud.add_message(db, user_id, session_id, "assistant", f"reply {i} " * 30)
+                        crud.touch_session(db, user_id, session_id)
+                except Exception as exc:
+                    write_errors.append(type(exc).__name__)
+        finally:
+            db.close()
+
+    def read():
+        db = SessionLocal()
+        try:
+            while writing.is_set():
+                started = time.perf_counter()
+                try:
+                    crud.list_messages(db, user_id, session_id, limit=50)
+                    db.rollback()  # end the read transaction
+                except Exception as exc:
+                    read_errors.append(type(exc).__name__)
+                read_times.append(time.perf_counter() - started)
+                time.sleep(READ_PAUSE_SECONDS)
+        finally:
+            db.close()
+
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=write) for _ in range(writers)]
+    started = time.perf_counter()
+    for t in reader_threads + writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    writing.clear()
+    for t in reader_threads:
+        t.join()
+
+    written = writers * replies - len(write_errors)
+    errors = write_errors + read_errors
+    print(
+        f"{profile:8} {written / elapsed:7.0f} replies/s  "
+        f"read p50 {percentile(read_times, 0.5) * 1000:6.2f} ms  "
+        f"p99 {percentile(read_times, 0.99) * 1000:7.2f} ms  "
+        f"failed writes {len(write_errors)}, reads {len(read_errors)}"
+        + (f" ({', '.join(sorted(set(errors)))})" if errors else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--profile", choices=PROFILES, help="run one profile in this process")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--replies", type=int, default=100, help="replies per writer")
+    args = parser.parse_args()
+
+    if args.profile:
+        run(args.profile, args.writers, args.readers, args.replies)
+        return
+
+    for profile in PROFILES:
+        subprocess.run(
+            [
+                sys.executable, "-m", "bench.sqlite_profiles",
+                "--profile", profile,
+                "--writers", str(args.writers),
+                "--readers", str(args.readers),
+                "--replies", str(args.replies),
+            ],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
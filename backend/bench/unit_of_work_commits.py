@@ -0,0 +1,78 @@
+"""
+Commits and time per persisted reply, with and without unit_of_work.
+
+Runs chat._persist_reply (everything a finished reply writes) --replies
+times. It does this once as shipped, with one transaction per reply,
+and once with crud.unit_of_work turned into a pass-through, so every
+crud call commits on its own as before. A 'commit' listener on the
+engine counts transactions.
+
+    cd backend && python -m bench.unit_of_work_commits --replies 500
+"""
+import argparse
+import contextlib
+import time
+
+from bench.common import setup_env
+
+
+def run(replies: int, batched: bool) -> tuple[float, float]:
+    from sqlalchemy import event
+
+    from app.api import chat
+    from app.db import crud
+    from app.db.database import SessionLocal, engine
+
+    commits = 0
+
+    def count_commit(_conn):
+        nonlocal commits
+        commits += 1
+
+    unit_of_work = crud.unit_of_work
+    if not batched:
+        crud.unit_of_work = lambda db: contextlib.nullcontext(db)
+
+    db = SessionLocal()
+    try:
+        user_id = crud.create_new_user_id()
+        crud.ensure_user(db, user_id)
+        session_id = crud.create_session(db, user_id).id
+
+        event.listen(engine, "commit", count_commit)
+        started = time.perf_counter()
+        for i in range(replies):
+            chat._persist_reply(
+                db,
+                user_id,
+                session_id,
+                "gpt-4o",
+                f"assistant reply {i} " * 20,
+                {"prompt_tokens": 200, "completion_tokens": 60},
+                title_if_new="bench",
+            )
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, "commit", count_commit)
+        crud.unit_of_work = unit_of_work
+        db.close()
+
+    return commits / replies, elapsed / replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--replies", type=int, default=500)
+    parser.add_argument("--profile", default="durable", help="SQLITE_PROFILE (commits cost an fsync)")
+    args = parser.parse_args()
+
+    setup_env("unit-of-work", SQLITE_PROFILE=args.profile)
+    import app.main  # noqa: F401  (creates the schema)
+
+    for label, batched in (("per-call commits", False), ("unit_of_work", True)):
+        per_reply, seconds = run(args.replies, batched)
+        print(f"{label:17} {per_reply:.2f} commits/reply, {seconds * 1000:.2f} ms/reply")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+# Settings and the engine are read at import, so point the app at a
+# throwaway database before anything under `app` is imported
+_workdir = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'chat.db')}"
+os.environ["BLOB_STORE_PATH"] = os.path.join(_workdir, "blobs")
+os.environ["USAGE_JOURNAL_PATH"] = os.path.join(_workdir, "usage_journal")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ["METRICS_TOKEN"] = "test-metrics-token"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeCompletions:
+    """
+    Stands in for client.chat.completions: streams `reply` back a word
+    at a time and records the messages of every call.
+    """
+
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.requests: list[list[dict]] = []
+
+    @property
+    def calls(self) -> int:
+        return len(self.requests)
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs["messages"])
+        return _FakeStream(self.reply.split(" "))
+
+
+class _FakeStream:
+    def __init__(self, words: list[str]):
+        self.words = words
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for i, word in enumerate(self.words):
+            await asyncio.sleep(0)
+            delta = types.SimpleNamespace(content=word if i == 0 else " " + word)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+        n = len(self.words)
+        usage = types.SimpleNamespace(prompt_tokens=20, completion_tokens=n, total_tokens=20 + n)
+        yield types.SimpleNamespace(choices=[], usage=usage)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_upstream(monkeypatch) -> FakeCompletions:
+    from app.services import openai_service
+
+    completions = FakeCompletions("Fake Upstream Reply")
+    monkeypatch.setattr(
+        openai_service,
+        "client",
+        types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions)),
+    )
+    return completions
@@ -0,0 +1,38 @@
+"""
+A session that fails to archive is counted and skipped; the rest of the
+pass still runs.
+"""
+import asyncio
+
+from app.services import archiver
+from app.services.archiver import MessageArchiver
+
+
+def test_failing_session_does_not_stop_pass(monkeypatch):
+    listings = [[("bad", "u1"), ("good", "u2")], []]
+    archived = []
+
+    def list_idle_sessions(idle_before):
+        return listings.pop(0)
+
+    def archive_batch(user_id, session_id, idle_before, batch_size):
+        if session_id == "bad":
+            raise RuntimeError("corrupt row")
+        archived.append(session_id)
+        return 3, 300, 100
+
+    async def reclaim_space():
+        pass
+
+    monkeypatch.setattr(archiver, "_list_idle_sessions", list_idle_sessions)
+    monkeypatch.setattr(archiver, "_archive_batch", archive_batch)
+    monkeypatch.setattr(archiver.session_purger, "reclaim_space", reclaim_space)
+
+    worker = MessageArchiver(enabled=True, after_days=30, interval=60, batch_size=10)
+    asyncio.run(worker.archive())
+
+    assert archived == ["good"]
+    assert worker.failures == 1
+    assert worker.sessions_archived == 1
+    assert worker.messages_archived == 3
+    assert worker.passes == 1
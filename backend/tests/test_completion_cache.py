@@ -0,0 +1,102 @@
+"""
+The completion cache is opt-in and text-only: with it enabled, resending
+a prompt (a retry after a disconnect, a duplicate tap) replays the reply
+without an upstream call; image turns always go upstream.
+"""
+import io
+
+import pytest
+from PIL import Image
+from starlette.testclient import TestClient
+
+from app.core.auth_utils import create_access_token
+from app.core.config import settings
+from app.db import crud
+from app.db.database import SessionLocal
+from app.main import app
+from app.services.image_pipeline import shutdown_pool
+from app.services.openai_service import completion_cache
+from app.services.usage_aggregator import usage_aggregator
+
+PROMPT = "What is a keyset cursor?"
+
+
+def _client(user_id: str) -> TestClient:
+    return TestClient(app, headers={"Authorization": f"Bearer {create_access_token(user_id)}"})
+
+
+def _new_session(user_id: str) -> str:
+    db = SessionLocal()
+    try:
+        crud.ensure_user(db, user_id)
+        return crud.create_session(db, user_id).id
+    finally:
+        db.close()
+
+
+def _chat(client, session_id: str, message: str = PROMPT) -> tuple[str, str]:
+    res = client.post("/chat", json={"session_id": session_id, "message": message})
+    assert res.status_code == 200
+    return res.text, res.headers["x-completion-cache"]
+
+
+@pytest.fixture
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(settings, "COMPLETION_CACHE_ENABLED", True)
+    completion_cache.clear()
+    yield
+    completion_cache.clear()
+
+
+def test_disabled_by_default(fake_upstream):
+    assert not settings.COMPLETION_CACHE_ENABLED
+    with _client("cache-off-user") as client:
+        session_id = _new_session("cache-off-user")
+        assert _chat(client, session_id) == ("Fake Upstream Reply", "miss")
+        assert _chat(client, session_id) == ("Fake Upstream Reply", "miss")
+    assert fake_upstream.calls == 2
+
+
+def test_retry_replays_cached_reply(fake_upstream, cache_enabled):
+    with _client("cache-user") as client:
+        session_id = _new_session("cache-user")
+        assert _chat(client, session_id) == ("Fake Upstream Reply", "miss")
+        used = usage_aggregator.pending("cache-user")
+
+        # The first attempt is history now; the retry still hits
+        assert _chat(client, session_id) == ("Fake Upstream Reply", "hit")
+        assert _chat(client, session_id) == ("Fake Upstream Reply", "hit")
+        assert fake_upstream.calls == 1
+        # A hit costs no upstream tokens
+        assert usage_aggregator.pending("cache-user") == used
+
+        assert _chat(client, session_id, "Something else entirely") == ("Fake Upstream Reply", "miss")
+        assert fake_upstream.calls == 2
+
+
+def test_scoped_per_user(fake_upstream, cache_enabled):
+    for user_id in ("cache-alice", "cache-bob"):
+        with _client(user_id) as client:
+            assert _chat(client, _new_session(user_id)) == ("Fake Upstream Reply", "miss")
+    assert fake_upstream.calls == 2
+
+
+def test_image_turns_bypass_cache(fake_upstream, cache_enabled):
+    out = io.BytesIO()
+    Image.new("RGB", (16, 16), "blue").save(out, "PNG")
+
+    with _client("cache-image-user") as client:
+        session_id = _new_session("cache-image-user")
+        for _ in range(2):
+            res = client.post(
+                "/chat/image",
+                data={"session_id": session_id, "text": PROMPT},
+                files={"image": ("blue.png", out.getvalue(), "image/png")},
+            )
+            assert res.status_code == 200
+            assert res.text == "Fake Upstream Reply"
+            assert "x-completion-cache" not in res.headers
+    shutdown_pool()
+
+    assert fake_upstream.calls == 2
+    assert len(completion_cache) == 0
@@ -0,0 +1,41 @@
+"""
+A worker that dies mid-resize breaks the process pool; the request gets
+a 503 and later uploads run on a fresh pool.
+"""
+import asyncio
+import io
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from PIL import Image
+
+from app.services import image_pipeline
+
+
+def _png() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (32, 32), "red").save(out, "PNG")
+    return out.getvalue()
+
+
+def test_broken_pool_is_replaced():
+    async def scenario():
+        pool = image_pipeline._get_pool()
+        # Kill a worker the way the OOM killer would
+        crash = pool.submit(os.abort)
+        with pytest.raises(BrokenProcessPool):
+            crash.result(timeout=30)
+
+        with pytest.raises(BrokenProcessPool):
+            await image_pipeline.normalize_image(_png(), "image/png")
+        assert image_pipeline._pool is None
+
+        normalized = await image_pipeline.normalize_image(_png(), "image/png")
+        assert (normalized.width, normalized.height) == (32, 32)
+        assert image_pipeline._pool is not pool
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        image_pipeline.shutdown_pool()
@@ -0,0 +1,43 @@
+"""
+Admission control on the password-hashing pool: when it is full,
+/auth/register and /auth/login answer 503 with Retry-After instead of
+queueing.
+"""
+import pytest
+from starlette.testclient import TestClient
+
+from app.core.auth_utils import hash_executor
+from app.main import app
+
+EMAIL = "hashing@example.com"
+PASSWORD = "correct horse"
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        res = client.post("/auth/register", json={"email": EMAIL, "password": PASSWORD})
+        assert res.status_code == 200, res.text
+        yield client
+
+
+@pytest.mark.parametrize(
+    "path, email",
+    [("/auth/login", EMAIL), ("/auth/register", "someone-new@example.com")],
+)
+def test_full_pool_returns_503(client, monkeypatch, path, email):
+    monkeypatch.setattr(hash_executor, "in_flight", hash_executor.capacity)
+    rejected = hash_executor.rejected
+
+    res = client.post(path, json={"email": email, "password": PASSWORD})
+
+    assert res.status_code == 503
+    assert res.headers["retry-after"] == str(hash_executor.retry_after)
+    assert hash_executor.rejected == rejected + 1
+
+
+def test_login_succeeds_once_pool_drains(client):
+    assert hash_executor.in_flight == 0
+    res = client.post("/auth/login", json={"email": EMAIL, "password": PASSWORD})
+    assert res.status_code == 200
+    assert res.json()["access_token"]
@@ -0,0 +1,100 @@
+"""
+EXPLAIN QUERY PLAN regression tests for the hot crud reads.
+
+Every SELECT a crud call issues is captured with its parameters and
+re-run under EXPLAIN QUERY PLAN. A full scan of chat_messages or
+chat_sessions, or a temp B-tree for ORDER BY, means a composite index
+stopped matching the query.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+import app.main  # noqa: F401  (creates the schema and indexes)
+from app.db import crud
+from app.db.database import SessionLocal, engine
+
+BAD_PLAN = re.compile(r"\bSCAN (chat_messages|chat_sessions)\b|USE TEMP B-TREE FOR ORDER BY")
+
+USER_ID = "plan-user"
+
+
+@pytest.fixture(scope="module")
+def session_id():
+    db = SessionLocal()
+    try:
+        crud.ensure_user(db, USER_ID)
+        crud.ensure_user(db, "other-user")
+        owners = (USER_ID, "other-user") * 3
+        sessions = [crud.create_session(db, owner).id for owner in owners]
+        for owner, sid in zip(owners, sessions):
+            for i in range(20):
+                crud.add_message(db, owner, sid, "user" if i % 2 == 0 else "assistant", f"message {i}")
+        # No ANALYZE: the app never runs it, so plans come from the schema alone
+        return sessions[0]
+    finally:
+        db.close()
+
+
+def _plans(call) -> list[tuple[str, list[str]]]:
+    """
+    Runs call(db) and returns (sql, plan details) for each SELECT it issued.
+    """
+    captured = []
+
+    def capture(_conn, _cursor, statement, parameters, _context, _executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            captured.append((statement, parameters))
+
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        call(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+        db.close()
+
+    assert captured, "the call issued no SELECT"
+    out = []
+    with engine.connect() as conn:
+        for statement, parameters in captured:
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            out.append((statement, [row[-1] for row in rows]))
+    return out
+
+
+def _cursor(db, sid):
+    latest = crud.list_messages(db, USER_ID, sid, limit=5)
+    return latest[0].created_at, latest[0].id
+
+
+HOT_READS = {
+    "list_sessions": lambda db, sid: crud.list_sessions(db, USER_ID, limit=3),
+    "list_sessions_before": lambda db, sid: crud.list_sessions(
+        db, USER_ID, limit=3, before=(datetime.now(timezone.utc).replace(tzinfo=None), "~")
+    ),
+    "get_sessions_fingerprint": lambda db, sid: crud.get_sessions_fingerprint(db, USER_ID),
+    "get_session": lambda db, sid: crud.get_session(db, USER_ID, sid),
+    "get_session_counters": lambda db, sid: crud.get_session_counters(db, USER_ID, sid),
+    "get_recent_messages": lambda db, sid: crud._query_recent_messages(db, USER_ID, sid, 10),
+    "list_messages_latest": lambda db, sid: crud.list_messages(db, USER_ID, sid, limit=5),
+    "list_messages_before": lambda db, sid: crud.list_messages(
+        db, USER_ID, sid, limit=5, before=_cursor(db, sid)
+    ),
+    "list_messages_after": lambda db, sid: crud.list_messages(
+        db, USER_ID, sid, limit=5, after=_cursor(db, sid)
+    ),
+    "get_message": lambda db, sid: crud.get_message(db, USER_ID, "missing-id"),
+    "get_summary": lambda db, sid: crud._query_summary(db, USER_ID, sid),
+    "list_tombstoned_sessions": lambda db, sid: crud.list_tombstoned_sessions(db),
+    "blob_referenced": lambda db, sid: crud.blob_referenced(db, "0" * 64),
+}
+
+
+@pytest.mark.parametrize("name", sorted(HOT_READS))
+def test_hot_read_uses_indexes(name, session_id):
+    for statement, details in _plans(lambda db: HOT_READS[name](db, session_id)):
+        bad = [d for d in details if BAD_PLAN.search(d)]
+        assert not bad, f"{name}: {bad}\n{statement}"
@@ -0,0 +1,55 @@
+"""
+Weighted fair queuing in UpstreamScheduler.slot: a user's earlier solo
+traffic must not push them behind everyone else once slots are contended.
+"""
+import asyncio
+
+from app.services.scheduler import UpstreamScheduler
+
+
+def _scheduler() -> UpstreamScheduler:
+    return UpstreamScheduler(
+        max_concurrency=1,
+        per_user_concurrency=1,
+        bucket_capacity=1000,
+        refill_per_second=1000,
+        weight_scale=100000,
+    )
+
+
+def test_solo_traffic_does_not_starve_user_later():
+    async def scenario() -> list[str]:
+        scheduler = _scheduler()
+        for _ in range(20):
+            async with scheduler.slot("alice", 100):
+                pass
+
+        order = []
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot("carol", 100):
+                order.append("carol")
+                await release.wait()
+
+        async def call(user_id: str):
+            async with scheduler.slot(user_id, 100):
+                order.append(user_id)
+                await asyncio.sleep(0)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        calls = [asyncio.create_task(call(u)) for _ in range(5) for u in ("alice", "bob")]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *calls)
+        return order
+
+    order = asyncio.run(scenario())
+
+    assert order[0] == "carol"
+    granted = order[1:]
+    assert sorted(granted) == ["alice"] * 5 + ["bob"] * 5
+    # Both users are served from the start, not one after the other
+    assert {"alice", "bob"} <= set(granted[:3])
+    assert max(granted[:6].count("alice"), granted[:6].count("bob")) <= 4
@@ -0,0 +1,95 @@
+"""
+Search rows are keyed on chat_messages.search_key, which survives
+archiving, rehydration and rowid reuse after purges.
+"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import app.main  # noqa: F401  (creates the schema and search index)
+from app.db import crud, migrate, models
+from app.db.database import SessionLocal, engine
+from app.db.migrate import SEARCH_TABLE
+
+USER_ID = "search-user"
+
+
+def _hits(term: str) -> list[str]:
+    db = SessionLocal()
+    try:
+        return sorted(row[0] for row in crud.search_messages(db, USER_ID, term, limit=100))
+    finally:
+        db.close()
+
+
+def _purge(db, session_id: str):
+    crud.delete_session(db, USER_ID, session_id)
+    while not crud.purge_session_batch(db, session_id, 100)[1]:
+        pass
+
+
+def _index_rows() -> int:
+    with engine.connect() as conn:
+        return conn.execute(
+            text(f"SELECT COUNT(*) FROM {SEARCH_TABLE} WHERE user_id = :user_id"),
+            {"user_id": USER_ID},
+        ).scalar()
+
+
+def test_search_keys_survive_archive_and_rowid_reuse():
+    # Everything counts as idle
+    idle_before = datetime.now(timezone.utc) + timedelta(days=1)
+    db = SessionLocal()
+    try:
+        crud.ensure_user(db, USER_ID)
+        old = crud.create_session(db, USER_ID).id
+        old_ids = [crud.add_message(db, USER_ID, old, "user", f"zebra old {i}").id for i in range(6)]
+        live = crud.create_session(db, USER_ID).id
+        for i in range(4):
+            crud.add_message(db, USER_ID, live, "user", f"zebra live {i}")
+
+        while crud.archive_session_batch(db, USER_ID, old, idle_before, 4)[0]:
+            pass
+        assert _hits("zebra old") == sorted(old_ids)
+
+        # Frees the newest rowids, which the next inserts take again
+        _purge(db, live)
+        new = crud.create_session(db, USER_ID).id
+        new_ids = [crud.add_message(db, USER_ID, new, "user", f"zebra new {i}").id for i in range(4)]
+        while crud.archive_session_batch(db, USER_ID, new, idle_before, 4)[0]:
+            pass
+        assert _hits("zebra") == sorted(old_ids + new_ids)
+        assert _index_rows() == 10
+
+        assert crud.rehydrate_session(db, USER_ID, old) == 6
+        assert crud.rehydrate_session(db, USER_ID, new) == 4
+        assert _hits("zebra") == sorted(old_ids + new_ids)
+        assert _index_rows() == 10
+
+        migrate.rebuild_search_index(engine)
+        assert _hits("zebra") == sorted(old_ids + new_ids)
+
+        _purge(db, old)
+        _purge(db, new)
+        assert _hits("zebra") == []
+        assert _index_rows() == 0
+    finally:
+        db.close()
+
+
+def test_search_key_column_added_without_fts5(tmp_path, monkeypatch):
+    other = create_engine(f"sqlite:///{tmp_path / 'plain.db'}")
+    models.Base.metadata.create_all(bind=other)
+    with other.begin() as conn:
+        conn.execute(text("ALTER TABLE chat_messages DROP COLUMN search_key"))
+    monkeypatch.setattr(migrate, "fts5_available", lambda engine: False)
+
+    assert migrate.ensure_search_index(other) is False
+
+    db = sessionmaker(bind=other)()
+    try:
+        assert db.query(models.ChatMessage).all() == []
+    finally:
+        db.close()
+        other.dispose()
@@ -0,0 +1,82 @@
+"""
+Write-through session context cache: loads that race a write never
+install a stale or duplicated context.
+"""
+import pytest
+
+import app.main  # noqa: F401  (creates the schema)
+
+from app.db import crud
+from app.db.database import SessionLocal
+from app.db.session_cache import session_cache
+
+USER_ID = "context-user"
+
+
+@pytest.fixture
+def session_id():
+    assert session_cache.enabled
+    db = SessionLocal()
+    try:
+        crud.ensure_user(db, USER_ID)
+        session_id = crud.create_session(db, USER_ID).id
+        crud.add_message(db, USER_ID, session_id, "user", "first")
+    finally:
+        db.close()
+    session_cache.invalidate(USER_ID, session_id)
+    return session_id
+
+
+def _cached_contents(session_id: str) -> list[str]:
+    ctx = session_cache.get(USER_ID, session_id)
+    assert ctx is not None
+    return [m.content for m in ctx.messages]
+
+
+def test_load_does_not_reuse_an_older_snapshot(session_id):
+    reader = SessionLocal()
+    writer = SessionLocal()
+    try:
+        # The request read before the write; a driver that keeps that read
+        # snapshot open must not have it serve the load
+        assert crud.get_summary(reader, USER_ID, session_id) == ""
+        crud.add_message(writer, USER_ID, session_id, "assistant", "second")
+
+        recent = crud.get_recent_messages(reader, USER_ID, session_id, limit=10)
+        assert [m.content for m in recent] == ["first", "second"]
+        assert _cached_contents(session_id) == ["first", "second"]
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_late_write_through_does_not_duplicate(session_id, monkeypatch):
+    deferred = []
+    db = SessionLocal()
+    try:
+        # Commit now, but hold back the write-through until after a load
+        with monkeypatch.context() as mp:
+            mp.setattr(session_cache, "append_message", lambda *args: deferred.append(args))
+            crud.add_message(db, USER_ID, session_id, "assistant", "second")
+
+        crud.get_recent_messages(db, USER_ID, session_id, limit=10)
+        session_cache.append_message(*deferred[0])
+
+        assert _cached_contents(session_id) == ["first", "second"]
+    finally:
+        db.close()
+
+
+def test_load_racing_a_write_is_discarded(session_id):
+    generation = session_cache.begin_load(USER_ID, session_id)
+    try:
+        db = SessionLocal()
+        try:
+            crud.add_message(db, USER_ID, session_id, "assistant", "second")
+        finally:
+            db.close()
+        session_cache.install(USER_ID, session_id, "", [], generation)
+    finally:
+        session_cache.end_load(USER_ID, session_id)
+
+    assert session_cache.get(USER_ID, session_id) is None
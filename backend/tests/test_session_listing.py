@@ -0,0 +1,82 @@
+"""
+GET /sessions: the (updated_at, id) keyset cursor walks every session
+exactly once even when updated_at ties, and an unchanged page is
+revalidated with a 304.
+"""
+import pytest
+from sqlalchemy import text
+from starlette.testclient import TestClient
+
+from app.core.auth_utils import create_access_token
+from app.db import crud
+from app.db.database import SessionLocal, engine
+from app.main import app
+
+USER_ID = "listing-user"
+
+
+@pytest.fixture(scope="module")
+def session_ids():
+    db = SessionLocal()
+    try:
+        crud.ensure_user(db, USER_ID)
+        ids = [crud.create_session(db, USER_ID, f"chat {i}").id for i in range(9)]
+    finally:
+        db.close()
+    # Six sessions share one updated_at, so pages split inside the tie
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "UPDATE chat_sessions SET updated_at = "
+                "(SELECT updated_at FROM chat_sessions WHERE id = :first) "
+                "WHERE id IN (:a, :b, :c, :d, :e)"
+            ),
+            dict(zip(["first", "a", "b", "c", "d", "e"], ids[:6])),
+        )
+    return ids
+
+
+@pytest.fixture
+def client():
+    headers = {"Authorization": f"Bearer {create_access_token(USER_ID)}"}
+    with TestClient(app, headers=headers) as client:
+        yield client
+
+
+def _walk(client, limit: int) -> list[str]:
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": limit, **({"before": cursor} if cursor else {})}
+        res = client.get("/sessions", params=params)
+        assert res.status_code == 200
+        seen += [s["id"] for s in res.json()]
+        cursor = res.headers.get("x-next-cursor")
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize("limit", [1, 2, 4, 200])
+def test_cursor_never_repeats_or_skips_on_ties(client, session_ids, limit):
+    seen = _walk(client, limit)
+    assert len(seen) == len(set(seen))
+    assert sorted(seen) == sorted(session_ids)
+    assert seen == _walk(client, 200)
+
+
+def test_unchanged_page_is_not_modified(client, session_ids):
+    first = client.get("/sessions", params={"limit": 4})
+    etag = first.headers["etag"]
+
+    again = client.get("/sessions", params={"limit": 4}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+
+    db = SessionLocal()
+    try:
+        crud.create_session(db, USER_ID, "new chat")
+    finally:
+        db.close()
+    changed = client.get("/sessions", params={"limit": 4}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
@@ -0,0 +1,119 @@
+"""
+Single-flight sharing stays within one user: followers never ride on
+another user's upstream call, bucket or usage.
+"""
+import asyncio
+import types
+
+import pytest
+from starlette.testclient import TestClient
+
+from app.main import app
+from app.services import openai_service
+from app.services.scheduler import RateLimitedError, UpstreamScheduler
+
+MESSAGES = [{"role": "user", "content": "the same prompt"}]
+
+
+class _FakeStream:
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            delta = types.SimpleNamespace(content="tok ")
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+        usage = types.SimpleNamespace(prompt_tokens=20, completion_tokens=5, total_tokens=25)
+        yield types.SimpleNamespace(choices=[], usage=usage)
+
+    async def close(self):
+        pass
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        return _FakeStream()
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    # Room for one request per bucket
+    scheduler = UpstreamScheduler(
+        max_concurrency=8,
+        per_user_concurrency=8,
+        bucket_capacity=1000,
+        refill_per_second=0.001,
+        weight_scale=100000,
+    )
+    monkeypatch.setattr(openai_service, "upstream_scheduler", scheduler)
+    return scheduler
+
+
+@pytest.fixture
+def upstream(monkeypatch, scheduler):
+    completions = _FakeCompletions()
+    monkeypatch.setattr(
+        openai_service,
+        "client",
+        types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions)),
+    )
+    return completions
+
+
+async def _consume(user_id: str) -> int:
+    reply = await openai_service.stream_completion(MESSAGES, user_id=user_id)
+    async for _ in reply:
+        pass
+    return reply.usage["total_tokens"]
+
+
+def test_same_user_shares_one_call(upstream):
+    async def main():
+        first = asyncio.create_task(_consume("alice"))
+        await asyncio.sleep(0)
+        # alice's bucket is spent; her duplicate joins the running call
+        return await asyncio.gather(first, _consume("alice"))
+
+    assert sorted(asyncio.run(main())) == [0, 25]
+    assert upstream.calls == 1
+
+
+def test_other_users_never_join(upstream):
+    async def main():
+        first = asyncio.create_task(_consume("alice"))
+        await asyncio.sleep(0)
+        return await asyncio.gather(first, _consume("bob"))
+
+    # Each pays for, and is billed for, their own call
+    assert asyncio.run(main()) == [25, 25]
+    assert upstream.calls == 2
+
+
+def test_follower_cannot_bypass_own_bucket(upstream, scheduler):
+    async def main():
+        await scheduler.reserve("bob", 1000)  # empties bob's bucket
+        running = asyncio.create_task(_consume("alice"))
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(RateLimitedError):
+                await _consume("bob")
+        finally:
+            await running
+
+    asyncio.run(main())
+
+
+def test_scheduler_metrics_require_token():
+    with TestClient(app) as client:
+        assert client.get("/metrics/scheduler").status_code == 401
+        assert client.get(
+            "/metrics/scheduler", headers={"Authorization": "Bearer wrong"}
+        ).status_code == 401
+        assert client.get(
+            "/metrics/scheduler", headers={"Authorization": "Bearer test-metrics-token"}
+        ).status_code == 200
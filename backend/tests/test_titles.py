@@ -0,0 +1,65 @@
+"""
+/chat/title: a model-generated title is cached by normalized prompt, so
+the same opener later is answered without an upstream call; trivial
+openers never reach the model.
+"""
+import pytest
+from starlette.testclient import TestClient
+
+from app.core.auth_utils import create_access_token
+from app.db import crud
+from app.db.database import SessionLocal
+from app.main import app
+
+USER_ID = "title-user"
+
+PROMPT = "How do I tune SQLite for many concurrent readers and one writer?"
+
+
+@pytest.fixture
+def client():
+    headers = {"Authorization": f"Bearer {create_access_token(USER_ID)}"}
+    with TestClient(app, headers=headers) as client:
+        yield client
+
+
+def _new_session() -> str:
+    db = SessionLocal()
+    try:
+        crud.ensure_user(db, USER_ID)
+        return crud.create_session(db, USER_ID).id
+    finally:
+        db.close()
+
+
+def _title(client, prompt: str) -> tuple[str, str, str]:
+    """
+    Returns (streamed title, X-Title-Source, title saved on the session).
+    """
+    session_id = _new_session()
+    res = client.post("/chat/title", json={"session_id": session_id, "prompt": prompt})
+    assert res.status_code == 200
+    db = SessionLocal()
+    try:
+        saved = crud.get_session(db, USER_ID, session_id).title
+    finally:
+        db.close()
+    return res.text, res.headers["x-title-source"], saved
+
+
+def test_cache_hit_skips_upstream(client, fake_upstream):
+    fake_upstream.reply = "SQLite Concurrency Tuning"
+
+    assert _title(client, PROMPT) == ("SQLite Concurrency Tuning", "model", "SQLite Concurrency Tuning")
+    assert fake_upstream.calls == 1
+
+    # Same opener, different case, spacing and trailing punctuation
+    again = "  how do I tune sqlite for many concurrent   readers and one writer?!"
+    assert _title(client, again) == ("SQLite Concurrency Tuning", "cache", "SQLite Concurrency Tuning")
+    assert fake_upstream.calls == 1
+
+
+def test_small_talk_is_titled_locally(client, fake_upstream):
+    assert _title(client, "hi there!") == ("Casual Chat", "local", "Casual Chat")
+    assert _title(client, "hey, docker networking") == ("Docker Networking", "local", "Docker Networking")
+    assert fake_upstream.calls == 0
@@ -0,0 +1,59 @@
+"""
+Journal recovery: a batch left on disk by a crash is applied exactly
+once, whether or not its flush committed before the crash.
+"""
+import os
+
+import app.main  # noqa: F401  (creates the schema)
+from app.db import crud
+from app.db.database import SessionLocal
+from app.services.usage_aggregator import UsageAggregator
+
+
+def _lifetime(user_id: str) -> dict[str, int]:
+    db = SessionLocal()
+    try:
+        return crud.get_token_usage(db, user_id)
+    finally:
+        db.close()
+
+
+def _crash(journal_dir: str, user_id: str):
+    """
+    Records usage and dies before flushing: the journal stays on disk.
+    Returns the abandoned batch.
+    """
+    aggregator = UsageAggregator(journal_dir=journal_dir, interval=60)
+    aggregator.add(user_id, "gpt-4o-mini", 10, 5)
+    aggregator.add(user_id, "gpt-4o-mini", 1, 1)
+    batch = aggregator._current
+    batch.close()
+    return batch
+
+
+def test_unflushed_journal_is_replayed_once(tmp_path):
+    _crash(str(tmp_path), "replay-user")
+
+    restarted = UsageAggregator(journal_dir=str(tmp_path), interval=60)
+    assert restarted.recover() == 1
+    assert _lifetime("replay-user") == {"gpt-4o-mini": 17}
+    assert os.listdir(tmp_path) == []
+
+    assert restarted.recover() == 0
+    assert _lifetime("replay-user") == {"gpt-4o-mini": 17}
+
+
+def test_committed_batch_is_not_replayed(tmp_path):
+    batch = _crash(str(tmp_path), "flushed-user")
+    # The flush committed, then the process died before deleting the journal
+    db = SessionLocal()
+    try:
+        assert crud.apply_token_usage_batch(db, batch.batch_id, batch.deltas)
+    finally:
+        db.close()
+    assert os.path.exists(batch.path)
+
+    restarted = UsageAggregator(journal_dir=str(tmp_path), interval=60)
+    assert restarted.recover() == 0
+    assert _lifetime("flushed-user") == {"gpt-4o-mini": 17}
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,123 @@
+"""
+/me/tokens range queries: bucket totals read from the hourly and daily
+rollups (plus unflushed deltas) match the sums of the recorded calls,
+including across hour and day boundaries and after compaction.
+"""
+from datetime import datetime, timezone
+
+import pytest
+from starlette.testclient import TestClient
+
+from app.core.auth_utils import create_access_token
+from app.db import crud
+from app.db.database import SessionLocal
+from app.main import app
+from app.services import usage_aggregator as aggregator_module
+from app.services.usage_aggregator import usage_aggregator
+
+USER_ID = "rollup-user"
+
+
+def _ts(day: int, hour: int, minute: int, second: int = 0) -> int:
+    return int(datetime(2026, 3, day, hour, minute, second, tzinfo=timezone.utc).timestamp())
+
+
+# (unix time, model, prompt, completion): one per recorded call, straddling
+# the 23:00 -> 00:00 hour and day boundary
+FLUSHED = [
+    (_ts(1, 22, 15), "gpt-4o-mini", 100, 20),
+    (_ts(1, 22, 59, 59), "gpt-4o", 40, 10),
+    (_ts(1, 23, 0), "gpt-4o-mini", 7, 3),
+    (_ts(1, 23, 59, 59), "gpt-4o-mini", 50, 50),
+    (_ts(2, 0, 0), "gpt-4o", 11, 9),
+    (_ts(2, 0, 30), "gpt-4o-mini", 5, 5),
+    (_ts(2, 13, 5), "gpt-4o-mini", 60, 40),
+]
+# Still buffered in the aggregator when the request comes in
+PENDING = [
+    (_ts(1, 23, 0), "gpt-4o", 2, 2),
+    (_ts(2, 0, 0), "gpt-4o-mini", 1, 1),
+]
+
+
+def _expected(width: int, start: int, end: int) -> dict[str, int]:
+    sums: dict[str, int] = {}
+    for ts, _model, prompt, completion in FLUSHED + PENDING:
+        if start <= ts < end:
+            bucket = datetime.fromtimestamp(ts - ts % width, tz=timezone.utc).isoformat()
+            sums[bucket] = sums.get(bucket, 0) + prompt + completion
+    return sums
+
+
+@pytest.fixture(scope="module")
+def client():
+    db = SessionLocal()
+    try:
+        crud.ensure_user(db, USER_ID)
+        # One flush per call, as if each landed in a different batch
+        for i, (ts, model, prompt, completion) in enumerate(FLUSHED):
+            crud.apply_token_usage_batch(db, f"rollup-{i}", {(USER_ID, model, ts): (prompt, completion)})
+    finally:
+        db.close()
+
+    with pytest.MonkeyPatch.context() as mp:
+        for ts, model, prompt, completion in PENDING:
+            mp.setattr(aggregator_module, "_current_hour", lambda ts=ts: ts - ts % 3600)
+            usage_aggregator.add(USER_ID, model, prompt, completion)
+
+    headers = {"Authorization": f"Bearer {create_access_token(USER_ID)}"}
+    with TestClient(app, headers=headers) as client:
+        yield client
+    usage_aggregator.flush()
+
+
+def _range(client, start: int, end: int, granularity: str) -> dict:
+    res = client.get(
+        "/me/tokens",
+        params={
+            "from": datetime.fromtimestamp(start, tz=timezone.utc).isoformat(),
+            "to": datetime.fromtimestamp(end, tz=timezone.utc).isoformat(),
+            "granularity": granularity,
+        },
+    )
+    assert res.status_code == 200, res.text
+    return res.json()
+
+
+@pytest.mark.parametrize(
+    "start, end, granularity, width",
+    [
+        (_ts(1, 22, 0), _ts(2, 2, 0), "hour", 3600),
+        # Edges are exclusive at the end: 00:00 belongs to the next bucket
+        (_ts(1, 23, 0), _ts(2, 0, 0), "hour", 3600),
+        (_ts(1, 0, 0), _ts(3, 0, 0), "day", 86400),
+        (_ts(2, 0, 0), _ts(3, 0, 0), "day", 86400),
+    ],
+)
+def test_range_matches_per_call_sums(client, start, end, granularity, width):
+    body = _range(client, start, end, granularity)
+
+    expected = _expected(width, start, end)
+    assert {b["start"]: b["total"] for b in body["buckets"]} == expected
+    assert body["total"] == sum(expected.values())
+    for bucket in body["buckets"]:
+        assert sum(bucket["by_model"].values()) == bucket["total"]
+
+
+def test_lifetime_total_matches_per_call_sums(client):
+    body = client.get("/me/tokens").json()
+    assert body["total"] == sum(p + c for _, _, p, c in FLUSHED + PENDING)
+
+
+def test_compaction_keeps_daily_totals(client):
+    before = _range(client, _ts(1, 0, 0), _ts(3, 0, 0), "day")
+
+    usage_aggregator.flush()
+    db = SessionLocal()
+    try:
+        assert crud.compact_token_usage(db, datetime.fromtimestamp(_ts(3, 0, 0), tz=timezone.utc)) > 0
+    finally:
+        db.close()
+
+    assert _range(client, _ts(1, 0, 0), _ts(3, 0, 0), "day") == before
+    assert _range(client, _ts(1, 22, 0), _ts(2, 2, 0), "hour")["buckets"] == []
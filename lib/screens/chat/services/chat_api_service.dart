@@ -28,8 +28,26 @@ class ChatApiService {
   // Sessions
   // -------------------------
   Future<List<ChatSession>> fetchSessions() async {
-    final res = await _jsonDio.get('/sessions', options: await _authOptions());
-    return (res.data as List).map((e) => ChatSession.fromJson(e)).toList();
+    final sessions = <ChatSession>[];
+    String? cursor;
+
+    // The list is paginated; follow X-Next-Cursor until the last page
+    do {
+      final res = await _jsonDio.get(
+        '/sessions',
+        queryParameters: {
+          'limit': 200,
+          if (cursor != null) 'before': cursor,
+        },
+        options: await _authOptions(),
+      );
+      sessions.addAll(
+        (res.data as List).map((e) => ChatSession.fromJson(e)),
+      );
+      cursor = res.headers.value('x-next-cursor');
+    } while (cursor != null);
+
+    return sessions;
   }
 
   Future<ChatSession> createSession() async {
@@ -42,11 +60,29 @@ class ChatApiService {
   }
 
   Future<List<ChatMessage>> fetchMessages(String sessionId) async {
-    final res = await _jsonDio.get(
-      '/sessions/$sessionId/messages',
-      options: await _authOptions(),
-    );
-    return (res.data as List).map((e) => ChatMessage.fromJson(e)).toList();
+    final messages = <ChatMessage>[];
+    String? cursor;
+
+    // History comes back newest page first; follow X-Prev-Cursor to the
+    // oldest page, prepending each one so the list stays oldest first
+    do {
+      final res = await _jsonDio.get(
+        '/sessions/$sessionId/messages',
+        queryParameters: {
+          'inline_images': true,
+          'limit': 500,
+          if (cursor != null) 'before': cursor,
+        },
+        options: await _authOptions(),
+      );
+      messages.insertAll(
+        0,
+        (res.data as List).map((e) => ChatMessage.fromJson(e)),
+      );
+      cursor = res.headers.value('x-prev-cursor');
+    } while (cursor != null);
+
+    return messages;
   }
 
   // -------------------------